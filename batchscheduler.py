@@ -0,0 +1,226 @@
+"""
+This module provides the scheduler that collects incoming packets into batches.
+
+Incoming packets are grouped per meta message and processed together once the batch window of that
+meta message expires, or once the batch grows beyond its maximum size.  The BatchScheduler appends
+packets to the pending batch of their meta message and uses a single Callback task per pending
+batch.  Pending batches are never unregistered from the Callback: a task that finds its batch
+already flushed or discarded simply does nothing.
+
+Meta messages with an adaptive BatchConfiguration get a BatchPolicy that chooses the window and size
+of their batches at runtime.
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+from time import time
+
+
+class _PendingBatch(object):
+
+    __slots__ = ["timestamp", "created", "packets"]
+
+    def __init__(self, timestamp):
+        self.timestamp = timestamp
+        self.created = time()
+        self.packets = []
+
+
+class BatchPolicy(object):
+
+    def __init__(self, batch):
+        """
+        Choose the window and size for the batches of one meta message, within the bounds of its
+        BatchConfiguration BATCH.
+        """
+        assert batch.adaptive
+        self._batch = batch
+        self._last_flush = time()
+        # the current window and size
+        self.window = batch.max_window
+        self.size = batch.max_size
+        # moving average of the arrival rate, in packets per second
+        self.rate = 0.0
+        # moving average of the processing time, in seconds per batch
+        self.duration = 0.0
+
+    def update(self, count, duration):
+        """
+        Update the window and size after a batch with COUNT packets took DURATION seconds to
+        process.
+        """
+        batch = self._batch
+        now = time()
+        rate = count / max(now - self._last_flush, 0.001)
+        self._last_flush = now
+        self.rate = 0.8 * self.rate + 0.2 * rate if self.rate else rate
+        self.duration = 0.8 * self.duration + 0.2 * duration if self.duration else duration
+
+        # under light load waiting does not result in larger batches, it only adds latency.  under
+        # heavy load a longer window results in fewer, larger, batches
+        if self.rate * batch.max_window < 2.0:
+            self.window = max(batch.min_window, self.window / 2.0)
+        else:
+            self.window = min(batch.max_window, self.window * 2.0)
+
+        # processing a batch should not take longer than collecting it, otherwise the callback
+        # thread is occupied for too long.  grow the size while full batches are processed on time
+        if self.duration > batch.max_window:
+            self.size = max(batch.min_size, self.size // 2)
+        elif count >= self.size:
+            self.size = min(batch.max_size, self.size * 2)
+
+
+class BatchScheduler(object):
+
+    def __init__(self, callback, func):
+        """
+        Create a scheduler that calls FUNC(META, TIMESTAMP, BATCH) on the CALLBACK thread for every
+        batch that is ready to be processed.
+        """
+        assert callable(func), func
+        self._callback = callback
+        self._func = func
+        # META:_PendingBatch pairs
+        self._pending = {}
+        # META:BatchPolicy pairs, only for meta messages with an adaptive BatchConfiguration
+        self._policies = {}
+        # nr of packets that are waiting to be processed
+        self._depth = 0
+        self.reset_statistics()
+
+    def __contains__(self, meta):
+        return meta in self._pending
+
+    def __iter__(self):
+        return iter(self._pending.keys())
+
+    def __len__(self):
+        return len(self._pending)
+
+    @property
+    def depth(self):
+        """
+        The number of packets that are waiting to be processed.
+        """
+        return self._depth
+
+    @property
+    def flush_count(self):
+        """
+        The number of batches that have been processed.
+        """
+        return self._flush_count
+
+    @property
+    def flush_latency(self):
+        """
+        The sum of the time, in seconds, between the creation of each batch and its processing.
+        """
+        return self._flush_latency
+
+    @property
+    def flush_latency_max(self):
+        """
+        The longest time, in seconds, between the creation of a batch and its processing.
+        """
+        return self._flush_latency_max
+
+    def get_policy(self, meta):
+        """
+        Returns the BatchPolicy for META, or None when META does not use adaptive batching.
+        """
+        if meta.batch.adaptive:
+            policy = self._policies.get(meta)
+            if policy is None:
+                policy = self._policies[meta] = BatchPolicy(meta.batch)
+            return policy
+        return None
+
+    def reset_statistics(self):
+        self._flush_count = 0
+        self._flush_latency = 0.0
+        self._flush_latency_max = 0.0
+
+    def add(self, meta, timestamp, batch):
+        """
+        Add BATCH, a list of packets for META received at TIMESTAMP, to the pending batch of META.
+
+        The pending batch is processed after meta.batch.max_window seconds.  When it grows beyond
+        meta.batch.max_size packets, the first max_size packets are processed immediately.  Both are
+        chosen by the BatchPolicy when META uses adaptive batching.
+        """
+        assert isinstance(timestamp, float), type(timestamp)
+        assert isinstance(batch, list), type(batch)
+        policy = self.get_policy(meta)
+        pending = self._pending.get(meta)
+        if pending is None:
+            window = policy.window if policy else meta.batch.max_window
+            pending = self._pending[meta] = _PendingBatch(timestamp)
+            self._callback.register(self._on_timeout, (meta, pending), delay=window, priority=meta.batch.priority)
+            logger.debug("new batch with %d %s messages (batch window: %f)", len(batch), meta.name, window)
+        else:
+            logger.debug("adding %d %s messages to existing batch", len(batch), meta.name)
+
+        pending.packets.extend(batch)
+        self._depth += len(batch)
+
+        max_size = policy.size if policy else meta.batch.max_size
+        while len(pending.packets) > max_size:
+            # batch exceeds maximum size, schedule first max_size immediately
+            logger.debug("schedule processing %d %s messages immediately (exceeded batch size)", max_size, meta.name)
+            self._callback.register(self._flush, (meta, pending.timestamp, pending.created, pending.packets[:max_size]), priority=meta.batch.priority)
+            del pending.packets[:max_size]
+            pending.timestamp = timestamp
+
+    def flush(self, meta):
+        """
+        Process the pending batch of META immediately.
+        """
+        pending = self._pending.pop(meta, None)
+        if pending:
+            return self._flush(meta, pending.timestamp, pending.created, pending.packets)
+
+    def discard(self, meta):
+        """
+        Remove the pending batch of META, and its BatchPolicy, without processing it.
+
+        Returns the number of packets that were removed.
+        """
+        self._policies.pop(meta, None)
+        pending = self._pending.pop(meta, None)
+        if pending:
+            self._depth -= len(pending.packets)
+            return len(pending.packets)
+        return 0
+
+    def clear(self):
+        """
+        Remove all pending batches, and all BatchPolicy instances, without processing them.
+        """
+        self._pending.clear()
+        self._policies.clear()
+        self._depth = 0
+
+    def _on_timeout(self, meta, pending):
+        # only process PENDING when it has not been flushed or discarded yet
+        if self._pending.get(meta) is pending:
+            del self._pending[meta]
+            return self._flush(meta, pending.timestamp, pending.created, pending.packets)
+
+    def _flush(self, meta, timestamp, created, packets):
+        latency = time() - created
+        self._depth = max(0, self._depth - len(packets))
+        self._flush_count += 1
+        self._flush_latency += latency
+        self._flush_latency_max = max(self._flush_latency_max, latency)
+
+        policy = self.get_policy(meta)
+        if policy:
+            start = time()
+            result = self._func(meta, timestamp, packets)
+            policy.update(len(packets), time() - start)
+            return result
+
+        return self._func(meta, timestamp, packets)
@@ -26,9 +26,23 @@ import logging
 logger = logging.getLogger(__name__)
 
 from hashlib import sha1, sha256, sha384, sha512, md5
+from itertools import islice, izip
 from math import ceil, log
 from struct import Struct
-from binascii import hexlify, unhexlify
+from binascii import hexlify
+
+try:
+    # numpy is optional, when available batches of keys are tested using vectorized operations
+    import numpy
+except ImportError:
+    numpy = None
+
+# number of bits set for every possible byte value, used to count the bits in the filter
+_POPCOUNT = tuple(bin(byte).count("1") for byte in xrange(256))
+
+# number of keys that not_filter hashes and tests at once when numpy is available.  kept small
+# because callers typically stop consuming once they have collected enough packets
+_NOT_FILTER_BATCH_SIZE = 128
 
 
 class BloomFilter(object):
@@ -47,7 +61,7 @@ class BloomFilter(object):
 
       Will create a BloomFilter instance that is m_size bits large with approximately f_error_rate chance for false
       positives.  Typically this is used to create a bloom filter where the size it can occupy is limited or fixed.
-      Note that m_size must be a multiple of 8.
+      Note that m_size must be a multiple of 8, otherwise ValueError is raised.
 
     - BloomFilter(float:f_error_rate, int:n_capacity, str:prefix="")
 
@@ -64,6 +78,11 @@ class BloomFilter(object):
       storage = (original.bytes, original.functions, original.prefix)
       # storage can be written to disk, socket, etc
       clone = BloomFilter(storage[0], storage[1], storage[2])
+
+    Each combination also accepts the keyword argument double_hashing=False.  When True, all k positions are derived
+    from a single md5 digest using the double hashing scheme from Kirsch and Mitzenmacher, "Less Hashing, Same
+    Performance: Building a Better Bloom Filter", instead of taking k chunks from a digest that may need to be as large
+    as sha512.  Both sides must use the same scheme, hence it must be stored or transmitted along with the bytes.
     """
 
     @staticmethod
@@ -84,7 +103,7 @@ class BloomFilter(object):
             prefix = kargs.get("prefix", args[2] if len(args) >= 3 else "")
             assert 0 < len(bytes_), len(bytes_)
             logger.debug("bloom filter based on %d bytes and k_functions %d", len(bytes_), k_functions)
-            filter_ = long(hexlify(bytes_[::-1]), 16)
+            filter_ = bytearray(bytes_)
 
         # matches: BloomFilter(int:m_size, float:f_error_rate, str:prefix="")
         elif len(args) >= 2 and isinstance(args[0], int) and isinstance(args[1], float):
@@ -92,11 +111,13 @@ class BloomFilter(object):
             f_error_rate = args[1]
             prefix = kargs.get("prefix", args[2] if len(args) >= 3 else "")
             assert 0 < m_size, m_size
-            assert m_size % 8 == 0, "size must be a multiple of eight (%d)" % m_size
             assert 0.0 < f_error_rate < 1.0, f_error_rate
+            if m_size % 8:
+                # the bits are stored, and sent, in whole bytes
+                raise ValueError("size must be a multiple of eight (%d)" % m_size)
             logger.debug("constructing bloom filter based on m_size %d bits and f_error_rate %f", m_size, f_error_rate)
             k_functions = cls._get_k_functions(m_size, cls._get_n_capacity(m_size, f_error_rate))
-            filter_ = 0
+            filter_ = bytearray(m_size / 8)
 
         # matches: BloomFilter(float:f_error_rate, int:n_capacity, str:prefix="")
         elif len(args) >= 2 and isinstance(args[0], float) and isinstance(args[1], int):
@@ -109,7 +130,7 @@ class BloomFilter(object):
                          n_capacity)
             m_size = int(ceil(abs((n_capacity * log(f_error_rate)) / (log(2) ** 2)) / 8.0) * 8)
             k_functions = cls._get_k_functions(m_size, n_capacity)
-            filter_ = 0
+            filter_ = bytearray(m_size / 8)
 
         else:
             raise RuntimeError("Unknown combination of argument types %s" % str([type(arg) for arg in args]))
@@ -119,6 +140,7 @@ class BloomFilter(object):
     def __init__(self, *args, **kargs):
         # get constructor arguments required to build the bloom filter
         self._m_size, self._k_functions, self._prefix, self._filter = self._overload_constructor_arguments(args, kargs)
+        self._double_hashing = kargs.get("double_hashing", False)
 
         assert isinstance(self._m_size, int), type(self._m_size)
         assert 0 < self._m_size, self._m_size
@@ -127,14 +149,17 @@ class BloomFilter(object):
         assert 0 < self._k_functions <= self._m_size, [self._k_functions, self._m_size]
         assert isinstance(self._prefix, str), type(self._prefix)
         assert 0 <= len(self._prefix) < 256, len(self._prefix)
-        assert isinstance(self._filter, (int, long)), type(self._filter)
+        assert isinstance(self._filter, bytearray), type(self._filter)
+        assert len(self._filter) * 8 == self._m_size, [len(self._filter), self._m_size]
+        assert isinstance(self._double_hashing, bool), type(self._double_hashing)
 
         if __debug__:
             hypothetical_error_rates = [0.4, 0.3, 0.2, 0.1, 0.01, 0.001, 0.0001]
             logger.debug("m size:      %d    ~%d bytes", self._m_size, self._m_size / 8)
             logger.debug("k functions: %d", self._k_functions)
             logger.debug("prefix:      %s", self._prefix.encode("HEX"))
-            logger.debug("filter:      %s", self._filter)
+            logger.debug("hashing:     %s", "double" if self._double_hashing else "classic")
+            logger.debug("filter:      %s", hexlify(self._filter))
             logger.debug("hypothetical error rate: %s", " | ".join("%.4f" % hypothetical_error_rate
                                                                    for hypothetical_error_rate
                                                                    in hypothetical_error_rates))
@@ -142,6 +167,32 @@ class BloomFilter(object):
                                                                    for hypothetical_error_rate
                                                                    in hypothetical_error_rates))
 
+        if self._double_hashing:
+            self._init_double_hashing()
+        else:
+            self._init_classic_hashing()
+
+    def _init_double_hashing(self):
+        # position i is (a + i * b + (i**3 - i) / 6) % m_size, where a and b are the two 64 bit halves of an md5
+        # digest.  the cubic term (enhanced double hashing, Dillinger and Manolios) avoids the short cycles that
+        # occur when b and m_size share a factor.  a and b are reduced modulo m_size first, ensuring that the numpy
+        # path can not overflow and gives identical results
+        unpack = Struct(">QQ").unpack
+        m_size = self._m_size
+        offsets = [(i, ((i ** 3 - i) / 6) % m_size) for i in xrange(self._k_functions)]
+
+        def fmt_unpack(digest):
+            a, b = unpack(digest)
+            a %= m_size
+            b %= m_size
+            return [(a + i * b + offset) % m_size for i, offset in offsets]
+
+        self._fmt_unpack = fmt_unpack
+        self._double_hashing_offsets = [offset for _, offset in offsets]
+        self._dtype = ">u8"
+        self._salt = md5(self._prefix)
+
+    def _init_classic_hashing(self):
         # determine hash function
         if self._m_size >= (1 << 31):
             fmt_code, chunk_size = "Q", 8
@@ -169,6 +220,10 @@ class BloomFilter(object):
         self._fmt_unpack = Struct("".join((">",
                                            fmt_code * self._k_functions,
                                            "x" * (hashfn().digest_size - bits_required / 8)))).unpack
+        # numpy equivalent of _fmt_unpack, every digest contains digest_size / chunk_size positions
+        # of which the first k_functions are used
+        assert hashfn().digest_size % chunk_size == 0, [hashfn().digest_size, chunk_size]
+        self._dtype = ">u%d" % chunk_size
         self._salt = hashfn(self._prefix)
 
     def add(self, key):
@@ -176,16 +231,24 @@ class BloomFilter(object):
         Add KEY to the BloomFilter.
         """
         filter_ = self._filter
+        m_size = self._m_size
         hash_ = self._salt.copy()
         hash_.update(key)
         for pos in self._fmt_unpack(hash_.digest()):
-            filter_ |= 1 << (pos % self._m_size)
-        self._filter = filter_
+            pos %= m_size
+            filter_[pos >> 3] |= 1 << (pos & 7)
 
     def add_keys(self, keys):
         """
         Add a sequence of KEYS to the BloomFilter.
         """
+        if numpy is not None:
+            positions = self.get_positions(keys).ravel()
+            # the array shares its memory with the bytearray, hence the bits are set in place
+            array = numpy.frombuffer(self._filter, dtype=numpy.uint8)
+            numpy.bitwise_or.at(array, positions >> 3, numpy.left_shift(1, positions & 7).astype(numpy.uint8))
+            return
+
         filter_ = self._filter
         salt_copy = self._salt.copy
         m_size = self._m_size
@@ -200,15 +263,14 @@ class BloomFilter(object):
             # while generators are more memory efficient, this list will be relatively short.
             # 07/05/12 Niels: using no list at all is even more efficient/faster
             for pos in fmt_unpack(hash_.digest()):
-                filter_ |= 1 << (pos % m_size)
-
-        self._filter = filter_
+                pos %= m_size
+                filter_[pos >> 3] |= 1 << (pos & 7)
 
     def clear(self):
         """
         Set all bits in the filter to zero.
         """
-        self._filter = 0
+        self._filter[:] = bytearray(len(self._filter))
 
     def __contains__(self, key):
         filter_ = self._filter
@@ -218,15 +280,79 @@ class BloomFilter(object):
         hash_.update(key)
 
         for pos in self._fmt_unpack(hash_.digest()):
-            if not filter_ & (1 << (pos % m_size_)):
+            pos %= m_size_
+            if not filter_[pos >> 3] & (1 << (pos & 7)):
                 return False
         return True
 
+    def get_positions(self, keys):
+        """
+        Returns the bit positions for every key in KEYS.
+
+        When numpy is available a (len(KEYS), k_functions) numpy array is returned, otherwise a list
+        with a tuple of k_functions positions for every key is returned.
+        """
+        salt_copy = self._salt.copy
+        digests = []
+        for key in keys:
+            assert isinstance(key, str)
+            hash_ = salt_copy()
+            hash_.update(key)
+            digests.append(hash_.digest())
+
+        if numpy is None:
+            m_size = self._m_size
+            fmt_unpack = self._fmt_unpack
+            return [tuple(pos % m_size for pos in fmt_unpack(digest)) for digest in digests]
+
+        if not digests:
+            return numpy.zeros((0, self._k_functions), dtype=numpy.intp)
+
+        if self._double_hashing:
+            halves = numpy.frombuffer("".join(digests), dtype=self._dtype).reshape(len(digests), 2) % numpy.uint64(self._m_size)
+            positions = (halves[:, :1] +
+                         numpy.arange(self._k_functions, dtype=numpy.uint64) * halves[:, 1:] +
+                         numpy.array(self._double_hashing_offsets, dtype=numpy.uint64))
+        else:
+            positions = numpy.frombuffer("".join(digests), dtype=self._dtype).reshape(len(digests), -1)[:, :self._k_functions]
+        return (positions % numpy.uint64(self._m_size)).astype(numpy.intp)
+
+    def contains_keys(self, keys):
+        """
+        Returns a list with a boolean for every key in KEYS, True when the key is in the filter.
+        """
+        positions = self.get_positions(keys)
+
+        if numpy is None:
+            filter_ = self._filter
+            return [all(filter_[pos >> 3] & (1 << (pos & 7)) for pos in tup) for tup in positions]
+
+        array = numpy.frombuffer(self._filter, dtype=numpy.uint8)
+        return ((array[positions >> 3] >> (positions & 7)) & 1).all(axis=1).tolist()
+
     def not_filter(self, iterator):
         """
         Yields all tuples in iterator where the first element in the tuple is NOT in the bloom
         filter.
         """
+        if numpy is not None:
+            return self._not_filter_batch(iterator)
+        return self._not_filter(iterator)
+
+    def _not_filter_batch(self, iterator):
+        iterator = iter(iterator)
+        while True:
+            batch = list(islice(iterator, _NOT_FILTER_BATCH_SIZE))
+            if not batch:
+                break
+
+            assert all(isinstance(tup, tuple) for tup in batch)
+            assert all(len(tup) > 0 for tup in batch)
+            for tup, contained in izip(batch, self.contains_keys(tup[0] for tup in batch)):
+                if not contained:
+                    yield tup
+
+    def _not_filter(self, iterator):
         filter_ = self._filter
         salt_copy = self._salt.copy
         m_size = self._m_size
@@ -243,7 +369,8 @@ class BloomFilter(object):
             # while generators are more memory efficient, this list will be relatively short.
             # 07/05/12 Niels: using no list at all is even more efficient/faster
             for pos in fmt_unpack(hash_.digest()):
-                if not filter_ & (1 << (pos % m_size)):
+                pos %= m_size
+                if not filter_[pos >> 3] & (1 << (pos & 7)):
                     yield tup
                     break
 
@@ -271,7 +398,8 @@ class BloomFilter(object):
         The number of bits in the bloom filter that are set.
         @rtype: int
         """
-        return sum(1 if self._filter & (1 << i) else 0 for i in range(self._m_size))
+        popcount = _POPCOUNT
+        return sum(popcount[byte] for byte in self._filter)
 
     @property
     def size(self):
@@ -288,6 +416,14 @@ class BloomFilter(object):
         """
         return self._k_functions
 
+    @property
+    def double_hashing(self):
+        """
+        True when the positions are derived using double hashing.
+        @rtype: bool
+        """
+        return self._double_hashing
+
     @property
     def prefix(self):
         """
@@ -301,9 +437,12 @@ class BloomFilter(object):
         """
         The binary representation of the bits in the bloom filter.  Note that to reconstruct the bloom filter, not the
         bytes as well as the number of functions are required.
+
+        Every call returns a new string, i.e. a copy of the m_size / 8 bytes in the filter.
         @rtype: string
         """
-        # hex should be m_size/4, hex is 16 instead of 8 -> hence half the number of "hexes" in m_size
-        hex_ = '%x' % self._filter
-        padding = '0' * (self._m_size /4 - len(hex_))
-        return unhexlify(padding + hex_)[::-1]
+        # bit N is stored in byte N/8 at position N%8, this is identical to the little-endian
+        # representation of the (long) filter that was used before, hence no conversion is required.
+        # the packet encoder joins strings, hence the bytearray is copied rather than returned as a
+        # buffer
+        return str(self._filter)
@@ -104,6 +104,10 @@ class WalkCandidate(Candidate):
         # the highest global time that one of the walks reported from this Candidate
         self._global_time = 0
 
+        # True when the last introduction-request from this Candidate indicated that it supports
+        # sync bloom filters that use double hashing
+        self._double_hashing_support = False
+
         if __debug__:
             if not (self.sock_addr == self._lan_address or self.sock_addr == self._wan_address):
                 logger.error("Either LAN %s or the WAN %s should be SOCK_ADDR %s", self._lan_address, self._wan_address, self.sock_addr)
@@ -121,6 +125,15 @@ class WalkCandidate(Candidate):
     def connection_type(self):
         return self._connection_type
 
+    @property
+    def double_hashing_support(self):
+        return self._double_hashing_support
+
+    @double_hashing_support.setter
+    def double_hashing_support(self, double_hashing_support):
+        assert isinstance(double_hashing_support, bool), type(double_hashing_support)
+        self._double_hashing_support = double_hashing_support
+
     def get_destination_address(self, wan_address):
         assert is_address(wan_address), wan_address
         return self._lan_address if wan_address[0] == self._wan_address[0] else self._wan_address
@@ -133,6 +146,7 @@ class WalkCandidate(Candidate):
         self._last_stumble = max(self._last_stumble, other._last_stumble)
         self._last_intro = max(self._last_intro, other._last_intro)
         self._global_time = max(self._global_time, other._global_time)
+        self._double_hashing_support = self._double_hashing_support or other._double_hashing_support
 
     @property
     def global_time(self):
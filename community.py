@@ -24,14 +24,18 @@ except ImportError:
     from .python27_ordereddict import OrderedDict
 
 from .bloomfilter import BloomFilter
+from .invertiblebloomfilter import InvertibleBloomFilter
 from .candidate import WalkCandidate, BootstrapCandidate
 from .conversion import BinaryConversion, DefaultConversion
 from .decorator import documentation, runtime_duration_warning
 from .dispersy import Dispersy
-from .distribution import SyncDistribution, GlobalTimePruning
+from .distribution import SyncDistribution, FullSyncDistribution, GlobalTimePruning
 from .member import DummyMember, Member
 from .resolution import PublicResolution, LinearResolution, DynamicResolution
 from .statistics import CommunityStatistics
+from .sequencecursors import SequenceCursors
+from .syncindex import SyncIndex
+from .syncresponsecache import SyncResponseCache
 from .timeline import Timeline
 
 
@@ -325,6 +329,9 @@ class Community(object):
         self._sync_cache = None
         self._dispersy_sync_skip_enable = True
         self._sync_cache_skip_count = 0
+        # whether the sync bloom filter that is currently being created uses double hashing, chosen
+        # for the destination candidate in dispersy_claim_sync_bloom_filter
+        self._sync_bloom_filter_double_hashing = False
         if __debug__:
             b = BloomFilter(self.dispersy_sync_bloom_filter_bits, self.dispersy_sync_bloom_filter_error_rate)
             logger.debug("sync bloom:    size: %d;  capacity: %d;  error-rate: %f", int(ceil(b.size // 8)), b.get_capacity(self.dispersy_sync_bloom_filter_error_rate), self.dispersy_sync_bloom_filter_error_rate)
@@ -337,6 +344,22 @@ class Community(object):
         self._random = Random(self._cid)
         self._nrsyncpackets = 0
 
+        # in-memory index of the syncable packets, loaded on demand by _get_sync_index
+        self._sync_index = None
+
+        # sha1 digests of at most dispersy_duplicate_index_size stored, not undone, packets, loaded
+        # on demand by _get_duplicate_index
+        self._duplicate_index = None
+        self._duplicate_index_size = self.dispersy_duplicate_index_size
+
+        # (highest global time, count) per member and meta message with sequence numbers
+        self._sequence_cursors = SequenceCursors(self._dispersy.database)
+        if self.dispersy_sequence_cursor_check_interval > 0.0:
+            self._pending_callbacks.append(self._dispersy.callback.register(self._periodically_check_sequence_cursors))
+
+        # recent results of the sync response query, used by Dispersy.on_introduction_request
+        self._sync_response_cache = SyncResponseCache(self.dispersy_sync_response_cache_timeout)
+
         # Initialize all the candidate iterators
         self._candidates = OrderedDict()
         self._walked_candidates = self._iter_category(u'walk')
@@ -567,10 +590,95 @@ class Community(object):
         """
         return (1500 - 60 - 8 - 51 - self._my_member.signature_length - 21 - 30) * 8
 
+    @property
+    def dispersy_sync_bloom_filter_double_hashing(self):
+        """
+        Use double hashing for the sync bloom filter.
+
+        When True, the sync bloom filters are created with BloomFilter(..., double_hashing=True).  This
+        derives all hash positions from a single md5 digest, making both the bloom filter creation and
+        the responses to incoming sync requests cheaper.  The dispersy-introduction-request message
+        indicates which scheme is used, allowing peers to handle either one.
+
+        Older peers do not recognise this flag and would test a double hashed bloom filter using the
+        classic scheme.  Hence double hashing is only used toward candidates that indicated support
+        in their own dispersy-introduction-request, all other candidates receive a classic bloom
+        filter.
+
+        @rtype: bool
+        """
+        return False
+
     @property
     def dispersy_sync_bloom_filter_strategy(self):
         return self._dispersy_claim_sync_bloom_filter_largest
 
+    @property
+    def dispersy_sync_invertible_bloom_filter_range(self):
+        """
+        The number of packets covered by the sync invertible bloom filter.
+
+        Used by _dispersy_claim_sync_invertible_bloom_filter.  An invertible bloom filter only
+        needs to be large enough to contain the difference between two peers, not the packets
+        themselves, hence it can cover many more packets than a sync bloom filter of the same size.
+        However, the receiver must retrieve the digests of all these packets to respond.
+
+        @rtype: int
+        """
+        return 10000
+
+    @property
+    def dispersy_sync_response_cache_timeout(self):
+        """
+        The number of seconds that the packets selected for a sync response are kept in memory.
+
+        Incoming sync requests with the same sync range, modulo, and offset will use these packets
+        instead of querying the database again.  The cache is updated whenever packets are stored,
+        removed, or undone.
+
+        @rtype: float
+        """
+        return 5.0
+
+    @property
+    def dispersy_duplicate_index_size(self):
+        """
+        The maximum number of sha1 digests in the duplicate index, see is_duplicate_packet.
+
+        Every digest costs roughly 100 bytes of memory.  Once the index is full the digests of newly
+        stored packets are not added.  Incoming duplicates of these packets are not dropped before
+        decoding, they are still detected by Dispersy._is_duplicate_sync_message.
+
+        @rtype: int
+        """
+        return 100000
+
+    @property
+    def dispersy_sequence_cursor_check_interval(self):
+        """
+        The interval, in seconds, between two checks of the sequence cursors against the database.
+
+        Zero, the default, disables this check.
+        @rtype: float
+        """
+        return 0.0
+
+    @property
+    def sequence_cursors(self):
+        """
+        The SequenceCursors containing the (highest global time, count) per member and meta message.
+        @rtype: SequenceCursors
+        """
+        return self._sequence_cursors
+
+    @property
+    def sync_response_cache(self):
+        """
+        The SyncResponseCache used by Dispersy.on_introduction_request.
+        @rtype: SyncResponseCache
+        """
+        return self._sync_response_cache
+
     @property
     def dispersy_sync_skip_enable(self):
         return self._dispersy_sync_skip_enable
@@ -582,6 +690,16 @@ class Community(object):
         if __debug__:
             cached = 0
 
+        for message in messages:
+            if self._duplicate_index is not None and len(self._duplicate_index) < self._duplicate_index_size:
+                self._duplicate_index.add(message.packet_digest)
+            if isinstance(message.distribution, FullSyncDistribution.Implementation) and message.distribution.enable_sequence_number:
+                self._sequence_cursors.add(message.database_id, message.authentication.member.database_id, message.distribution.global_time)
+            if message.distribution.priority > 32:
+                if self._sync_index is not None:
+                    self._sync_index.add(message.distribution.global_time, message.database_id)
+                self._sync_response_cache.invalidate(message.database_id, message.distribution.global_time)
+
         if self._sync_cache:
             cache = self._sync_cache
             for message in messages:
@@ -603,17 +721,77 @@ class Community(object):
             if cached:
                 logger.debug("%s] %d out of %d were part of the cached bloomfilter", self._cid.encode("HEX"), cached, len(messages))
 
+    def dispersy_remove_sync(self, meta, global_times, digests=()):
+        """
+        Called after packets of META, with the given GLOBAL_TIMES and sha1 DIGESTS, have been
+        removed from the database.
+        """
+        if self._duplicate_index is not None:
+            self._duplicate_index.difference_update(digests)
+        if meta.distribution.priority > 32:
+            for global_time in global_times:
+                if self._sync_index is not None:
+                    self._sync_index.remove(global_time, meta.database_id)
+                self._sync_response_cache.invalidate(meta.database_id, global_time)
+
+    def dispersy_undo_sync(self, meta, global_times, digests):
+        """
+        Called after packets of META, with the given GLOBAL_TIMES and sha1 DIGESTS, have been
+        marked as undone.  Undone packets are no longer part of the sync.
+
+        The sequence cursors are not affected, their counts include undone packets.
+        """
+        if self._duplicate_index is not None:
+            self._duplicate_index.difference_update(digests)
+        if meta.distribution.priority > 32:
+            for global_time in global_times:
+                if self._sync_index is not None:
+                    self._sync_index.remove(global_time, meta.database_id)
+                self._sync_response_cache.invalidate(meta.database_id, global_time)
+
+    def dispersy_redo_sync(self, meta, global_times, digests):
+        """
+        Called after packets of META, with the given GLOBAL_TIMES and sha1 DIGESTS, are no longer
+        marked as undone.  These packets are part of the sync again.
+        """
+        if self._duplicate_index is not None:
+            for digest in digests:
+                if len(self._duplicate_index) >= self._duplicate_index_size:
+                    break
+                self._duplicate_index.add(digest)
+        if meta.distribution.priority > 32:
+            for global_time in global_times:
+                if self._sync_index is not None:
+                    self._sync_index.add(global_time, meta.database_id)
+                self._sync_response_cache.invalidate(meta.database_id, global_time)
+
+    def dispersy_invalidate_sync(self):
+        """
+        Called after the sync table changed in a way that is not reported through dispersy_store,
+        dispersy_remove_sync, dispersy_undo_sync, or dispersy_redo_sync.  For example when a
+        malicious member is removed or when the community is hard-killed.
+
+        Everything is loaded from the database again when it is used next, this is expensive.
+        """
+        self._sync_index = None
+        self._duplicate_index = None
+        self._sequence_cursors.clear()
+        self._sync_response_cache.clear()
+
     def dispersy_claim_sync_bloom_filter(self, request_cache):
         """
         Returns a (time_low, time_high, modulo, offset, bloom_filter) or None.
         """
+        # only use double hashing toward candidates that support it
+        double_hashing = self.dispersy_sync_bloom_filter_double_hashing and request_cache.helper_candidate.double_hashing_support
+
         if self._sync_cache:
             if self._sync_cache.responses_received > 0:
                 if self._dispersy_sync_skip_enable:
                     # We have received data, reset skip counter
                     self._sync_cache_skip_count = 0
 
-                if self._sync_cache.times_used < 100:
+                if self._sync_cache.times_used < 100 and (double_hashing or not getattr(self._sync_cache.bloom_filter, "double_hashing", False)):
                     self._statistics.sync_bloom_reuse += 1
                     self._statistics.sync_bloom_send += 1
                     cache = self._sync_cache
@@ -621,7 +799,7 @@ class Community(object):
                     cache.responses_received = 0
                     cache.candidate = request_cache.helper_candidate
 
-                    logger.debug("%s reuse #%d (packets received: %d; %s)", self._cid.encode("HEX"), cache.times_used, cache.responses_received, hex(cache.bloom_filter._filter))
+                    logger.debug("%s reuse #%d (packets received: %d; %s)", self._cid.encode("HEX"), cache.times_used, cache.responses_received, cache.bloom_filter.bytes.encode("HEX"))
                     return cache.time_low, cache.time_high, cache.modulo, cache.offset, cache.bloom_filter
 
             elif self._sync_cache.times_used == 0:
@@ -638,6 +816,7 @@ class Community(object):
                 self._sync_cache = None
                 return None
 
+        self._sync_bloom_filter_double_hashing = double_hashing
         sync = self.dispersy_sync_bloom_filter_strategy()
         if sync:
             self._sync_cache = SyncCache(*sync)
@@ -650,7 +829,7 @@ class Community(object):
 
     @runtime_duration_warning(0.5)
     def dispersy_claim_sync_bloom_filter_simple(self):
-        bloom = BloomFilter(self.dispersy_sync_bloom_filter_bits, self.dispersy_sync_bloom_filter_error_rate, prefix=chr(int(random() * 256)))
+        bloom = BloomFilter(self.dispersy_sync_bloom_filter_bits, self.dispersy_sync_bloom_filter_error_rate, prefix=chr(int(random() * 256)), double_hashing=self._sync_bloom_filter_double_hashing)
         capacity = bloom.get_capacity(self.dispersy_sync_bloom_filter_error_rate)
         global_time = self.global_time
 
@@ -686,7 +865,7 @@ class Community(object):
     # choose a pivot, add all items capacity to the right. If too small, add items left of pivot
     @runtime_duration_warning(0.5)
     def dispersy_claim_sync_bloom_filter_right(self):
-        bloom = BloomFilter(self.dispersy_sync_bloom_filter_bits, self.dispersy_sync_bloom_filter_error_rate, prefix=chr(int(random() * 256)))
+        bloom = BloomFilter(self.dispersy_sync_bloom_filter_bits, self.dispersy_sync_bloom_filter_error_rate, prefix=chr(int(random() * 256)), double_hashing=self._sync_bloom_filter_double_hashing)
         capacity = bloom.get_capacity(self.dispersy_sync_bloom_filter_error_rate)
 
         desired_mean = self.global_time / 2.0
@@ -739,7 +918,7 @@ class Community(object):
     # instead of pivot + capacity, divide capacity to have 50/50 divivion around pivot
     @runtime_duration_warning(0.5)
     def dispersy_claim_sync_bloom_filter_50_50(self):
-        bloom = BloomFilter(self.dispersy_sync_bloom_filter_bits, self.dispersy_sync_bloom_filter_error_rate, prefix=chr(int(random() * 256)))
+        bloom = BloomFilter(self.dispersy_sync_bloom_filter_bits, self.dispersy_sync_bloom_filter_error_rate, prefix=chr(int(random() * 256)), double_hashing=self._sync_bloom_filter_double_hashing)
         capacity = bloom.get_capacity(self.dispersy_sync_bloom_filter_error_rate)
 
         desired_mean = self.global_time / 2.0
@@ -816,7 +995,7 @@ class Community(object):
                 t2 = time()
 
             acceptable_global_time = self.acceptable_global_time
-            bloom = BloomFilter(self.dispersy_sync_bloom_filter_bits, self.dispersy_sync_bloom_filter_error_rate, prefix=chr(int(random() * 256)))
+            bloom = BloomFilter(self.dispersy_sync_bloom_filter_bits, self.dispersy_sync_bloom_filter_error_rate, prefix=chr(int(random() * 256)), double_hashing=self._sync_bloom_filter_double_hashing)
             capacity = bloom.get_capacity(self.dispersy_sync_bloom_filter_error_rate)
 
             desired_mean = self.global_time / 2.0
@@ -857,18 +1036,19 @@ class Community(object):
 
                 data, fixed = self._select_and_fix(syncable_messages, 0, capacity, True)
                 if len(data) > 0 and fixed:
-                    bloomfilter_range[1] = data[-1][0]
+                    bloomfilter_range[1] = data[-1]
                     self._nrsyncpackets = capacity + 1
 
             if __debug__:
                 t4 = time()
 
             if len(data) > 0:
-                bloom.add_keys(str(packet) for _, packet in data)
+                # DATA contains all global times between its first and last entry
+                bloom.add_keys(self._select_bloomfilter_packets(syncable_messages, data[0], data[-1]))
 
                 if __debug__:
                     logger.debug("%s syncing %d-%d, nr_packets = %d, capacity = %d, packets %d-%d, pivot = %d",
-                                 self.cid.encode("HEX"), bloomfilter_range[0], bloomfilter_range[1], len(data), capacity, data[0][0], data[-1][0], from_gbtime)
+                                 self.cid.encode("HEX"), bloomfilter_range[0], bloomfilter_range[1], len(data), capacity, data[0], data[-1], from_gbtime)
                     logger.debug("%s took %f (fakejoin %f, rangeselect %f, dataselect %f, bloomfill, %f",
                                  self.cid.encode("HEX"), time() - t1, t2 - t1, t3 - t2, t4 - t3, time() - t4)
 
@@ -881,15 +1061,62 @@ class Community(object):
             logger.debug("%s NOT syncing no syncable messages", self.cid.encode("HEX"))
         return (1, acceptable_global_time, 1, 0, BloomFilter(8, 0.1, prefix='\x00'))
 
+    @runtime_duration_warning(0.5)
+    def _dispersy_claim_sync_invertible_bloom_filter(self):
+        """
+        Sync strategy that sends an invertible bloom filter containing the digests of all packets in
+        a global time range, allowing the receiver to decode exactly which packets we are missing.
+
+        When the difference is too large to decode, the receiver will only send some, or none, of
+        the missing packets.  Hence every other sync falls back to the
+        _dispersy_claim_sync_bloom_filter_largest strategy.
+
+        Peers that do not support invertible bloom filters ignore the flag that indicates an
+        invertible bloom filter and try to read it as a sync bloom filter.  This fails their length
+        check, hence they drop the dispersy-introduction-request message.  Use this strategy (by
+        overriding dispersy_sync_bloom_filter_strategy) only when all peers in the community support
+        it.
+        """
+        if self._random.random() < 0.5:
+            return self._dispersy_claim_sync_bloom_filter_largest()
+
+        syncable_messages = u", ".join(unicode(meta.database_id) for meta in self._meta_messages.itervalues() if isinstance(meta.distribution, SyncDistribution) and meta.distribution.priority > 32)
+        if syncable_messages:
+            acceptable_global_time = self.acceptable_global_time
+            invertible_bloom_filter = InvertibleBloomFilter(self.dispersy_sync_bloom_filter_bits / 8 / InvertibleBloomFilter.cell_size)
+            to_select = self.dispersy_sync_invertible_bloom_filter_range
+
+            self._nrsyncpackets = len(self._get_sync_index(syncable_messages))
+            if self._nrsyncpackets > to_select:
+                from_gbtime = int(self._random.random() * self.global_time)
+                (time_low, time_high, _), _ = self._select_bloomfilter_range(syncable_messages, from_gbtime - 1, to_select, True)
+                time_low = max(1, time_low)
+            else:
+                time_low, time_high = 1, acceptable_global_time
+
+            invertible_bloom_filter.add_keys(InvertibleBloomFilter.get_key(str(digest))
+                                             for digest,
+                                             in self._dispersy.database.execute(u"SELECT digest FROM sync WHERE meta_message IN (%s) AND undone = 0 AND global_time BETWEEN ? AND ?" % syncable_messages,
+                                                                                (time_low, time_high)))
+
+            logger.debug("%s syncing %d-%d using an invertible bloom filter, cells = %d, totalnr = %d",
+                         self.cid.encode("HEX"), time_low, time_high, invertible_bloom_filter.size, self._nrsyncpackets)
+
+            return (min(time_low, acceptable_global_time), min(time_high, acceptable_global_time), 1, 0, invertible_bloom_filter)
+
+        else:
+            logger.debug("%s NOT syncing no syncable messages", self.cid.encode("HEX"))
+        return (1, self.acceptable_global_time, 1, 0, BloomFilter(8, 0.1, prefix='\x00'))
+
     # instead of pivot + capacity, compare pivot - capacity and pivot + capacity to see which globaltime range is largest
     @runtime_duration_warning(0.5)
     def _dispersy_claim_sync_bloom_filter_modulo(self):
         syncable_messages = u", ".join(unicode(meta.database_id) for meta in self._meta_messages.itervalues() if isinstance(meta.distribution, SyncDistribution) and meta.distribution.priority > 32)
         if syncable_messages:
-            bloom = BloomFilter(self.dispersy_sync_bloom_filter_bits, self.dispersy_sync_bloom_filter_error_rate, prefix=chr(int(random() * 256)))
+            bloom = BloomFilter(self.dispersy_sync_bloom_filter_bits, self.dispersy_sync_bloom_filter_error_rate, prefix=chr(int(random() * 256)), double_hashing=self._sync_bloom_filter_double_hashing)
             capacity = bloom.get_capacity(self.dispersy_sync_bloom_filter_error_rate)
 
-            self._nrsyncpackets = list(self._dispersy.database.execute(u"SELECT count(*) FROM sync WHERE meta_message IN (%s) AND undone = 0 LIMIT 1" % (syncable_messages)))[0][0]
+            self._nrsyncpackets = len(self._get_sync_index(syncable_messages))
             modulo = int(ceil(self._nrsyncpackets / float(capacity)))
             if modulo > 1:
                 offset = randint(0, modulo - 1)
@@ -910,29 +1137,65 @@ class Community(object):
             logger.debug("%s NOT syncing no syncable messages", self.cid.encode("HEX"))
         return (1, self.acceptable_global_time, 1, 0, BloomFilter(8, 0.1, prefix='\x00'))
 
-    def _select_and_fix(self, syncable_messages, global_time, to_select, higher=True):
+    def _get_sync_index(self, syncable_messages):
+        """
+        Returns the SyncIndex containing all syncable packets, loading it from the database when
+        required.
+        """
         assert isinstance(syncable_messages, unicode)
-        if higher:
-            data = list(self._dispersy.database.execute(u"SELECT global_time, packet FROM sync WHERE meta_message IN (%s) AND undone = 0 AND global_time > ? ORDER BY global_time ASC LIMIT ?" % (syncable_messages),
-                                                    (global_time, to_select + 1)))
-        else:
-            data = list(self._dispersy.database.execute(u"SELECT global_time, packet FROM sync WHERE meta_message IN (%s) AND undone = 0 AND global_time < ? ORDER BY global_time DESC LIMIT ?" % (syncable_messages),
-                                                    (global_time, to_select + 1)))
+        if self._sync_index is None:
+            self._sync_index = SyncIndex(self._dispersy.database.execute(u"SELECT global_time, meta_message FROM sync WHERE meta_message IN (%s) AND undone = 0" % syncable_messages))
+        return self._sync_index
 
-        fixed = False
-        if len(data) > to_select:
-            fixed = True
+    def _get_duplicate_index(self):
+        """
+        Returns the set containing the sha1 digests of stored, not undone, packets, loading it from
+        the database when required.  When there are more than dispersy_duplicate_index_size of
+        these packets, only the most recent ones are loaded.
+        """
+        if self._duplicate_index is None:
+            self._duplicate_index = set(str(digest) for digest, in self._dispersy.database.execute(u"SELECT digest FROM sync WHERE community = ? AND undone = 0 ORDER BY global_time DESC LIMIT ?",
+                                                                                                    (self._database_id, self._duplicate_index_size)))
+            logger.debug("new duplicate index with %d entries", len(self._duplicate_index))
+        return self._duplicate_index
 
-            # if last 2 packets are equal, then we need to drop those
-            global_time = data[-1][0]
-            del data[-1]
-            while data and data[-1][0] == global_time:
-                del data[-1]
+    def is_duplicate_packet(self, digest):
+        """
+        Returns True when the packet with sha1 DIGEST is already stored and not undone.  False may
+        also be returned for such a packet when the duplicate index is full, see
+        dispersy_duplicate_index_size.
 
-        if not higher:
-            data.reverse()
+        Pruned packets may still be reported as duplicates, which is harmless because an incoming
+        pruned packet is dropped regardless.
+        """
+        assert isinstance(digest, str), type(digest)
+        assert len(digest) == 20, len(digest)
+        return digest in self._get_duplicate_index()
 
-        return data, fixed
+    def replace_duplicate_packet(self, old_digest, new_digest):
+        """
+        Called after a stored packet was replaced by a packet with the same member and global time.
+        """
+        if self._duplicate_index is not None:
+            self._duplicate_index.discard(old_digest)
+            if len(self._duplicate_index) < self._duplicate_index_size:
+                self._duplicate_index.add(new_digest)
+
+    def _select_and_fix(self, syncable_messages, global_time, to_select, higher=True):
+        """
+        Returns a (global_times, fixed) tuple, see SyncIndex.select.
+        """
+        return self._get_sync_index(syncable_messages).select(global_time, to_select, higher)
+
+    def _select_bloomfilter_packets(self, syncable_messages, time_low, time_high):
+        """
+        Returns a list with all syncable packets between TIME_LOW and TIME_HIGH, inclusive.
+        """
+        assert isinstance(syncable_messages, unicode)
+        return [str(packet)
+                for packet,
+                in self._dispersy.database.execute(u"SELECT packet FROM sync WHERE meta_message IN (%s) AND undone = 0 AND global_time BETWEEN ? AND ?" % syncable_messages,
+                                                   (time_low, time_high))]
 
     def _select_bloomfilter_range(self, syncable_messages, global_time, to_select, higher=True):
         data, fixed = self._select_and_fix(syncable_messages, global_time, to_select, higher)
@@ -952,7 +1215,7 @@ class Community(object):
                     higherdata, higherfixed = self._select_and_fix(syncable_messages, global_time - 1, to_select, True)
                     data = data + higherdata
 
-        bloomfilter_range = [data[0][0], data[-1][0], len(data)]
+        bloomfilter_range = [data[0], data[-1], len(data)]
         # we can use the global_time as a min or max value for lower and upper bound
         if higher:
             # we selected items higher than global_time, make sure bloomfilter_range[0] is at least as low a global_time + 1
@@ -1060,6 +1323,37 @@ class Community(object):
         """
         return 5 * 1024
 
+    @property
+    def dispersy_sync_response_burst(self):
+        """
+        The maximum number of bytes to send back at once per received dispersy-sync message.
+
+        Responses larger than this are sent in multiple bursts, see dispersy_sync_response_interval.
+        By default the entire response is sent at once, unless the endpoint is unable to send
+        everything that is in its send queue.
+        @rtype: int
+        """
+        return self.dispersy_sync_response_limit
+
+    @property
+    def dispersy_sync_response_interval(self):
+        """
+        The number of seconds between two bursts of the same sync response.
+        @rtype: float
+        """
+        return 0.1
+
+    @property
+    def dispersy_sync_response_deadline(self):
+        """
+        The maximum number of seconds that a sync response waits for a congested endpoint.
+
+        The requester sends a new sync request after one walker step, hence there is no need to
+        continue the response after that.
+        @rtype: float
+        """
+        return 5.0
+
     @property
     def dispersy_missing_sequence_response_limit(self):
         """
@@ -1226,11 +1520,23 @@ class Community(object):
                                                 (meta.database_id, self._global_time - meta.distribution.pruning.prune_threshold))
                 logger.debug("%d %s messages have been pruned", self._dispersy.database.changes, meta.name)
 
+                if self._dispersy.database.changes:
+                    self._sequence_cursors.invalidate(meta.database_id)
+
+                if self._dispersy.database.changes and meta.distribution.priority > 32:
+                    if self._sync_index is not None:
+                        self._sync_index.prune(meta.database_id, self._global_time - meta.distribution.pruning.prune_threshold)
+                    self._sync_response_cache.prune(meta.database_id, self._global_time - meta.distribution.pruning.prune_threshold)
+
     def dispersy_check_database(self):
         """
         Called each time after the community is loaded and attached to Dispersy.
         """
         self._database_version = self._dispersy.database.check_community_database(self, self._database_version)
+        self.dispersy_invalidate_sync()
+
+        # warm the duplicate index, it is used for every incoming packet
+        self._get_duplicate_index()
 
     def get_member(self, public_key):
         """
@@ -1281,6 +1587,12 @@ class Community(object):
         logger.warning("deprecated.  please use Dispersy.get_members_from_id")
         return self._dispersy.get_members_from_id(mid)
 
+    def get_conversions(self):
+        """
+        Returns a list with all available conversions, in the order that they were added.
+        """
+        return list(self._conversions)
+
     def get_default_conversion(self):
         """
         Returns the default conversion (defined as the last conversion).
@@ -1356,6 +1668,7 @@ class Community(object):
             from .conversion import Conversion
             assert isinstance(conversion, Conversion)
         self._conversions.append(conversion)
+        self._dispersy.update_dispatch_table(self)
 
     @documentation(Dispersy.take_step)
     def dispersy_take_step(self, allow_sync):
@@ -1747,6 +2060,16 @@ class Community(object):
                 self.add_candidate(candidate)
                 self._dispersy.wan_address_unvote(other)
 
+    def _periodically_check_sequence_cursors(self):
+        """
+        Periodically compare the sequence cursors with the database.
+        """
+        while True:
+            yield self.dispersy_sequence_cursor_check_interval
+            corrected = self._sequence_cursors.check()
+            if corrected:
+                logger.warning("%s corrected %d sequence cursors", self._cid.encode("HEX"), corrected)
+
     def _periodically_cleanup_candidates(self):
         """
         Periodically remove obsolete Candidate instances.
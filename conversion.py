@@ -2,6 +2,7 @@ import logging
 logger = logging.getLogger(__name__)
 
 from abc import ABCMeta, abstractmethod
+from hashlib import sha1
 from math import ceil
 from socket import inet_ntoa, inet_aton
 from struct import pack, unpack_from, Struct
@@ -9,8 +10,8 @@ from random import choice
 
 from .authentication import NoAuthentication, MemberAuthentication, DoubleMemberAuthentication
 from .bloomfilter import BloomFilter
+from .invertiblebloomfilter import InvertibleBloomFilter
 from .crypto import ec_check_public_bin
-from .destination import CommunityDestination, CandidateDestination
 from .distribution import FullSyncDistribution, LastSyncDistribution, DirectDistribution
 from .message import DelayPacketByMissingMember, DropPacket, Message
 from .resolution import PublicResolution, LinearResolution, DynamicResolution
@@ -88,6 +89,17 @@ class Conversion(object):
         """
         assert isinstance(data, str), type(data)
 
+    def get_meta_messages(self):
+        """
+        Returns a list with (message byte, Message) pairs for the meta messages that this conversion
+        can decode.
+
+        A packet starting with the conversion prefix followed by one of these bytes must be
+        accepted by can_decode_message and decode_meta_message must return the associated Message.
+        Packets for conversions that return an empty list are dispatched using can_decode_message.
+        """
+        return []
+
     @abstractmethod
     def decode_meta_message(self, data):
         """
@@ -99,18 +111,31 @@ class Conversion(object):
         assert data[:22] == self._prefix
 
     @abstractmethod
-    def decode_message(self, address, data, verify=True):
+    def decode_message(self, address, data, verify=True, lazy=False, digest=None):
         """
         DATA is a string, where the first byte is the on-the-wire Dispersy version, the second byte
         is the on-the-wire Community version and the following 20 bytes is the Community Identifier.
         The rest is the message payload.
 
+        When LAZY is True, the payload of messages whose meta message has lazy_payload enabled is
+        decoded when it is first used.
+
+        DIGEST, when given, must be the sha1 digest of DATA.  It is reused instead of computing it
+        again, see Message.packet_digest.
+
         Returns a Message instance.
         """
         assert isinstance(data, str)
         assert len(data) >= 22
         assert data[:22] == self._prefix
 
+    def get_signature_triple(self, data):
+        """
+        Returns the (public key, digest, signature) triple required to verify the signature of
+        DATA, or None when this is not available.
+        """
+        return None
+
     @abstractmethod
     def can_encode_message(self, message):
         """
@@ -146,13 +171,14 @@ class BinaryConversion(Conversion):
     All data is encoded in a binary form.
     """
     class Placeholder(object):
-        __slots__ = ["candidate", "meta", "offset", "data", "authentication", "resolution", "first_signature_offset", "destination", "distribution", "payload", "verify", "allow_empty_signature"]
+        __slots__ = ["candidate", "meta", "offset", "data", "authentication", "resolution", "first_signature_offset", "destination", "distribution", "payload", "verify", "allow_empty_signature", "digest"]
 
-        def __init__(self, candidate, meta, offset, data, verify, allow_empty_signature):
+        def __init__(self, candidate, meta, offset, data, verify, allow_empty_signature, digest=None):
             self.candidate = candidate
             self.meta = meta
             self.offset = offset
             self.data = data
+            self.digest = digest
             self.verify = verify
             self.allow_empty_signature = allow_empty_signature
             self.authentication = None
@@ -162,27 +188,33 @@ class BinaryConversion(Conversion):
             self.distribution = None
             self.payload = None
 
+        def get_digest(self):
+            """
+            Returns the sha1 digest of the packet, it is computed only when it was not given.
+            """
+            if self.digest is None:
+                self.digest = sha1(self.data).digest()
+            return self.digest
+
     class EncodeFunctions(object):
-        __slots__ = ["byte", "authentication", "signature", "resolution", "distribution", "payload"]
+        __slots__ = ["byte", "prefix", "authentication", "signature", "header", "payload"]
 
-        def __init__(self, byte, xxx_todo_changeme, resolution, distribution, payload):
-            (authentication, signature) = xxx_todo_changeme
+        def __init__(self, byte, prefix, authentication, signature, header, payload):
             self.byte = byte
+            self.prefix = prefix
             self.authentication = authentication
             self.signature = signature
-            self.resolution = resolution
-            self.distribution = distribution
+            self.header = header
             self.payload = payload
 
     class DecodeFunctions(object):
-        __slots__ = ["meta", "authentication", "resolution", "distribution", "destination", "payload"]
+        __slots__ = ["meta", "authentication", "blacklist", "header", "payload"]
 
-        def __init__(self, meta, authentication, resolution, distribution, destination, payload):
+        def __init__(self, meta, authentication, blacklist, header, payload):
             self.meta = meta
             self.authentication = authentication
-            self.resolution = resolution
-            self.distribution = distribution
-            self.destination = destination
+            self.blacklist = blacklist
+            self.header = header
             self.payload = payload
 
     def __init__(self, community, community_version):
@@ -196,7 +228,6 @@ class BinaryConversion(Conversion):
         self._struct_LL = Struct(">LL")
         self._struct_Q = Struct(">Q")
         self._struct_QH = Struct(">QH")
-        self._struct_QL = Struct(">QL")
         self._struct_QQHHBH = Struct(">QQHHBH")
         self._struct_ccB = Struct(">ccB")
 
@@ -214,7 +245,17 @@ class BinaryConversion(Conversion):
         # reserve 3rd bit for enable/disable tunnel (02/05/12)
         self._encode_tunnel_map = {True: int("100", 2), False: int("000", 2)}
         self._decode_tunnel_map = dict((value, key) for key, value in self._encode_tunnel_map.iteritems())
-        # 4th, 5th and 6th bits are currently unused
+        # reserve 4th bit for classic/double hashing in the sync bloom filter (introduction-request only)
+        self._encode_double_hashing_map = {True: int("1000", 2), False: int("0000", 2)}
+        self._decode_double_hashing_map = dict((value, key) for key, value in self._encode_double_hashing_map.iteritems())
+        # reserve 5th bit for a bloom filter or an invertible bloom filter in the sync (introduction-request only)
+        self._encode_invertible_map = {True: int("10000", 2), False: int("00000", 2)}
+        self._decode_invertible_map = dict((value, key) for key, value in self._encode_invertible_map.iteritems())
+        # reserve 6th bit to indicate that the sender supports double hashing in the sync bloom filter
+        # (introduction-request only).  older peers do not set it, hence they will only receive sync
+        # bloom filters that use the classic scheme
+        self._encode_double_hashing_support_map = {True: int("100000", 2), False: int("000000", 2)}
+        self._decode_double_hashing_support_map = dict((value, key) for key, value in self._encode_double_hashing_support_map.iteritems())
         # reserve 7th and 8th bits for connection type
         self._encode_connection_type_map = {u"unknown": int("00000000", 2), u"public": int("10000000", 2), u"symmetric-NAT": int("11000000", 2)}
         self._decode_connection_type_map = dict((value, key) for key, value in self._encode_connection_type_map.iteritems())
@@ -269,34 +310,106 @@ class BinaryConversion(Conversion):
 
         mapping = {MemberAuthentication: (self._encode_member_authentication, self._encode_member_authentication_signature),
                    DoubleMemberAuthentication: (self._encode_double_member_authentication, self._encode_double_member_authentication_signature),
-                   NoAuthentication: (self._encode_no_authentication, self._encode_no_authentication_signature),
+                   NoAuthentication: (self._encode_no_authentication, self._encode_no_authentication_signature)}
+        authentication, signature = mapping[type(meta.authentication)]
+        self._encode_message_map[meta.name] = self.EncodeFunctions(byte, self._prefix + byte, authentication, signature, self._compile_encode_header(meta), encode_payload_func)
+
+        mapping = {MemberAuthentication: self._decode_member_authentication,
+                   DoubleMemberAuthentication: self._decode_double_member_authentication,
+                   NoAuthentication: self._decode_no_authentication}
+        blacklist = isinstance(meta.authentication, (MemberAuthentication, DoubleMemberAuthentication))
+        self._decode_message_map[byte] = self.DecodeFunctions(meta, mapping[type(meta.authentication)], blacklist, self._compile_decode_header(meta), decode_payload_func)
 
-                   PublicResolution: self._encode_public_resolution,
-                   LinearResolution: self._encode_linear_resolution,
-                   DynamicResolution: self._encode_dynamic_resolution,
+    def _get_header_struct(self, meta):
+        """
+        Returns the Struct used for the resolution and distribution fields of META.
 
-                   FullSyncDistribution: self._encode_full_sync_distribution,
-                   LastSyncDistribution: self._encode_last_sync_distribution,
-                   DirectDistribution: self._encode_direct_distribution}
+        These fields directly follow the authentication: an optional policy index for
+        DynamicResolution, followed by the global time and, when enabled, the sequence number.
+        """
+        if not isinstance(meta.resolution, (PublicResolution, LinearResolution, DynamicResolution)):
+            raise NotImplementedError(type(meta.resolution))
+        if not isinstance(meta.distribution, (FullSyncDistribution, LastSyncDistribution, DirectDistribution)):
+            raise NotImplementedError(type(meta.distribution))
 
-        self._encode_message_map[meta.name] = self.EncodeFunctions(byte, mapping[type(meta.authentication)], mapping[type(meta.resolution)], mapping[type(meta.distribution)], encode_payload_func)
+        return Struct(">%s%s" % ("B" if isinstance(meta.resolution, DynamicResolution) else "",
+                                 "QL" if isinstance(meta.distribution, FullSyncDistribution) and meta.distribution.enable_sequence_number else "Q"))
 
-        mapping = {MemberAuthentication: self._decode_member_authentication,
-                   DoubleMemberAuthentication: self._decode_double_member_authentication,
-                   NoAuthentication: self._decode_no_authentication,
+    def _compile_encode_header(self, meta):
+        """
+        Returns a function that encodes the resolution and distribution fields of a message of META
+        into a single string.
+        """
+        header_struct = self._get_header_struct(meta)
+        policies = meta.resolution.policies if isinstance(meta.resolution, DynamicResolution) else None
+        sequence_number = isinstance(meta.distribution, FullSyncDistribution) and meta.distribution.enable_sequence_number
+
+        if policies:
+            # both the public and the linear resolution do not require any storage
+            if sequence_number:
+                def encode_header(message):
+                    assert message.distribution.global_time
+                    assert message.distribution.sequence_number
+                    return header_struct.pack(policies.index(message.resolution.policy.meta), message.distribution.global_time, message.distribution.sequence_number)
+            else:
+                def encode_header(message):
+                    assert message.distribution.global_time
+                    return header_struct.pack(policies.index(message.resolution.policy.meta), message.distribution.global_time)
+
+        elif sequence_number:
+            def encode_header(message):
+                assert message.distribution.global_time
+                assert message.distribution.sequence_number
+                return header_struct.pack(message.distribution.global_time, message.distribution.sequence_number)
+
+        else:
+            def encode_header(message):
+                assert message.distribution.global_time
+                return header_struct.pack(message.distribution.global_time)
+
+        return encode_header
 
-                   DynamicResolution: self._decode_dynamic_resolution,
-                   LinearResolution: self._decode_linear_resolution,
-                   PublicResolution: self._decode_public_resolution,
+    def _compile_decode_header(self, meta):
+        """
+        Returns a function that decodes the resolution, destination, and distribution of a message
+        of META, starting at placeholder.offset.
+        """
+        header_struct = self._get_header_struct(meta)
+        size = header_struct.size
+        resolution = meta.resolution
+        destination = meta.destination
+        distribution = meta.distribution
+        dynamic = isinstance(resolution, DynamicResolution)
+        sequence_number = isinstance(distribution, FullSyncDistribution) and distribution.enable_sequence_number
+        # DirectDistribution allows a zero global time
+        check_global_time = isinstance(distribution, (FullSyncDistribution, LastSyncDistribution))
+
+        def decode_header(placeholder):
+            if len(placeholder.data) < placeholder.offset + size:
+                raise DropPacket("Insufficient packet size (%s header)" % meta.name)
+            values = header_struct.unpack_from(placeholder.data, placeholder.offset)
+            placeholder.offset += size
+
+            if dynamic:
+                index = values[0]
+                if index >= len(resolution.policies):
+                    raise DropPacket("Invalid policy index")
+                meta_policy = resolution.policies[index]
+                # both the public and the linear resolution do not require any storage
+                placeholder.resolution = resolution.Implementation(resolution, meta_policy.Implementation(meta_policy))
+                values = values[1:]
+            else:
+                placeholder.resolution = resolution.Implementation(resolution)
 
-                   DirectDistribution: self._decode_direct_distribution,
-                   FullSyncDistribution: self._decode_full_sync_distribution,
-                   LastSyncDistribution: self._decode_last_sync_distribution,
+            placeholder.destination = destination.Implementation(destination)
 
-                   CandidateDestination: self._decode_empty_destination,
-                   CommunityDestination: self._decode_empty_destination}
+            if check_global_time and not values[0]:
+                raise DropPacket("Invalid global time value (%s)" % meta.name)
+            if sequence_number and not values[1]:
+                raise DropPacket("Invalid sequence number value (%s)" % meta.name)
+            placeholder.distribution = distribution.Implementation(distribution, *values)
 
-        self._decode_message_map[byte] = self.DecodeFunctions(meta, mapping[type(meta.authentication)], mapping[type(meta.resolution)], mapping[type(meta.distribution)], mapping[type(meta.destination)], decode_payload_func)
+        return decode_header
 
     #
     # Dispersy payload
@@ -820,11 +933,20 @@ class BinaryConversion(Conversion):
         data = [inet_aton(payload.destination_address[0]), self._struct_H.pack(payload.destination_address[1]),
                 inet_aton(payload.source_lan_address[0]), self._struct_H.pack(payload.source_lan_address[1]),
                 inet_aton(payload.source_wan_address[0]), self._struct_H.pack(payload.source_wan_address[1]),
-                self._struct_B.pack(self._encode_advice_map[payload.advice] | self._encode_connection_type_map[payload.connection_type] | self._encode_sync_map[payload.sync]),
+                self._struct_B.pack(self._encode_advice_map[payload.advice] | self._encode_connection_type_map[payload.connection_type] | self._encode_sync_map[payload.sync] |
+                                    self._encode_double_hashing_map[payload.bloom_filter is not None and payload.bloom_filter.double_hashing] |
+                                    self._encode_invertible_map[payload.invertible_bloom_filter is not None] |
+                                    self._encode_double_hashing_support_map[payload.double_hashing_support]),
                 self._struct_H.pack(payload.identifier)]
 
         # add optional sync
-        if payload.sync:
+        if payload.invertible_bloom_filter:
+            assert 0 < payload.invertible_bloom_filter.functions < 256
+            assert 0 < payload.invertible_bloom_filter.size < 2 ** 16
+            data.extend((self._struct_QQHHBH.pack(payload.time_low, payload.time_high, payload.modulo, payload.offset, payload.invertible_bloom_filter.functions, payload.invertible_bloom_filter.size),
+                         payload.invertible_bloom_filter.bytes))
+
+        elif payload.sync:
             assert payload.bloom_filter.size % 8 == 0
             assert 0 < payload.bloom_filter.functions < 256, "assuming that we choose BITS to ensure the bloom filter will fit in one MTU, it is unlikely that there will be more than 255 functions.  hence we can encode this in one byte"
             assert len(payload.bloom_filter.prefix) == 1, "must have a one character prefix"
@@ -861,7 +983,49 @@ class BinaryConversion(Conversion):
         sync = self._decode_sync_map.get(flags & int("10", 2))
         if sync is None:
             raise DropPacket("Invalid sync flag")
-        if sync:
+
+        double_hashing = self._decode_double_hashing_map.get(flags & int("1000", 2))
+        if double_hashing is None:
+            raise DropPacket("Invalid double hashing flag")
+
+        invertible = self._decode_invertible_map.get(flags & int("10000", 2))
+        if invertible is None:
+            raise DropPacket("Invalid invertible flag")
+
+        double_hashing_support = self._decode_double_hashing_support_map.get(flags & int("100000", 2))
+        if double_hashing_support is None:
+            raise DropPacket("Invalid double hashing support flag")
+
+        if sync and invertible:
+            if len(data) < offset + 23:
+                raise DropPacket("Insufficient packet size")
+
+            time_low, time_high, modulo, modulo_offset, functions, size = self._struct_QQHHBH.unpack_from(data, offset)
+            offset += 23
+
+            if not time_low > 0:
+                raise DropPacket("Invalid time_low value")
+            if not (time_high == 0 or time_low <= time_high):
+                raise DropPacket("Invalid time_high value")
+            if not 0 < modulo:
+                raise DropPacket("Invalid modulo value")
+            if not 0 <= modulo_offset < modulo:
+                raise DropPacket("Invalid offset value")
+            if not 0 < functions <= 4:
+                raise DropPacket("Invalid functions value")
+            if not functions <= size:
+                raise DropPacket("Invalid size value")
+
+            length = size * InvertibleBloomFilter.cell_size
+            if not length == len(data) - offset:
+                raise DropPacket("Invalid number of bytes available")
+
+            invertible_bloom_filter = InvertibleBloomFilter(data[offset:offset + length], functions)
+            offset += length
+
+            sync = (time_low, time_high, modulo, modulo_offset, invertible_bloom_filter)
+
+        elif sync:
             if len(data) < offset + 24:
                 raise DropPacket("Insufficient packet size")
 
@@ -890,7 +1054,7 @@ class BinaryConversion(Conversion):
             if not length == len(data) - offset:
                 raise DropPacket("Invalid number of bytes available")
 
-            bloom_filter = BloomFilter(data[offset:offset + length], functions, prefix=prefix)
+            bloom_filter = BloomFilter(data[offset:offset + length], functions, prefix=prefix, double_hashing=double_hashing)
             offset += length
 
             sync = (time_low, time_high, modulo, modulo_offset, bloom_filter)
@@ -898,7 +1062,7 @@ class BinaryConversion(Conversion):
         else:
             sync = None
 
-        return offset, placeholder.meta.payload.Implementation(placeholder.meta.payload, destination_address, source_lan_address, source_wan_address, advice, connection_type, sync, identifier)
+        return offset, placeholder.meta.payload.Implementation(placeholder.meta.payload, destination_address, source_lan_address, source_wan_address, advice, connection_type, sync, identifier, double_hashing_support)
 
     def _encode_introduction_response(self, message):
         payload = message.payload
@@ -1015,47 +1179,6 @@ class BinaryConversion(Conversion):
         else:
             raise NotImplementedError(message.authentication.encoding)
 
-    def _encode_full_sync_distribution(self, container, message):
-        assert message.distribution.global_time
-        # 23/04/12 Boudewijn: testcases generate global time values that have not been claimed
-        # if message.distribution.global_time > message.community.global_time:
-        # did not use community.claim_global_time() FAIL
-        #     raise ValueError("incorrect global_time value chosen")
-        if message.distribution.enable_sequence_number:
-            assert message.distribution.sequence_number
-            container.append(self._struct_QL.pack(message.distribution.global_time, message.distribution.sequence_number))
-        else:
-            container.append(self._struct_Q.pack(message.distribution.global_time))
-
-    def _encode_last_sync_distribution(self, container, message):
-        assert message.distribution.global_time
-        # 23/04/12 Boudewijn: testcases generate global time values that have not been claimed
-        # if message.distribution.global_time > message.community.global_time:
-        # did not use community.claim_global_time() FAIL
-        #     raise ValueError("incorrect global_time value chosen")
-        container.append(self._struct_Q.pack(message.distribution.global_time))
-
-    def _encode_direct_distribution(self, container, message):
-        assert message.distribution.global_time
-        # 23/04/12 Boudewijn: testcases generate global time values that have not been claimed
-        # if message.distribution.global_time > message.community.global_time:
-        # did not use community.claim_global_time() FAIL
-        #     raise ValueError("incorrect global_time value chosen")
-        container.append(self._struct_Q.pack(message.distribution.global_time))
-
-    def _encode_public_resolution(self, container, message):
-        pass
-
-    def _encode_linear_resolution(self, container, message):
-        pass
-
-    def _encode_dynamic_resolution(self, container, message):
-        assert isinstance(message.resolution.policy, (PublicResolution.Implementation, LinearResolution.Implementation)), message.resolution.policy
-        assert not isinstance(message.resolution.policy, DynamicResolution), message.resolution.policy
-        index = message.resolution.policies.index(message.resolution.policy.meta)
-        container.append(chr(index))
-        # both the public and the linear resolution do not require any storage
-
     def _encode_no_authentication_signature(self, container, message, sign):
         return "".join(container)
 
@@ -1097,16 +1220,13 @@ class BinaryConversion(Conversion):
         encode_functions = self._encode_message_map[message.name]
 
         # community prefix, message-id
-        container = [self._prefix, encode_functions.byte]
+        container = [encode_functions.prefix]
 
         # authentication
         encode_functions.authentication(container, message)
 
-        # resolution
-        encode_functions.resolution(container, message)
-
-        # distribution
-        encode_functions.distribution(container, message)
+        # resolution and distribution
+        container.append(encode_functions.header(message))
 
         # payload
         payload = encode_functions.payload(message)
@@ -1126,59 +1246,6 @@ class BinaryConversion(Conversion):
     # Decoding
     #
 
-    def _decode_full_sync_distribution(self, placeholder):
-        distribution = placeholder.meta.distribution
-        if distribution.enable_sequence_number:
-            global_time, sequence_number = self._struct_QL.unpack_from(placeholder.data, placeholder.offset)
-            if not global_time:
-                raise DropPacket("Invalid global time value (_decode_full_sync_distribution)")
-            if not sequence_number:
-                raise DropPacket("Invalid sequence number value (_decode_full_sync_distribution)")
-            placeholder.offset += 12
-            placeholder.distribution = distribution.Implementation(distribution, global_time, sequence_number)
-
-        else:
-            global_time, = self._struct_Q.unpack_from(placeholder.data, placeholder.offset)
-            if not global_time:
-                raise DropPacket("Invalid global time value (_decode_full_sync_distribution)")
-            placeholder.offset += 8
-            placeholder.distribution = distribution.Implementation(distribution, global_time)
-
-    def _decode_last_sync_distribution(self, placeholder):
-        global_time, = self._struct_Q.unpack_from(placeholder.data, placeholder.offset)
-        if not global_time:
-            raise DropPacket("Invalid global time value (_decode_last_sync_distribution)")
-        placeholder.offset += 8
-        placeholder.distribution = LastSyncDistribution.Implementation(placeholder.meta.distribution, global_time)
-
-    def _decode_direct_distribution(self, placeholder):
-        global_time, = self._struct_Q.unpack_from(placeholder.data, placeholder.offset)
-        placeholder.offset += 8
-        placeholder.distribution = DirectDistribution.Implementation(placeholder.meta.distribution, global_time)
-
-    def _decode_public_resolution(self, placeholder):
-        placeholder.resolution = PublicResolution.Implementation(placeholder.meta.resolution)
-
-    def _decode_linear_resolution(self, placeholder):
-        placeholder.resolution = LinearResolution.Implementation(placeholder.meta.resolution)
-
-    def _decode_dynamic_resolution(self, placeholder):
-        if len(placeholder.data) < placeholder.offset + 1:
-            raise DropPacket("Insufficient packet size (_decode_dynamic_resolution)")
-
-        index = ord(placeholder.data[placeholder.offset])
-        if index > len(placeholder.meta.resolution.policies):
-            raise DropPacket("Invalid policy index")
-        meta_policy = placeholder.meta.resolution.policies[index]
-        placeholder.offset += 1
-
-        assert isinstance(meta_policy, (PublicResolution, LinearResolution)), meta_policy
-        assert not isinstance(meta_policy, DynamicResolution), meta_policy
-        # both the public and the linear resolution do not require any storage
-        policy = meta_policy.Implementation(meta_policy)
-
-        placeholder.resolution = DynamicResolution.Implementation(placeholder.meta.resolution, policy)
-
     def _decode_no_authentication(self, placeholder):
         placeholder.first_signature_offset = len(placeholder.data)
         placeholder.authentication = NoAuthentication.Implementation(placeholder.meta.authentication)
@@ -1198,11 +1265,25 @@ class BinaryConversion(Conversion):
             if not members:
                 raise DelayPacketByMissingMember(self._community, member_id)
 
+            if placeholder.verify:
+                signature_cache = self._community.dispersy.signature_cache
+                digest = placeholder.get_digest()
+                verified = signature_cache.get(digest)
+
             # signatures are enabled, verify that the signature matches the member sha1
             # identifier
             for member in members:
                 first_signature_offset = len(data) - member.signature_length
-                if (not placeholder.verify and len(members) == 1) or member.verify(data, data[first_signature_offset:], length=first_signature_offset):
+                if not placeholder.verify:
+                    valid = len(members) == 1
+                elif verified == (member.public_key,):
+                    valid = True
+                else:
+                    valid = member.verify(data, data[first_signature_offset:], length=first_signature_offset)
+                    if valid:
+                        signature_cache.add(digest, (member.public_key,))
+
+                if valid:
                     placeholder.offset = offset
                     placeholder.first_signature_offset = first_signature_offset
                     placeholder.authentication = MemberAuthentication.Implementation(authentication, member, is_signed=True)
@@ -1231,7 +1312,18 @@ class BinaryConversion(Conversion):
             first_signature_offset = len(data) - member.signature_length
 
             # signatures are enabled, verify that the signature matches the member sha1 identifier
-            if not placeholder.verify or member.verify(data, data[first_signature_offset:], length=first_signature_offset):
+            if placeholder.verify:
+                signature_cache = self._community.dispersy.signature_cache
+                digest = placeholder.get_digest()
+                valid = signature_cache.get(digest) == (member.public_key,)
+                if not valid:
+                    valid = member.verify(data, data[first_signature_offset:], length=first_signature_offset)
+                    if valid:
+                        signature_cache.add(digest, (member.public_key,))
+            else:
+                valid = True
+
+            if valid:
                 placeholder.offset = offset
                 placeholder.first_signature_offset = first_signature_offset
                 placeholder.authentication = MemberAuthentication.Implementation(authentication, member, is_signed=True)
@@ -1272,8 +1364,16 @@ class BinaryConversion(Conversion):
                 offset += 20
                 members_ids.append(members)
 
+            if placeholder.verify:
+                signature_cache = self._community.dispersy.signature_cache
+                digest = placeholder.get_digest()
+                verified = signature_cache.get(digest)
+            else:
+                verified = None
+
             for members in iter_options(members_ids):
                 # try this member combination
+                public_keys = tuple(member.public_key for member in members)
                 first_signature_offset = len(data) - sum([member.signature_length for member in members])
                 signature_offset = first_signature_offset
                 signatures = ["", ""]
@@ -1285,7 +1385,7 @@ class BinaryConversion(Conversion):
                     if placeholder.allow_empty_signature and signature == "\x00" * member.signature_length:
                         signatures[index] = ""
 
-                    elif (not placeholder.verify and len(members) == 1) or member.verify(data, data[signature_offset:signature_offset + member.signature_length], length=first_signature_offset):
+                    elif (not placeholder.verify and len(members) == 1) or verified == public_keys or member.verify(data, data[signature_offset:signature_offset + member.signature_length], length=first_signature_offset):
                         signatures[index] = signature
 
                     else:
@@ -1295,6 +1395,10 @@ class BinaryConversion(Conversion):
 
                 # found a valid combination
                 if found_valid_combination:
+                    # only remember packets where both signatures are present, otherwise the same
+                    # packet would also be accepted when empty signatures are not allowed
+                    if placeholder.verify and verified is None and all(signatures):
+                        signature_cache.add(digest, public_keys)
                     placeholder.offset = offset
                     placeholder.first_signature_offset = first_signature_offset
                     placeholder.authentication = DoubleMemberAuthentication.Implementation(placeholder.meta.authentication, members, signatures=signatures)
@@ -1327,13 +1431,24 @@ class BinaryConversion(Conversion):
             first_signature_offset = second_signature_offset - members[0].signature_length
             signatures = [data[first_signature_offset:second_signature_offset], data[second_signature_offset:]]
 
+            public_keys = (key1, key2)
+            if placeholder.verify:
+                signature_cache = self._community.dispersy.signature_cache
+                digest = placeholder.get_digest()
+                verified = signature_cache.get(digest) == public_keys
+            else:
+                verified = False
+
             for index, member in enumerate(members):
                 if placeholder.allow_empty_signature and signatures[index] == "\x00" * member.signature_length:
                     signatures[index] = ""
 
-                elif placeholder.verify and not member.verify(data, signatures[index], length=first_signature_offset):
+                elif placeholder.verify and not verified and not member.verify(data, signatures[index], length=first_signature_offset):
                     raise DropPacket("Signature does not match public key")
 
+            if placeholder.verify and not verified and all(signatures):
+                signature_cache.add(digest, public_keys)
+
             placeholder.offset = offset
             placeholder.first_signature_offset = first_signature_offset
             placeholder.authentication = DoubleMemberAuthentication.Implementation(placeholder.meta.authentication, members, signatures=signatures)
@@ -1341,10 +1456,7 @@ class BinaryConversion(Conversion):
         else:
             raise NotImplementedError(authentication.encoding)
 
-    def _decode_empty_destination(self, placeholder):
-        placeholder.destination = placeholder.meta.destination.Implementation(placeholder.meta.destination)
-
-    def _decode_message(self, candidate, data, verify, allow_empty_signature):
+    def _decode_message(self, candidate, data, verify, allow_empty_signature, lazy=False, digest=None):
         """
         Decode a binary string into a Message structure, with some
         Dispersy specific parameters.
@@ -1354,10 +1466,17 @@ class BinaryConversion(Conversion):
 
         Invalid signature(s) will cause DropPacket to be raised, except when ALLOW_EMPTY_SIGNATURE
         is True and the failed signature consist of \x00 bytes.
+
+        When LAZY is True and the meta message has lazy_payload enabled, the payload is decoded when
+        it is first used.  Errors while decoding the payload are raised at that time.
+
+        DIGEST, when given, must be the sha1 digest of DATA.  It is used for the signature cache and
+        stored in the returned message to avoid computing it again.
         """
         assert isinstance(data, str)
         assert isinstance(verify, bool)
         assert isinstance(allow_empty_signature, bool)
+        assert digest is None or digest == sha1(data).digest()
         assert len(data) >= 22
         assert data[:22] == self._prefix, (data[:22].encode("HEX"), self._prefix.encode("HEX"))
 
@@ -1370,7 +1489,7 @@ class BinaryConversion(Conversion):
             raise DropPacket("Unknown message code %d" % ord(data[22]))
 
         # placeholder
-        placeholder = self.Placeholder(candidate, decode_functions.meta, 23, data, verify, allow_empty_signature)
+        placeholder = self.Placeholder(candidate, decode_functions.meta, 23, data, verify, allow_empty_signature, digest)
 
         # authentication
         decode_functions.authentication(placeholder)
@@ -1379,23 +1498,27 @@ class BinaryConversion(Conversion):
         # however, decoding the payload can cause DelayPacketByMissingMessage to be raised for
         # dispersy-undo messages, and the last thing that we want is to request messages from a
         # blacklisted member
-        if isinstance(placeholder.meta.authentication, (MemberAuthentication, DoubleMemberAuthentication)) and placeholder.authentication.member.must_blacklist:
+        if decode_functions.blacklist and placeholder.authentication.member.must_blacklist:
             self._community.dispersy.send_malicious_proof(self._community, placeholder.authentication.member, candidate)
             raise DropPacket("Creator is blacklisted")
 
-        # resolution
-        decode_functions.resolution(placeholder)
+        # resolution, destination, and distribution
+        decode_functions.header(placeholder)
         assert isinstance(placeholder.resolution, Resolution.Implementation)
-
-        # destination
-        decode_functions.destination(placeholder)
         assert isinstance(placeholder.destination, Destination.Implementation)
-
-        # distribution
-        decode_functions.distribution(placeholder)
         assert isinstance(placeholder.distribution, Distribution.Implementation)
 
-        # payload
+        if lazy and placeholder.meta.lazy_payload:
+            # the payload is decoded when it is first used
+            payload = lambda: self._decode_payload(decode_functions, placeholder)
+        else:
+            payload = self._decode_payload(decode_functions, placeholder)
+
+        return placeholder.meta.Implementation(placeholder.meta, placeholder.authentication, placeholder.resolution, placeholder.distribution, placeholder.destination, payload, conversion=self, candidate=candidate, packet=placeholder.data, packet_digest=placeholder.digest)
+
+    def _decode_payload(self, decode_functions, placeholder):
+        # the payload decoder is given the packet, without the signatures, as a str.  decoders use
+        # len(data) as the end of the payload.  slicing does not copy packets without signatures
         placeholder.offset, placeholder.payload = decode_functions.payload(placeholder, placeholder.offset, placeholder.data[:placeholder.first_signature_offset])
         if placeholder.offset != placeholder.first_signature_offset:
             logger.warning("invalid packet size for %s data:%d; offset:%d", placeholder.meta.name, placeholder.first_signature_offset, placeholder.offset)
@@ -1406,7 +1529,7 @@ class BinaryConversion(Conversion):
             assert isinstance(placeholder.payload, Payload.Implementation), type(placeholder.payload)
             assert isinstance(placeholder.offset, (int, long))
 
-        return placeholder.meta.Implementation(placeholder.meta, placeholder.authentication, placeholder.resolution, placeholder.distribution, placeholder.destination, placeholder.payload, conversion=self, candidate=candidate, packet=placeholder.data)
+        return placeholder.payload
 
     def can_decode_message(self, data):
         """
@@ -1414,9 +1537,12 @@ class BinaryConversion(Conversion):
         """
         assert isinstance(data, str), type(data)
         return (len(data) >= 23 and
-                data[:22] == self._prefix and
+                data.startswith(self._prefix) and
                 data[22] in self._decode_message_map)
 
+    def get_meta_messages(self):
+        return [(byte, decode_functions.meta) for byte, decode_functions in self._decode_message_map.iteritems()]
+
     def decode_meta_message(self, data):
         """
         Decode a binary string into a Message instance.
@@ -1434,14 +1560,46 @@ class BinaryConversion(Conversion):
 
         return decode_functions.meta
 
-    def decode_message(self, candidate, data, verify=True):
+    def decode_message(self, candidate, data, verify=True, lazy=False, digest=None):
         """
         Decode a binary string into a Message.Implementation structure.
+
+        DIGEST, when given, must be the sha1 digest of DATA.
         """
         assert isinstance(candidate, Candidate), candidate
         assert isinstance(data, str), data
         assert isinstance(verify, bool)
-        return self._decode_message(candidate, data, verify, False)
+        assert isinstance(lazy, bool)
+        return self._decode_message(candidate, data, verify, False, lazy, digest)
+
+    def get_signature_triple(self, data):
+        """
+        Returns the (public key, digest, signature) triple required to verify the signature of DATA.
+
+        This allows the signatures of many packets to be verified at once, before they are decoded
+        using decode_message(..., verify=False).  Returns None when DATA does not use
+        MemberAuthentication with the sha1 encoding, or when DATA is not associated with exactly one
+        known member.  These packets must be decoded and verified using decode_message.
+        """
+        assert isinstance(data, str), type(data)
+        decode_functions = self._decode_message_map.get(data[22]) if len(data) >= 23 else None
+        if decode_functions is None:
+            return None
+
+        authentication = decode_functions.meta.authentication
+        if not (isinstance(authentication, MemberAuthentication) and authentication.encoding == "sha1"):
+            return None
+
+        members = [member for member in self._community.dispersy.get_members_from_id(data[23:43]) if member.has_identity(self._community)]
+        if not len(members) == 1:
+            return None
+
+        member = members[0]
+        first_signature_offset = len(data) - member.signature_length
+        if first_signature_offset < 43:
+            return None
+
+        return member.public_key, sha1(buffer(data, 0, first_signature_offset)).digest(), data[first_signature_offset:]
 
     def __str__(self):
         return "<%s %s%s [%s]>" % (self.__class__.__name__, self.dispersy_version.encode("HEX"), self.community_version.encode("HEX"), ", ".join(self._encode_message_map.iterkeys()))
@@ -10,10 +10,14 @@ import logging
 logger = logging.getLogger(__name__)
 
 import sys
+import threading
+from Queue import Queue, Full
 from abc import ABCMeta, abstractmethod
 from sqlite3 import Connection, Error
+from time import time
 
 from .decorator import attach_runtime_statistics
+from .queryprofiler import QueryProfiler, RowCountingCursor
 
 if __debug__:
     import thread
@@ -57,20 +61,95 @@ class IgnoreCommits(Exception):
         super(IgnoreCommits, self).__init__("Ignore all commits made within __enter__ and __exit__")
 
 
+# the values returned by PRAGMA synchronous
+_SYNCHRONOUS = {u"0": u"OFF", u"1": u"NORMAL", u"2": u"FULL", u"3": u"EXTRA",
+                u"OFF": u"OFF", u"NORMAL": u"NORMAL", u"FULL": u"FULL", u"EXTRA": u"EXTRA"}
+
+
+class DatabaseProfile(object):
+
+    def __init__(self, journal_mode=u"WAL", synchronous=u"NORMAL", page_size=8192, cache_size=None, mmap_size=None):
+        """
+        The sqlite performance settings that a Database applies when it is opened.
+
+        JOURNAL_MODE is one of DELETE, TRUNCATE, PERSIST, MEMORY, WAL, or OFF.  WAL allows readers
+        to continue while the database is written.
+
+        SYNCHRONOUS is one of OFF, NORMAL, FULL, or EXTRA.  With WAL, NORMAL is safe from corruption
+        but may lose the most recent commits when the machine crashes.
+
+        PAGE_SIZE is the page size in bytes.  Changing the page size of an existing database
+        requires a VACUUM, this is performed once when the database is opened.
+
+        CACHE_SIZE is the size of the page cache, in pages when positive or in kibibytes when
+        negative.  MMAP_SIZE is the number of bytes that may be accessed using memory-mapped I/O.
+        The sqlite defaults are used when these are None.
+        """
+        assert journal_mode in (u"DELETE", u"TRUNCATE", u"PERSIST", u"MEMORY", u"WAL", u"OFF"), journal_mode
+        assert synchronous in (u"OFF", u"NORMAL", u"FULL", u"EXTRA"), synchronous
+        assert isinstance(page_size, int), type(page_size)
+        assert 512 <= page_size <= 65536 and page_size & (page_size - 1) == 0, page_size
+        assert cache_size is None or isinstance(cache_size, int), type(cache_size)
+        assert mmap_size is None or isinstance(mmap_size, (int, long)), type(mmap_size)
+        assert mmap_size is None or mmap_size >= 0, mmap_size
+        self._journal_mode = journal_mode
+        self._synchronous = synchronous
+        self._page_size = page_size
+        self._cache_size = cache_size
+        self._mmap_size = mmap_size
+
+    @property
+    def journal_mode(self):
+        return self._journal_mode
+
+    @property
+    def synchronous(self):
+        return self._synchronous
+
+    @property
+    def page_size(self):
+        return self._page_size
+
+    @property
+    def cache_size(self):
+        return self._cache_size
+
+    @property
+    def mmap_size(self):
+        return self._mmap_size
+
+    def __str__(self):
+        return "<%s journal_mode=%s synchronous=%s page_size=%d cache_size=%s mmap_size=%s>" % \
+            (self.__class__.__name__, self._journal_mode, self._synchronous, self._page_size, self._cache_size, self._mmap_size)
+
+# the settings used unless another profile is given
+DEFAULT_PROFILE = DatabaseProfile()
+# every commit is synced to disk, even in WAL mode
+DURABLE_PROFILE = DatabaseProfile(synchronous=u"FULL")
+# a larger cache and memory-mapped reads, commits are never synced to disk.  a crash of the machine
+# may corrupt the database
+FAST_PROFILE = DatabaseProfile(synchronous=u"OFF", cache_size=-65536, mmap_size=268435456)
+
+
 class Database(object):
 
     __metaclass__ = ABCMeta
 
-    def __init__(self, file_path):
+    def __init__(self, file_path, profile=None):
         """
         Initialize a new Database instance.
 
         @param file_path: the path to the database file.
         @type file_path: unicode
+
+        @param profile: the sqlite performance settings, DEFAULT_PROFILE when not given.
+        @type profile: DatabaseProfile
         """
         assert isinstance(file_path, unicode)
+        assert profile is None or isinstance(profile, DatabaseProfile), type(profile)
         logger.debug("loading database [%s]", file_path)
         self._file_path = file_path
+        self._profile = DEFAULT_PROFILE if profile is None else profile
 
         # _CONNECTION, _CURSOR, AND _DATABASE_VERSION are set during open(...)
         self._connection = None
@@ -84,6 +163,18 @@ class Database(object):
         # when _pending_commits > 0.  A commit is required when _pending_commits > 1.
         self._pending_commits = 0
 
+        # group commit, see enable_group_commit.  _GROUP_COMMIT is None when disabled, otherwise it
+        # is a (callback, max_latency, max_pending) tuple
+        self._group_commit = None
+        self._group_commit_scheduled = False
+        # the number of Database.request_commit() calls, and the functions that must be called,
+        # since the last commit
+        self._group_commit_pending = 0
+        self._group_commit_waiters = []
+
+        # per statement template execution counts, times, and rows, see QueryProfiler
+        self._query_profiler = QueryProfiler()
+
         if __debug__:
             self._debug_thread_ident = 0
 
@@ -112,45 +203,49 @@ class Database(object):
 
     def _connect(self):
         self._connection = Connection(self._file_path)
-        self._cursor = self._connection.cursor()
+        # counts the rows fetched, see QueryProfiler.count_rows
+        self._cursor = self._connection.cursor(RowCountingCursor)
+        self._cursor.counter = self._query_profiler.row_counter
 
     def _initial_statements(self):
         assert self._cursor is not None, "Database.close() has been called or Database.open() has not been called"
         assert self._connection is not None, "Database.close() has been called or Database.open() has not been called"
+        profile = self._profile
 
         # collect current database configuration
         page_size = int(next(self._cursor.execute(u"PRAGMA page_size"))[0])
         journal_mode = unicode(next(self._cursor.execute(u"PRAGMA journal_mode"))[0]).upper()
-        synchronous = unicode(next(self._cursor.execute(u"PRAGMA synchronous"))[0]).upper()
+        synchronous = _SYNCHRONOUS.get(unicode(next(self._cursor.execute(u"PRAGMA synchronous"))[0]).upper())
 
         #
         # PRAGMA page_size = bytes;
         # http://www.sqlite.org/pragma.html#pragma_page_size
         # Note that changing page_size has no effect unless performed on a new database or followed
         # directly by VACUUM.  Since we do not want the cost of VACUUM every time we load a
-        # database, existing databases must be upgraded.
+        # database, existing databases are upgraded once.
         #
-        if page_size < 8192:
-            logger.debug("PRAGMA page_size = 8192 (previously: %s) [%s]", page_size, self._file_path)
+        if page_size != profile.page_size:
+            logger.debug("PRAGMA page_size = %d (previously: %s) [%s]", profile.page_size, page_size, self._file_path)
 
             # it is not possible to change page_size when WAL is enabled
             if journal_mode == u"WAL":
                 self._cursor.executescript(u"PRAGMA journal_mode = DELETE")
                 journal_mode = u"DELETE"
-            self._cursor.execute(u"PRAGMA page_size = 8192")
+            self._cursor.execute(u"PRAGMA page_size = %d" % profile.page_size)
             self._cursor.execute(u"VACUUM")
-            page_size = 8192
 
         else:
             logger.debug("PRAGMA page_size = %s (no change) [%s]", page_size, self._file_path)
 
         #
         # PRAGMA journal_mode = DELETE | TRUNCATE | PERSIST | MEMORY | WAL | OFF
-        # http://www.sqlite.org/pragma.html#pragma_page_size
+        # http://www.sqlite.org/pragma.html#pragma_journal_mode
+        # Switching to and from WAL is safe for an existing database, sqlite checkpoints or creates
+        # the journal as required.  An in-memory database always uses the MEMORY journal.
         #
-        if not (journal_mode == u"WAL" or self._file_path == u":memory:"):
-            logger.debug("PRAGMA journal_mode = WAL (previously: %s) [%s]", journal_mode, self._file_path)
-            self._cursor.execute(u"PRAGMA journal_mode = WAL")
+        if not (journal_mode == profile.journal_mode or self._file_path == u":memory:"):
+            logger.debug("PRAGMA journal_mode = %s (previously: %s) [%s]", profile.journal_mode, journal_mode, self._file_path)
+            self._cursor.execute(u"PRAGMA journal_mode = %s" % profile.journal_mode)
 
         else:
             logger.debug("PRAGMA journal_mode = %s (no change) [%s]", journal_mode, self._file_path)
@@ -159,13 +254,47 @@ class Database(object):
         # PRAGMA synchronous = 0 | OFF | 1 | NORMAL | 2 | FULL;
         # http://www.sqlite.org/pragma.html#pragma_synchronous
         #
-        if not synchronous in (u"NORMAL", u"1"):
-            logger.debug("PRAGMA synchronous = NORMAL (previously: %s) [%s]", synchronous, self._file_path)
-            self._cursor.execute(u"PRAGMA synchronous = NORMAL")
+        if not synchronous == profile.synchronous:
+            logger.debug("PRAGMA synchronous = %s (previously: %s) [%s]", profile.synchronous, synchronous, self._file_path)
+            self._cursor.execute(u"PRAGMA synchronous = %s" % profile.synchronous)
 
         else:
             logger.debug("PRAGMA synchronous = %s (no change) [%s]", synchronous, self._file_path)
 
+        #
+        # PRAGMA cache_size = pages | -kibibytes;
+        # http://www.sqlite.org/pragma.html#pragma_cache_size
+        #
+        if profile.cache_size is not None:
+            self._cursor.execute(u"PRAGMA cache_size = %d" % profile.cache_size)
+
+        #
+        # PRAGMA mmap_size = bytes;
+        # http://www.sqlite.org/pragma.html#pragma_mmap_size
+        # Ignored by sqlite versions before 3.7.17.
+        #
+        if profile.mmap_size is not None:
+            self._cursor.execute(u"PRAGMA mmap_size = %d" % profile.mmap_size)
+
+        logger.info("database pragmas %s [%s]", ", ".join("%s=%s" % item for item in sorted(self.get_pragmas().iteritems())), self._file_path)
+
+    def get_pragmas(self):
+        """
+        Returns a dictionary with the current value of the pragmas that DatabaseProfile configures.
+        """
+        assert self._cursor is not None, "Database.close() has been called or Database.open() has not been called"
+        pragmas = {}
+        for name in (u"page_size", u"journal_mode", u"synchronous", u"cache_size", u"mmap_size"):
+            # PRAGMA mmap_size returns nothing when it is not supported
+            row = next(self._cursor.execute(u"PRAGMA %s" % name), None)
+            if row is not None:
+                pragmas[name] = row[0]
+        if u"journal_mode" in pragmas:
+            pragmas[u"journal_mode"] = unicode(pragmas[u"journal_mode"]).upper()
+        if u"synchronous" in pragmas:
+            pragmas[u"synchronous"] = _SYNCHRONOUS.get(unicode(pragmas[u"synchronous"]).upper())
+        return pragmas
+
     def _prepare_version(self):
         assert self._cursor is not None, "Database.close() has been called or Database.open() has not been called"
         assert self._connection is not None, "Database.close() has been called or Database.open() has not been called"
@@ -201,6 +330,20 @@ class Database(object):
         """
         return self._file_path
 
+    @property
+    def profile(self):
+        """
+        The DatabaseProfile that is applied when the database is opened.
+        """
+        return self._profile
+
+    @property
+    def query_profiler(self):
+        """
+        The QueryProfiler that records the statements given to execute and executemany.
+        """
+        return self._query_profiler
+
     def __enter__(self):
         """
         Enters a no-commit state.  The commit will be performed by __exit__.
@@ -237,6 +380,13 @@ class Database(object):
 
         elif isinstance(exc_value, IgnoreCommits):
             logger.debug("enabling commit without committing now [%s]", self._file_path)
+            if self._group_commit_pending:
+                if self._group_commit is None:
+                    # the requested commits are ignored, the functions given to request_commit
+                    # are called as if they were performed
+                    self._notify_group_commit()
+                elif not self._group_commit_scheduled:
+                    self._schedule_group_commit()
             return True
 
         else:
@@ -306,6 +456,10 @@ class Database(object):
 
         try:
             logger.log(logging.NOTSET, "%s <-- %s [%s]", statement, bindings, self._file_path)
+            if self._query_profiler.enabled:
+                start = time()
+                cursor = self._cursor.execute(statement, bindings)
+                return self._query_profiler.record(statement, time() - start, cursor)
             return self._cursor.execute(statement, bindings)
 
         except Error:
@@ -375,6 +529,10 @@ class Database(object):
 
         try:
             logger.log(logging.NOTSET, "%s [%s]", statement, self._file_path)
+            if self._query_profiler.enabled:
+                start = time()
+                cursor = self._cursor.executemany(statement, sequenceofbindings)
+                return self._query_profiler.record(statement, time() - start, cursor)
             return self._cursor.executemany(statement, sequenceofbindings)
 
         except Error:
@@ -402,7 +560,105 @@ class Database(object):
                 except Exception as exception:
                     logger.exception("%s [%s]", exception, self._file_path)
 
-            return self._connection.commit()
+            result = self._connection.commit()
+            self._notify_group_commit()
+            return result
+
+    def enable_group_commit(self, callback, max_latency=1.0, max_pending=64):
+        """
+        Combine the commits requested using Database.request_commit().
+
+        Requested commits are performed once MAX_LATENCY seconds have passed since the first
+        pending request, or once MAX_PENDING requests are pending, whichever comes first.  CALLBACK
+        is used to schedule the delayed commits and must run on the database thread.
+
+        Database.commit() still commits immediately, committing all pending requests as well.
+        """
+        assert isinstance(max_latency, float), type(max_latency)
+        assert max_latency >= 0.0, max_latency
+        assert isinstance(max_pending, int), type(max_pending)
+        assert max_pending > 0, max_pending
+        self._group_commit = (callback, max_latency, max_pending)
+
+    def disable_group_commit(self):
+        """
+        Commit all pending requests and perform all future requests immediately.
+        """
+        self._group_commit = None
+        if self._group_commit_pending:
+            self.commit()
+
+    @property
+    def group_commit_enabled(self):
+        """
+        True when requested commits are combined, see enable_group_commit.
+        """
+        return self._group_commit is not None
+
+    @property
+    def group_commit_pending(self):
+        """
+        The number of requested commits that have not been performed yet.
+        """
+        return self._group_commit_pending
+
+    def request_commit(self, func=None):
+        """
+        Request that all changes are committed.
+
+        Without group commit, see enable_group_commit, the changes are committed immediately.
+        Otherwise the commit is delayed and shared with other requests, avoiding one disk sync for
+        each request.  Callers that require their changes to be durable before continuing should use
+        Database.commit() instead.
+
+        FUNC, when given, is called without arguments once the changes have been committed.  Without
+        group commit it is also called when the commit is ignored by raising IgnoreCommits within a
+        'with database:' clause, with group commit the delayed commit is scheduled instead.
+
+        Returns True when the changes were committed before returning.
+        """
+        assert func is None or callable(func), func
+        if func:
+            self._group_commit_waiters.append(func)
+        self._group_commit_pending += 1
+
+        if self._group_commit is None:
+            self.commit()
+            # the commit is deferred within a 'with database:' clause
+            return not self._group_commit_pending
+
+        _, _, max_pending = self._group_commit
+        if self._group_commit_pending >= max_pending:
+            logger.debug("group commit %d requests (max pending) [%s]", self._group_commit_pending, self._file_path)
+            self.commit()
+            return not self._group_commit_pending
+
+        if not self._group_commit_scheduled:
+            self._schedule_group_commit()
+        return False
+
+    def _schedule_group_commit(self):
+        callback, max_latency, _ = self._group_commit
+        self._group_commit_scheduled = True
+        callback.register(self._group_commit_timeout, delay=max_latency)
+
+    def _group_commit_timeout(self):
+        self._group_commit_scheduled = False
+        # the database may have been closed, or the requests may have been committed already
+        if self._connection is not None and self._group_commit_pending:
+            logger.debug("group commit %d requests (max latency) [%s]", self._group_commit_pending, self._file_path)
+            self.commit()
+
+    def _notify_group_commit(self):
+        # called after every commit, all requested commits have now been performed
+        self._group_commit_pending = 0
+        if self._group_commit_waiters:
+            waiters, self._group_commit_waiters = self._group_commit_waiters, []
+            for func in waiters:
+                try:
+                    func()
+                except Exception as exception:
+                    logger.exception("%s [%s]", exception, self._file_path)
 
     @abstractmethod
     def check_database(self, database_version):
@@ -432,6 +688,144 @@ class Database(object):
         self._commit_callbacks.remove(func)
 
 
+class ReadConnection(object):
+
+    """
+    A read-only connection to an existing database.
+
+    A Database may only be used from the thread that opened it.  A ReadConnection allows other
+    threads to query the same database file concurrently, which requires the database to use the
+    WAL journal mode (Database enables this for every database that is not stored in memory).
+    Changes made through the Database become visible after they are committed.
+
+    Each ReadConnection may only be used from the thread that created it.
+    """
+
+    def __init__(self, file_path):
+        assert isinstance(file_path, unicode)
+        assert file_path != u":memory:", "an in-memory database can not be shared between connections"
+        logger.debug("open read connection [%s]", file_path)
+        self._file_path = file_path
+        self._connection = Connection(file_path)
+        self._cursor = self._connection.cursor()
+        self._cursor.execute(u"PRAGMA query_only = ON")
+        if __debug__:
+            self._debug_thread_ident = thread.get_ident()
+
+    @property
+    def file_path(self):
+        return self._file_path
+
+    def execute(self, statement, bindings=()):
+        """
+        Execute one read-only SQL statement, see Database.execute.
+        """
+        assert self._cursor is not None, "ReadConnection.close() has been called"
+        assert self._debug_thread_ident == thread.get_ident(), "Calling ReadConnection.execute on the wrong thread"
+        assert isinstance(statement, unicode), "The SQL statement must be given in unicode"
+        assert isinstance(bindings, (tuple, list, dict, set)), "The bindings must be a tuple, list, dictionary, or set"
+
+        try:
+            logger.log(logging.NOTSET, "%s <-- %s [%s]", statement, bindings, self._file_path)
+            return self._cursor.execute(statement, bindings)
+
+        except Error:
+            logger.exception("%s [%s] ", statement, self._file_path)
+            raise
+
+    def close(self):
+        assert self._cursor is not None, "ReadConnection.close() has been called"
+        logger.debug("close read connection [%s]", self._file_path)
+        self._cursor.close()
+        self._cursor = None
+        self._connection.close()
+        self._connection = None
+
+
+class DatabaseReadPool(object):
+
+    """
+    A small pool of threads, each with its own ReadConnection to the same database file.
+
+    Tasks are submitted from the Callback thread.  Each task is called on a worker thread with
+    the ReadConnection of that thread as its first argument, after which its result is given to
+    the result function, which is registered on CALLBACK.
+    """
+
+    def __init__(self, file_path, callback, size=2, queue_size=32):
+        assert isinstance(file_path, unicode)
+        assert isinstance(size, int), type(size)
+        assert 0 < size, size
+        assert isinstance(queue_size, int), type(queue_size)
+        self._file_path = file_path
+        self._callback = callback
+        self._queue = Queue(queue_size)
+        self._threads = [threading.Thread(name="DatabaseReadPool-%d" % index, target=self._loop) for index in xrange(size)]
+        for worker in self._threads:
+            worker.daemon = True
+            worker.start()
+
+    @property
+    def size(self):
+        return len(self._threads)
+
+    @property
+    def pending(self):
+        """
+        The number of tasks that have not yet been started.
+        """
+        return self._queue.qsize()
+
+    def submit(self, func, args=(), result_func=None, result_args=()):
+        """
+        Schedule FUNC(read_connection, *ARGS) to be called on a worker thread.  Its result will be
+        given to RESULT_FUNC(result, *RESULT_ARGS) on the callback thread.
+
+        Returns False, without scheduling FUNC, when too many tasks are pending.
+        """
+        assert callable(func), type(func)
+        assert isinstance(args, tuple), type(args)
+        assert result_func is None or callable(result_func), type(result_func)
+        assert isinstance(result_args, tuple), type(result_args)
+        try:
+            self._queue.put_nowait((func, args, result_func, result_args))
+        except Full:
+            return False
+        return True
+
+    def stop(self, timeout=10.0):
+        """
+        Stop all workers after the tasks that are currently pending.
+
+        Returns True when all workers stopped within TIMEOUT seconds.
+        """
+        assert isinstance(timeout, float), type(timeout)
+        for _ in self._threads:
+            self._queue.put((None, (), None, ()))
+        for worker in self._threads:
+            worker.join(timeout)
+        return not any(worker.is_alive() for worker in self._threads)
+
+    def _loop(self):
+        database = ReadConnection(self._file_path)
+        try:
+            while True:
+                func, args, result_func, result_args = self._queue.get()
+                if func is None:
+                    break
+
+                try:
+                    result = func(database, *args)
+                except Exception:
+                    logger.exception("read task %s failed [%s]", func, self._file_path)
+                else:
+                    if result_func:
+                        self._callback.register(result_func, (result,) + result_args)
+
+        finally:
+            database.close()
+
+
 class APSWDatabase(Database):
 
     def _connect(self):
@@ -453,6 +847,10 @@ class APSWDatabase(Database):
 
         try:
             logger.log(logging.NOTSET, "%s <-- %s [%s]", statement, bindings, self._file_path)
+            if self._query_profiler.enabled:
+                start = time()
+                cursor = self._cursor.execute(statement, bindings)
+                return self._query_profiler.record(statement, time() - start, cursor)
             return self._cursor.execute(statement, bindings)
 
         except apsw.Error:
@@ -479,6 +877,10 @@ class APSWDatabase(Database):
 
         try:
             logger.log(logging.NOTSET, "%s [%s]", statement, self._file_path)
+            if self._query_profiler.enabled:
+                start = time()
+                cursor = self._cursor.executemany(statement, sequenceofbindings)
+                return self._query_profiler.record(statement, time() - start, cursor)
             return self._cursor.executemany(statement, sequenceofbindings)
 
         except apsw.Error:
@@ -518,4 +920,5 @@ class APSWDatabase(Database):
                 callback(exiting=exiting)
             except Exception as exception:
                 logger.debug("%s [%s]", exception, self._file_path)
+        self._notify_group_commit()
         return result
@@ -58,11 +58,14 @@ from socket import inet_aton, error as socket_error
 from time import time
 
 from .authentication import NoAuthentication, MemberAuthentication, DoubleMemberAuthentication
+from .batchscheduler import BatchScheduler
 from .bloomfilter import BloomFilter
 from .bootstrap import get_bootstrap_candidates
+from .invertiblebloomfilter import InvertibleBloomFilter
 from .candidate import BootstrapCandidate, LoopbackCandidate, WalkCandidate, Candidate
 from .crypto import ec_generate_key, ec_to_public_bin, ec_to_private_bin
 from .destination import CommunityDestination, CandidateDestination
+from .database import DatabaseProfile, DatabaseReadPool
 from .dispersydatabase import DispersyDatabase
 from .distribution import SyncDistribution, FullSyncDistribution, LastSyncDistribution, DirectDistribution, GlobalTimePruning
 from .member import DummyMember, Member
@@ -79,7 +82,9 @@ from .payload import MissingSequencePayload, MissingProofPayload
 from .payload import SignatureRequestPayload, SignatureResponsePayload
 from .requestcache import Cache, RequestCache
 from .resolution import PublicResolution, LinearResolution
+from .signaturecache import SignatureCache
 from .statistics import DispersyStatistics
+from .verificationpool import VerificationPool
 
 if __debug__:
     from .callback import Callback
@@ -237,7 +242,7 @@ class Dispersy(object):
     The Dispersy class provides the interface to all Dispersy related commands, managing the in- and
     outgoing data for, possibly, multiple communities.
     """
-    def __init__(self, callback, endpoint, working_directory, database_filename=u"dispersy.db"):
+    def __init__(self, callback, endpoint, working_directory, database_filename=u"dispersy.db", database_profile=None):
         """
         Initialise a Dispersy instance.
 
@@ -252,11 +257,15 @@ class Dispersy(object):
 
         @param database_filename: The database filename or u":memory:"
         @type database_filename: unicode
+
+        @param database_profile: The sqlite performance settings, DEFAULT_PROFILE when not given.
+        @type database_profile: DatabaseProfile
         """
         assert isinstance(callback, Callback), type(callback)
         assert isinstance(endpoint, Endpoint), type(endpoint)
         assert isinstance(working_directory, unicode), type(working_directory)
         assert isinstance(database_filename, unicode), type(database_filename)
+        assert database_profile is None or isinstance(database_profile, DatabaseProfile), type(database_profile)
         super(Dispersy, self).__init__()
 
         # the thread we will be using
@@ -266,7 +275,17 @@ class Dispersy(object):
         self._endpoint = endpoint
 
         # batch caching incoming packets
-        self._batch_cache = {}
+        self._batch_scheduler = BatchScheduler(self._callback, self._on_batch_cache_timeout)
+
+        # sync responses that are still being sent, (cid, sock_addr):packets iterator
+        self._sync_responses = {}
+
+        # optional worker threads that select the packets for sync responses, see
+        # enable_sync_response_workers
+        self._sync_response_pool = None
+
+        # optional child processes that verify incoming signatures, see enable_verification_pool
+        self._verification_pool = None
 
         # where we store all data
         self._working_directory = os.path.abspath(working_directory)
@@ -275,13 +294,16 @@ class Dispersy(object):
         self._member_cache_by_hash = dict()
         self._member_cache_by_database_id = dict()
 
+        # digests of packets whose signatures were already verified
+        self._signature_cache = SignatureCache()
+
         # our data storage
         if not database_filename == u":memory:":
             database_directory = os.path.join(self._working_directory, u"sqlite")
             if not os.path.isdir(database_directory):
                 os.makedirs(database_directory)
             database_filename = os.path.join(database_directory, database_filename)
-        self._database = DispersyDatabase(database_filename)
+        self._database = DispersyDatabase(database_filename, database_profile)
 
         # assigns temporary cache objects to unique identifiers
         self._request_cache = RequestCache(self._callback)
@@ -311,6 +333,10 @@ class Dispersy(object):
         self._communities = {}
         self._walker_commmunities = []
 
+        # the destination of incoming packets for loaded communities.  (prefix + message
+        # byte):(Community, Conversion, Message) pairs, see update_dispatch_table
+        self._dispatch_table = {}
+
         self._check_distribution_batch_map = {DirectDistribution: self._check_direct_distribution_batch,
                                               FullSyncDistribution: self._check_full_sync_distribution_batch,
                                               LastSyncDistribution: self._check_last_sync_distribution_batch}
@@ -503,6 +529,22 @@ class Dispersy(object):
         """
         return self._statistics
 
+    @property
+    def batch_scheduler(self):
+        """
+        The BatchScheduler instance that collects incoming packets into batches.
+        @rtype: BatchScheduler
+        """
+        return self._batch_scheduler
+
+    @property
+    def signature_cache(self):
+        """
+        The SignatureCache instance containing the packets whose signatures were already verified.
+        @rtype: SignatureCache
+        """
+        return self._signature_cache
+
     def initiate_meta_messages(self, community):
         """
         Create the meta messages that Dispersy uses.
@@ -768,6 +810,7 @@ class Dispersy(object):
         assert not community.cid in self._communities
         assert not community in self._walker_commmunities
         self._communities[community.cid] = community
+        self.update_dispatch_table(community)
         community.dispersy_check_database()
 
         if community.dispersy_enable_candidate_walker:
@@ -807,6 +850,7 @@ class Dispersy(object):
         assert self._communities[community.cid] == community
         assert not community.dispersy_enable_candidate_walker or community in self._walker_commmunities, [community.dispersy_enable_candidate_walker, community in self._walker_commmunities]
         del self._communities[community.cid]
+        self.update_dispatch_table(community)
 
         # stop walker
         if community.dispersy_enable_candidate_walker:
@@ -820,9 +864,29 @@ class Dispersy(object):
 
         # remove any items that are left in the cache
         for meta in community.get_meta_messages():
-            if meta.batch.enabled and meta in self._batch_cache:
-                task_identifier, _, _ = self._batch_cache[meta]
-                self._callback.unregister(task_identifier)
+            if meta.batch.enabled:
+                self._batch_scheduler.discard(meta)
+
+    def update_dispatch_table(self, community):
+        """
+        Update the entries of COMMUNITY in the dispatch table.
+
+        The dispatch table maps the first 23 bytes of an incoming packet, i.e. the conversion prefix
+        and the message byte, to the community, conversion, and meta message that will handle it.
+        This avoids testing every conversion of a community for every incoming packet.
+
+        This method is called when COMMUNITY is attached, detached, or when a conversion is added to
+        it.  Packets that are not in the dispatch table are dispatched using get_community and
+        community.get_conversion_for_packet.
+        """
+        for key in [key for key, (other, _, _) in self._dispatch_table.iteritems() if other is community]:
+            del self._dispatch_table[key]
+
+        if self._communities.get(community.cid) is community:
+            # community.get_conversion_for_packet prefers the most recently added conversion
+            for conversion in community.get_conversions():
+                for byte, meta in conversion.get_meta_messages():
+                    self._dispatch_table[conversion.prefix + byte] = (community, conversion, meta)
 
     def reclassify_community(self, source, destination):
         """
@@ -1104,10 +1168,40 @@ class Dispersy(object):
             # is symmetric NAT.  once votes have been pruned we may find that we are no longer behind a symmetric-NAT
             set_connection_type(u"unknown")
 
-    def _is_duplicate_sync_message(self, message):
+    def _get_existing_sync_messages(self, messages):
+        """
+        Returns a dictionary with (member database id, global time):(packet id, digest, undone) for
+        every stored packet that has the same community, member, and global time as one of
+        MESSAGES.
+
+        All MESSAGES must belong to the same community.  One query is used for the entire batch.
+        """
+        assert isinstance(messages, list)
+        assert all(message.community == messages[0].community for message in messages)
+        keys = set((message.authentication.member.database_id, message.distribution.global_time) for message in messages)
+        members = set(member for member, _ in keys)
+        global_times = set(global_time for _, global_time in keys)
+        assert all(isinstance(member, (int, long)) for member in members)
+        assert all(isinstance(global_time, (int, long)) for global_time in global_times)
+
+        # the database ids and global times are integers, embedding them in the query avoids the
+        # sqlite limit on the number of bindings
+        existing = {}
+        for member, global_time, packet_id, digest, undone in self._database.execute(
+                u"SELECT member, global_time, id, digest, undone FROM sync WHERE community = ? AND member IN (%s) AND global_time IN (%s)" %
+                (u", ".join(unicode(member) for member in members), u", ".join(unicode(global_time) for global_time in global_times)),
+                (messages[0].community.database_id,)):
+            if (member, global_time) in keys:
+                existing[(member, global_time)] = (packet_id, digest, undone)
+        return existing
+
+    def _is_duplicate_sync_message(self, message, existing=None):
         """
         Returns True when this message is a duplicate, otherwise the message must be processed.
 
+        EXISTING is the optional result of _get_existing_sync_messages for a batch containing
+        MESSAGE, when given the database is not consulted to find the duplicate.
+
         === Problem: duplicate message ===
         The simplest reason to reject an incoming message is when we already have it, based on the
         community, member, and global time.  No further action is performed.
@@ -1140,17 +1234,19 @@ class Dispersy(object):
         until the bloom filter is synced with the database again.
         """
         community = message.community
-        # fetch the duplicate binary packet from the database
+        # fetch the digest of the duplicate binary packet from the database
         try:
-            have_packet, undone = self._database.execute(u"SELECT packet, undone FROM sync WHERE community = ? AND member = ? AND global_time = ?",
-                                                    (community.database_id, message.authentication.member.database_id, message.distribution.global_time)).next()
-        except StopIteration:
+            if existing is None:
+                packet_id, have_digest, undone = self._database.execute(u"SELECT id, digest, undone FROM sync WHERE community = ? AND member = ? AND global_time = ?",
+                                                                   (community.database_id, message.authentication.member.database_id, message.distribution.global_time)).next()
+            else:
+                packet_id, have_digest, undone = existing[(message.authentication.member.database_id, message.distribution.global_time)]
+        except (StopIteration, KeyError):
             logger.debug("this message is not a duplicate")
             return False
 
         else:
-            have_packet = str(have_packet)
-            if have_packet == message.packet:
+            if str(have_digest) == message.packet_digest:
                 # exact binary duplicate, do NOT process the message
                 logger.warning("received identical message %s %d@%d from %s %s",
                                message.name,
@@ -1169,6 +1265,9 @@ class Dispersy(object):
                         self._endpoint.send([message.candidate], [str(proof)])
 
             else:
+                # only load the packet when it differs from ours
+                have_packet, = self._database.execute(u"SELECT packet FROM sync WHERE id = ?", (packet_id,)).next()
+                have_packet = str(have_packet)
                 signature_length = message.authentication.member.signature_length
                 if have_packet[:signature_length] == message.packet[:signature_length]:
                     # the message payload is binary unique (only the signature is different)
@@ -1180,12 +1279,26 @@ class Dispersy(object):
                                    "(this message is undone)" if undone else "")
 
                     if have_packet < message.packet:
-                        # replace our current message with the other one
-                        self._database.execute(u"UPDATE sync SET packet = ? WHERE community = ? AND member = ? AND global_time = ?",
-                                               (buffer(message.packet), community.database_id, message.authentication.member.database_id, message.distribution.global_time))
+                        try:
+                            # the payload may not have been decoded yet (see Message.lazy_payload),
+                            # never replace our packet with one whose payload can not be decoded
+                            message.payload
+                        except (DropPacket, DelayPacket) as exception:
+                            logger.warning("not replacing %s %d@%d with a packet that can not be decoded (%s)",
+                                           message.name,
+                                           message.authentication.member.database_id,
+                                           message.distribution.global_time,
+                                           exception)
+
+                        else:
+                            # replace our current message with the other one
+                            digest = message.packet_digest
+                            self._database.execute(u"UPDATE sync SET packet = ?, digest = ? WHERE community = ? AND member = ? AND global_time = ?",
+                                                   (buffer(message.packet), buffer(digest), community.database_id, message.authentication.member.database_id, message.distribution.global_time))
+                            community.replace_duplicate_packet(str(have_digest), digest)
 
-                        # notify that global times have changed
-                        # community.update_sync_range(message.meta, [message.distribution.global_time])
+                            # notify that global times have changed
+                            # community.update_sync_range(message.meta, [message.distribution.global_time])
 
                 else:
                     logger.warning("received message with duplicate community/member/global-time triplet from %s.  possibly malicious behaviour", message.candidate)
@@ -1226,14 +1339,13 @@ class Dispersy(object):
         # refuse messages where the global time is unreasonably high
         acceptable_global_time = messages[0].community.acceptable_global_time
 
+        # obtain all stored messages with the same member and global time at once
+        existing = self._get_existing_sync_messages(messages)
+
         if enable_sequence_number:
-            # obtain the highest sequence_number from the database
-            highest = {}
-            for message in messages:
-                if not message.authentication.member.database_id in highest:
-                    last_global_time, seq = execute(u"SELECT MAX(global_time), COUNT(*) FROM sync WHERE member = ? AND meta_message = ?",
-                                                    (message.authentication.member.database_id, message.database_id)).next()
-                    highest[message.authentication.member.database_id] = (last_global_time or 0, seq)
+            # obtain the highest sequence_number for all members at once
+            sequence_cursors = messages[0].community.sequence_cursors
+            highest = sequence_cursors.get(messages[0].database_id, (message.authentication.member.database_id for message in messages))
 
             # all messages must follow the sequence_number order
             for message in messages:
@@ -1277,11 +1389,13 @@ class Dispersy(object):
                             execute(u"DELETE FROM sync WHERE member = ? AND meta_message = ? AND global_time >= ?",
                                     (message.authentication.member.database_id, message.database_id, global_time))
                             logger.debug("removed %d entries from sync because the member created multiple sequences", self._database.changes)
+                            message.community.dispersy_invalidate_sync()
 
-                            # by deleting messages we changed SEQ and the HIGHEST cache
-                            last_global_time, seq = execute(u"SELECT MAX(global_time), COUNT(*) FROM sync WHERE member = ? AND meta_message = ?",
-                                                       (message.authentication.member.database_id, message.database_id)).next()
-                            highest[message.authentication.member.database_id] = (last_global_time or 0, seq)
+                            # by deleting messages we changed SEQ, the HIGHEST cache, and EXISTING
+                            sequence_cursors.invalidate(message.database_id, message.authentication.member.database_id)
+                            highest.update(sequence_cursors.get(message.database_id, [message.authentication.member.database_id]))
+                            last_global_time, seq = highest[message.authentication.member.database_id]
+                            existing = self._get_existing_sync_messages(messages)
                             # we can allow MESSAGE to be processed
 
                 if seq + 1 != message.distribution.sequence_number:
@@ -1291,7 +1405,7 @@ class Dispersy(object):
 
                 # we have the previous message, check for duplicates based on community,
                 # member, and global_time
-                if self._is_duplicate_sync_message(message):
+                if self._is_duplicate_sync_message(message, existing):
                     # we have the previous message (drop)
                     yield DropMessage(message, "duplicate message by global_time (1)")
                     continue
@@ -1324,7 +1438,7 @@ class Dispersy(object):
                 unique.add(key)
 
                 # check for duplicates based on community, member, and global_time
-                if self._is_duplicate_sync_message(message):
+                if self._is_duplicate_sync_message(message, existing):
                     # we have the previous message (drop)
                     yield DropMessage(message, "duplicate message by global_time (2)")
                     continue
@@ -1384,13 +1498,10 @@ class Dispersy(object):
             else:
                 unique.add(key)
 
-                if not message.authentication.member.database_id in times:
-                    times[message.authentication.member.database_id] = [global_time for global_time, in self._database.execute(u"SELECT global_time FROM sync WHERE community = ? AND member = ? AND meta_message = ?",
-                                                                                                                               (message.community.database_id, message.authentication.member.database_id, message.database_id))]
-                    assert len(times[message.authentication.member.database_id]) <= message.distribution.history_size, [message.packet_id, message.distribution.history_size, times[message.authentication.member.database_id]]
+                assert len(times[message.authentication.member.database_id]) <= message.distribution.history_size, [message.packet_id, message.distribution.history_size, times[message.authentication.member.database_id]]
                 tim = times[message.authentication.member.database_id]
 
-                if message.distribution.global_time in tim and self._is_duplicate_sync_message(message):
+                if message.distribution.global_time in tim and self._is_duplicate_sync_message(message, existing):
                     return DropMessage(message, "duplicate message by member^global_time (3)")
 
                 elif len(tim) >= message.distribution.history_size and min(tim) > message.distribution.global_time:
@@ -1444,26 +1555,12 @@ class Dispersy(object):
                 else:
                     unique.add(key)
 
-                    if self._is_duplicate_sync_message(message):
+                    if self._is_duplicate_sync_message(message, existing):
                         # we have the previous message (drop)
                         logger.debug("drop %s %s@%d (_is_duplicate_sync_message)", message.name, members, message.distribution.global_time)
                         return DropMessage(message, "duplicate message by member^global_time (4)")
 
-                    if not members in times:
-                        # the next query obtains a list with all global times that we have in the
-                        # database for all message.meta messages that were signed by
-                        # message.authentication.members where the order of signing is not taken
-                        # into account.
-                        times[members] = dict((global_time, (packet_id, str(packet)))
-                                              for global_time, packet_id, packet
-                                              in self._database.execute(u"""
-SELECT sync.global_time, sync.id, sync.packet
-FROM sync
-JOIN double_signed_sync ON double_signed_sync.sync = sync.id
-WHERE sync.meta_message = ? AND double_signed_sync.member1 = ? AND double_signed_sync.member2 = ?
-""",
-                                                                        (message.database_id,) + members))
-                        assert len(times[members]) <= message.distribution.history_size, [len(times[members]), message.distribution.history_size]
+                    assert len(times[members]) <= message.distribution.history_size, [len(times[members]), message.distribution.history_size]
                     tim = times[members]
 
                     if message.distribution.global_time in tim:
@@ -1484,9 +1581,18 @@ WHERE sync.meta_message = ? AND double_signed_sync.member1 = ? AND double_signed
                                 logger.debug("received identical message with different member-order or signatures %s %s@%d from %s", message.name, members, message.distribution.global_time, message.candidate)
 
                                 if have_packet < message.packet:
+                                    try:
+                                        # the payload may not have been decoded yet, see
+                                        # _is_duplicate_sync_message
+                                        message.payload
+                                    except (DropPacket, DelayPacket) as exception:
+                                        return DropMessage(message, "not replacing existing packet with a packet that can not be decoded (%s)" % exception)
+
                                     # replace our current message with the other one
-                                    self._database.execute(u"UPDATE sync SET member = ?, packet = ? WHERE id = ?",
-                                                           (message.authentication.member.database_id, buffer(message.packet), packet_id))
+                                    digest = message.packet_digest
+                                    self._database.execute(u"UPDATE sync SET member = ?, packet = ?, digest = ? WHERE id = ?",
+                                                           (message.authentication.member.database_id, buffer(message.packet), buffer(digest), packet_id))
+                                    message.community.replace_duplicate_packet(sha1(have_packet).digest(), digest)
 
                                     return DropMessage(message, "replaced existing packet with other packet with the same payload")
 
@@ -1528,12 +1634,23 @@ WHERE sync.meta_message = ? AND double_signed_sync.member1 = ? AND double_signed
         # refuse messages that have been pruned (or soon will be)
         messages = [DropMessage(message, "message has been pruned") if isinstance(message, Message.Implementation) and not message.distribution.pruning.is_active() else message for message in messages]
 
+        # obtain all stored messages with the same member and global time at once
+        candidates = [message for message in messages if isinstance(message, Message.Implementation)]
+        existing = self._get_existing_sync_messages(candidates) if candidates else {}
+
         if isinstance(meta.authentication, MemberAuthentication):
             # a message is considered unique when (creator, global-time), i.r. (authentication.member,
             # distribution.global_time), is unique.  UNIQUE is used in the check_member_and_global_time
             # function
             unique = set()
-            times = {}
+
+            # obtain the global times that we have in the database for all members at once
+            times = dict((message.authentication.member.database_id, []) for message in candidates)
+            if times:
+                for member, global_time in self._database.execute(u"SELECT member, global_time FROM sync WHERE community = ? AND meta_message = ? AND member IN (%s)" % u", ".join(unicode(member) for member in times),
+                                                                  (meta.community.database_id, meta.database_id)):
+                    times[member].append(global_time)
+
             messages = [message if isinstance(message, DropMessage) else check_member_and_global_time(unique, times, message) for message in messages]
 
         # instead of storing HISTORY_SIZE messages for each authentication.member, we will store
@@ -1541,7 +1658,22 @@ WHERE sync.meta_message = ? AND double_signed_sync.member1 = ? AND double_signed
         else:
             assert isinstance(meta.authentication, DoubleMemberAuthentication)
             unique = set()
-            times = {}
+
+            # the next query obtains all global times that we have in the database for all
+            # meta messages that were signed by the authentication.members of any of the messages,
+            # where the order of signing is not taken into account.
+            times = dict((tuple(sorted(member.database_id for member in message.authentication.members)), {}) for message in candidates)
+            if times:
+                members = set(member for key in times for member in key)
+                for global_time, packet_id, packet, member1, member2 in self._database.execute(u"""
+SELECT sync.global_time, sync.id, sync.packet, double_signed_sync.member1, double_signed_sync.member2
+FROM sync
+JOIN double_signed_sync ON double_signed_sync.sync = sync.id
+WHERE sync.meta_message = ? AND double_signed_sync.member1 IN (%s) AND double_signed_sync.member2 IN (%s)
+""" % ((u", ".join(unicode(member) for member in members),) * 2), (meta.database_id,)):
+                    if (member1, member2) in times:
+                        times[(member1, member2)][global_time] = (packet_id, str(packet))
+
             messages = [message if isinstance(message, DropMessage) else check_double_member_and_global_time(unique, times, message) for message in messages]
 
         return messages
@@ -1730,30 +1862,7 @@ WHERE sync.meta_message = ? AND double_signed_sync.member1 = ? AND double_signed
 
             # schedule batch processing (taking into account the message priority)
             if meta.batch.enabled and cache:
-                if meta in self._batch_cache:
-                    task_identifier, current_timestamp, current_batch = self._batch_cache[meta]
-                    current_batch.extend(batch)
-                    logger.debug("adding %d %s messages to existing cache", len(batch), meta.name)
-
-                else:
-                    current_timestamp = timestamp
-                    current_batch = batch
-                    task_identifier = self._callback.register(self._on_batch_cache_timeout, (meta, current_timestamp, current_batch), delay=meta.batch.max_window, priority=meta.batch.priority)
-                    self._batch_cache[meta] = (task_identifier, current_timestamp, current_batch)
-                    logger.debug("new cache with %d %s messages (batch window: %d)", len(batch), meta.name, meta.batch.max_window)
-
-                while len(current_batch) > meta.batch.max_size:
-                    # batch exceeds maximum size, schedule first max_size immediately
-                    batch, current_batch = current_batch[:meta.batch.max_size], current_batch[meta.batch.max_size:]
-                    logger.debug("schedule processing %d %s messages immediately (exceeded batch size)", len(batch), meta.name)
-                    self._callback.register(self._on_batch_cache_timeout, (meta, current_timestamp, batch), priority=meta.batch.priority)
-
-                    # we can not use callback.replace_register because
-                    # it would not re-schedule the task, i.e. not at
-                    # the end of the task queue
-                    self._callback.unregister(task_identifier)
-                    task_identifier = self._callback.register(self._on_batch_cache_timeout, (meta, timestamp, current_batch), delay=meta.batch.max_window, priority=meta.batch.priority)
-                    self._batch_cache[meta] = (task_identifier, timestamp, current_batch)
+                self._batch_scheduler.add(meta, timestamp, batch)
 
             else:
                 # ignore cache, process batch immediately
@@ -1765,7 +1874,7 @@ WHERE sync.meta_message = ? AND double_signed_sync.member1 = ? AND double_signed
         Start processing a batch of messages once the cache timeout occurs.
 
         This method is called meta.batch.max_window seconds after the first message in this batch
-        arrived.  All messages in this batch have been 'cached' together in self._batch_cache[meta].
+        arrived.  All messages in this batch have been 'cached' together by self._batch_scheduler.
         Hopefully the delay caused the batch to collect as many messages as possible.
         """
         assert isinstance(meta, Message)
@@ -1774,10 +1883,6 @@ WHERE sync.meta_message = ? AND double_signed_sync.member1 = ? AND double_signed
         assert len(batch) > 0
         logger.debug("processing %sx %s batched messages", len(batch), meta.name)
 
-        if meta in self._batch_cache and id(self._batch_cache[meta][2]) == id(batch):
-            logger.debug("pop batch cache for %sx %s", len(batch), meta.name)
-            self._batch_cache.pop(meta)
-
         if not self._communities.get(meta.community.cid, None) == meta.community:
             logger.warning("dropped %sx %s packets (community no longer loaded)", len(batch), meta.name)
             self._statistics.dict_inc(self._statistics.drop, "on_batch_cache_timeout: community no longer loaded", len(batch))
@@ -1839,6 +1944,7 @@ WHERE sync.meta_message = ? AND double_signed_sync.member1 = ? AND double_signed
          1. Messages created by a member in our blacklist are droped.
 
          2. Messages that are old or duplicate, based on their distribution policy, are dropped.
+            When meta.lazy_payload is enabled, the payload of the remaining messages is decoded now.
 
          3. The meta.check_callback(...) is used to allow messages to be dropped or delayed.
 
@@ -1889,6 +1995,12 @@ WHERE sync.meta_message = ? AND double_signed_sync.member1 = ? AND double_signed
         if not messages:
             return 0
 
+        # decode the payload of the remaining messages, when this was postponed
+        if meta.lazy_payload:
+            messages = list(self._decode_lazy_payloads(messages))
+            if not messages:
+                return 0
+
         # check all remaining messages on the community side.  may yield Message.Implementation,
         # DropMessage, and DelayMessage instances
         try:
@@ -1955,7 +2067,15 @@ WHERE sync.meta_message = ? AND double_signed_sync.member1 = ? AND double_signed
         assert all(isinstance(packet[0], Candidate) for packet in packets)
         assert all(isinstance(packet[1], str) for packet in packets)
 
+        dispatch_table = self._dispatch_table
         for candidate, packet in packets:
+            # find associated community, conversion, and meta message using a single lookup
+            entry = dispatch_table.get(packet[:23])
+            if entry:
+                _, conversion, meta = entry
+                yield meta, candidate, packet, conversion
+                continue
+
             # find associated community
             try:
                 community = self.get_community(packet[2:22])
@@ -1991,14 +2111,34 @@ WHERE sync.meta_message = ? AND double_signed_sync.member1 = ? AND double_signed
         assert all(isinstance(x, tuple) for x in batch)
         assert all(len(x) == 3 for x in batch)
 
+        # drop exact duplicates of stored packets before verifying and decoding them.  the digest
+        # is computed once, it is reused by the signature cache and when the message is stored
+        remaining = []
+        digests = []
         for candidate, packet, conversion in batch:
             assert isinstance(candidate, Candidate)
             assert isinstance(packet, str)
             assert isinstance(conversion, Conversion)
 
+            digest = sha1(packet).digest()
+            if conversion.community.is_duplicate_packet(digest):
+                logger.debug("drop a %d byte packet (duplicate packet) from %s", len(packet), candidate)
+                self._statistics.dict_inc(self._statistics.drop, u"_convert_batch_into_messages:duplicate packet")
+                self._statistics.drop_count += 1
+                continue
+
+            remaining.append((candidate, packet, conversion))
+            digests.append(digest)
+
+        # verify the signatures of the remaining packets at once, the packets with a valid signature
+        # are decoded without verifying them again.  all other packets are decoded (and verified)
+        # as usual
+        verified = self._verify_batch(remaining) if self._verification_pool and remaining else ()
+
+        for index, ((candidate, packet, conversion), digest) in enumerate(zip(remaining, digests)):
             try:
                 # convert binary data to internal Message
-                yield conversion.decode_message(candidate, packet)
+                yield conversion.decode_message(candidate, packet, verify=not index in verified, lazy=True, digest=digest)
 
             except DropPacket as exception:
                 logger.warning("drop a %d byte packet (%s) from %s", len(packet), exception, candidate)
@@ -2012,6 +2152,57 @@ WHERE sync.meta_message = ? AND double_signed_sync.member1 = ? AND double_signed
                 self._statistics.dict_inc(self._statistics.delay, "_convert_batch_into_messages:%s" % delay)
                 self._statistics.delay_count += 1
 
+    def _decode_lazy_payloads(self, messages):
+        """
+        Decode the payload of MESSAGES whose payload was not decoded yet.
+
+        Yields the messages whose payload could be decoded, the others are dropped or delayed in the
+        same way as packets that fail to decode in _convert_batch_into_messages.
+        """
+        for message in messages:
+            if message.is_payload_decoded:
+                yield message
+                continue
+
+            try:
+                message.payload
+
+            except DropPacket as exception:
+                logger.warning("drop a %d byte packet (%s) from %s", len(message.packet), exception, message.candidate)
+                self._statistics.dict_inc(self._statistics.drop, "_decode_lazy_payloads:%s" % exception)
+                self._statistics.drop_count += 1
+
+            except DelayPacket as delay:
+                logger.debug("delay a %d byte packet (%s) from %s", len(message.packet), delay, message.candidate)
+                if delay.create_request(message.candidate, message.packet):
+                    self._statistics.delay_send += 1
+                self._statistics.dict_inc(self._statistics.delay, "_decode_lazy_payloads:%s" % delay)
+                self._statistics.delay_count += 1
+
+            else:
+                yield message
+
+    def _verify_batch(self, batch):
+        """
+        Verify the signatures in BATCH using the verification pool.
+
+        Returns a set with the indexes of the packets in BATCH that have a valid signature.
+        """
+        indexes = []
+        triples = []
+        for index, (_, packet, conversion) in enumerate(batch):
+            triple = conversion.get_signature_triple(packet)
+            if triple:
+                indexes.append(index)
+                triples.append(triple)
+
+        if triples:
+            results = self._verification_pool.verify(triples)
+            self._statistics.dict_inc(self._statistics.success, u"verification-pool-valid", sum(results))
+            self._statistics.dict_inc(self._statistics.drop, u"verification-pool-invalid", len(results) - sum(results))
+            return set(index for index, result in zip(indexes, results) if result)
+        return set()
+
     def _store(self, messages):
         """
         Store a message in the database.
@@ -2041,87 +2232,80 @@ WHERE sync.meta_message = ? AND double_signed_sync.member1 = ? AND double_signed
         meta = messages[0].meta
         logger.debug("attempting to store %d %s messages", len(messages), meta.name)
         is_double_member_authentication = isinstance(meta.authentication, DoubleMemberAuthentication)
-        highest_global_time = 0
 
-        # update_sync_range = set()
+        if __debug__:
+            for message in messages:
+                # the signature must be set
+                assert isinstance(message.authentication, (MemberAuthentication.Implementation, DoubleMemberAuthentication.Implementation)), message.authentication
+                assert message.authentication.is_signed
+                assert not message.packet[-10:] == "\x00" * 10, message.packet[-10:].encode("HEX")
+                # we must have the identity message as well
+                assert message.authentication.encoding == "bin" or message.authentication.member.has_identity(message.community), [message, message.community, message.authentication.member.database_id]
+                logger.debug("%s %d@%d", message.name, message.authentication.member.database_id, message.distribution.global_time)
+
+        # add packets to database
+        self._database.executemany(u"INSERT INTO sync (community, member, global_time, meta_message, packet, digest) VALUES (?, ?, ?, ?, ?, ?)",
+                                   [(message.community.database_id,
+                                     message.authentication.member.database_id,
+                                     message.distribution.global_time,
+                                     message.database_id,
+                                     buffer(message.packet),
+                                     buffer(message.packet_digest))
+                                    for message in messages])
+        if __debug__:
+            # must have stored one entry for each message
+            assert self._database.changes == len(messages), [self._database.changes, len(messages)]
+            # when sequence numbers are enabled, we must have exactly
+            # message.distribution.sequence_number messages in the database
+            if isinstance(meta.distribution, FullSyncDistribution) and meta.distribution.enable_sequence_number:
+                sequence_numbers = {}
+                for message in messages:
+                    member = message.authentication.member.database_id
+                    sequence_numbers[member] = max(sequence_numbers.get(member, 0), message.distribution.sequence_number)
+                for member, count_ in self._database.execute(u"SELECT member, COUNT(*) FROM sync WHERE meta_message = ? AND member IN (%s) GROUP BY member" % u", ".join(unicode(member) for member in sequence_numbers),
+                                                             (meta.database_id,)):
+                    assert count_ == sequence_numbers[member], [count_, sequence_numbers[member]]
+
+        # ensure that we can reference these packets, the row ids are recovered using one query
+        existing = self._get_existing_sync_messages(messages)
         for message in messages:
-            # the signature must be set
-            assert isinstance(message.authentication, (MemberAuthentication.Implementation, DoubleMemberAuthentication.Implementation)), message.authentication
-            assert message.authentication.is_signed
-            assert not message.packet[-10:] == "\x00" * 10, message.packet[-10:].encode("HEX")
-            # we must have the identity message as well
-            assert message.authentication.encoding == "bin" or message.authentication.member.has_identity(message.community), [message, message.community, message.authentication.member.database_id]
-
-            logger.debug("%s %d@%d", message.name, message.authentication.member.database_id, message.distribution.global_time)
-
-            # add packet to database
-            self._database.execute(u"INSERT INTO sync (community, member, global_time, meta_message, packet) VALUES (?, ?, ?, ?, ?)",
-                    (message.community.database_id,
-                     message.authentication.member.database_id,
-                     message.distribution.global_time,
-                     message.database_id,
-                     buffer(message.packet)))
-            # update_sync_range.add(message.distribution.global_time)
-            if __debug__:
-                # must have stored one entry
-                assert self._database.changes == 1
-                # when sequence numbers are enabled, we must have exactly
-                # message.distribution.sequence_number messages in the database
-                if isinstance(message.distribution, FullSyncDistribution) and message.distribution.enable_sequence_number:
-                    count_ = self._database.execute(u"SELECT COUNT(*) FROM sync WHERE meta_message = ? AND member = ?", (message.database_id, message.authentication.member.database_id)).next()
-                    assert count_ == message.distribution.sequence_number, [count_, message.distribution.sequence_number]
-
-            # ensure that we can reference this packet
-            message.packet_id = self._database.last_insert_rowid
+            message.packet_id = existing[(message.authentication.member.database_id, message.distribution.global_time)][0]
             logger.debug("stored message %s in database at row %d", message.name, message.packet_id)
 
-            if is_double_member_authentication:
-                member1 = message.authentication.members[0].database_id
-                member2 = message.authentication.members[1].database_id
-                self._database.execute(u"INSERT INTO double_signed_sync (sync, member1, member2) VALUES (?, ?, ?)",
-                                       (message.packet_id, member1, member2) if member1 < member2 else (message.packet_id, member2, member1))
-                assert self._database.changes == 1
+        if is_double_member_authentication:
+            order = lambda member1, member2: (member1, member2) if member1 < member2 else (member2, member1)
+            self._database.executemany(u"INSERT INTO double_signed_sync (sync, member1, member2) VALUES (?, ?, ?)",
+                                       [(message.packet_id,) + order(message.authentication.members[0].database_id, message.authentication.members[1].database_id)
+                                        for message in messages])
+            assert self._database.changes == len(messages)
 
-            # update global time
-            highest_global_time = max(highest_global_time, message.distribution.global_time)
+        # update global time
+        highest_global_time = max(message.distribution.global_time for message in messages)
 
         if isinstance(meta.distribution, LastSyncDistribution):
-            # delete packets that have become obsolete
-            items = set()
+            # delete packets that have become obsolete, the obsolete packets for the entire batch are
+            # found using one query
             if is_double_member_authentication:
-                order = lambda member1, member2: (member1, member2) if member1 < member2 else (member2, member1)
-                for member1, member2 in set(order(message.authentication.members[0].database_id, message.authentication.members[1].database_id) for message in messages):
-                    assert member1 < member2, [member1, member2]
-                    all_items = list(self._database.execute(u"""
-SELECT sync.id, sync.global_time
-FROM sync
-JOIN double_signed_sync ON double_signed_sync.sync = sync.id
-WHERE sync.meta_message = ? AND double_signed_sync.member1 = ? AND double_signed_sync.member2 = ?
-ORDER BY sync.global_time, sync.packet""", (meta.database_id, member1, member2)))
-                    if len(all_items) > meta.distribution.history_size:
-                        items.update(all_items[:len(all_items) - meta.distribution.history_size])
-
+                items = self._database.get_obsolete_double_last_sync(meta.database_id,
+                                                                     set(order(message.authentication.members[0].database_id, message.authentication.members[1].database_id) for message in messages),
+                                                                     meta.distribution.history_size)
             else:
-                for member_database_id in set(message.authentication.member.database_id for message in messages):
-                    all_items = list(self._database.execute(u"""
-SELECT id, global_time
-FROM sync
-WHERE meta_message = ? AND member = ?
-ORDER BY global_time""", (meta.database_id, member_database_id)))
-                    if len(all_items) > meta.distribution.history_size:
-                        items.update(all_items[:len(all_items) - meta.distribution.history_size])
+                items = self._database.get_obsolete_last_sync(meta.database_id,
+                                                              set(message.authentication.member.database_id for message in messages),
+                                                              meta.distribution.history_size)
 
             if items:
-                self._database.executemany(u"DELETE FROM sync WHERE id = ?", [(syncid,) for syncid, _ in items])
+                # the packet ids are integers, embedding them in the query avoids the sqlite limit on
+                # the number of bindings
+                packet_ids = u", ".join(unicode(syncid) for syncid, _, _ in items)
+                self._database.execute(u"DELETE FROM sync WHERE id IN (%s)" % packet_ids)
                 assert len(items) == self._database.changes
                 logger.debug("deleted %d messages", self._database.changes)
 
                 if is_double_member_authentication:
-                    self._database.executemany(u"DELETE FROM double_signed_sync WHERE sync = ?", [(syncid,) for syncid, _ in items])
+                    self._database.execute(u"DELETE FROM double_signed_sync WHERE sync IN (%s)" % packet_ids)
                     assert len(items) == self._database.changes
 
-                # update_sync_range.update(global_time for _, _, global_time in items)
-
             # 12/10/11 Boudewijn: verify that we do not have to many packets in the database
             if __debug__:
                 if not is_double_member_authentication:
@@ -2134,6 +2318,9 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
 
         meta.community.dispersy_store(messages)
 
+        if isinstance(meta.distribution, LastSyncDistribution) and items:
+            meta.community.dispersy_remove_sync(meta, [global_time for _, global_time, _ in items], [digest for _, _, digest in items])
+
         # if update_sync_range:
         # notify that global times have changed
         #     meta.community.update_sync_range(meta, update_sync_range)
@@ -2231,12 +2418,11 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
 
         else:
             # flush any sync-able items left in the cache before we create a sync
-            flush_list = [(meta, tup) for meta, tup in self._batch_cache.iteritems() if meta.community == community and isinstance(meta.distribution, SyncDistribution)]
-            flush_list.sort(key=lambda tup: tup[0].batch.priority, reverse=True)
-            for meta, (task_identifier, timestamp, batch) in flush_list:
-                logger.debug("flush cached %dx %s messages (id: %s)", len(batch), meta.name, task_identifier)
-                self._callback.unregister(task_identifier)
-                self._on_batch_cache_timeout(meta, timestamp, batch)
+            flush_list = [meta for meta in self._batch_scheduler if meta.community == community and isinstance(meta.distribution, SyncDistribution)]
+            flush_list.sort(key=lambda meta: meta.batch.priority, reverse=True)
+            for meta in flush_list:
+                logger.debug("flush cached %s messages", meta.name)
+                self._batch_scheduler.flush(meta)
 
             sync = community.dispersy_claim_sync_bloom_filter(cache)
             if __debug__:
@@ -2248,7 +2434,7 @@ ORDER BY global_time""", (meta.database_id, member_database_id)))
                     assert isinstance(time_high, (int, long)), time_high
                     assert isinstance(modulo, int), modulo
                     assert isinstance(offset, int), offset
-                    assert isinstance(bloom_filter, BloomFilter), bloom_filter
+                    assert isinstance(bloom_filter, (BloomFilter, InvertibleBloomFilter)), bloom_filter
 
                     # verify that the bloom filter is correct
                     try:
@@ -2265,20 +2451,30 @@ WHERE sync.community = ? AND meta_message.priority > 32 AND sync.undone = 0 AND
                         logger.exception("the sqlite3 python module can not handle values 2**63 or larger.  limit time_low and time_high to 2**63-1")
                         assert False
 
-                    # BLOOM_FILTER must be the same after transmission
-                    test_bloom_filter = BloomFilter(bloom_filter.bytes, bloom_filter.functions, prefix=bloom_filter.prefix)
-                    assert bloom_filter.bytes == test_bloom_filter.bytes, "problem with the long <-> binary conversion"
-                    assert list(bloom_filter.not_filter((packet,) for packet in packets)) == [], "does not have all correct bits set before transmission"
-                    assert list(test_bloom_filter.not_filter((packet,) for packet in packets)) == [], "does not have all correct bits set after transmission"
-
-                    # BLOOM_FILTER must have been correctly filled
-                    test_bloom_filter.clear()
-                    test_bloom_filter.add_keys(packets)
-                    if not bloom_filter.bytes == bloom_filter.bytes:
-                        if bloom_filter.bits_checked < test_bloom_filter.bits_checked:
-                            logger.error("%d bits in: %s", bloom_filter.bits_checked, bloom_filter.bytes.encode("HEX"))
-                            logger.error("%d bits in: %s", test_bloom_filter.bits_checked, test_bloom_filter.bytes.encode("HEX"))
-                            assert False, "does not match the given range [%d:%d] %%%d+%d packets:%d" % (time_low, time_high, modulo, offset, len(packets))
+                    if isinstance(bloom_filter, InvertibleBloomFilter):
+                        # BLOOM_FILTER must be the same after transmission and contain all PACKETS
+                        test_bloom_filter = InvertibleBloomFilter(bloom_filter.bytes, bloom_filter.functions)
+                        assert bloom_filter.bytes == test_bloom_filter.bytes, "problem with the binary conversion"
+                        for packet in packets:
+                            test_bloom_filter.add_key(InvertibleBloomFilter.get_key(sha1(packet).digest()), -1)
+                        success, _, negative = test_bloom_filter.decode()
+                        assert not (success and negative), "does not match the given range [%d:%d] %%%d+%d packets:%d" % (time_low, time_high, modulo, offset, len(packets))
+
+                    else:
+                        # BLOOM_FILTER must be the same after transmission
+                        test_bloom_filter = BloomFilter(bloom_filter.bytes, bloom_filter.functions, prefix=bloom_filter.prefix, double_hashing=bloom_filter.double_hashing)
+                        assert bloom_filter.bytes == test_bloom_filter.bytes, "problem with the bytearray <-> binary conversion"
+                        assert list(bloom_filter.not_filter((packet,) for packet in packets)) == [], "does not have all correct bits set before transmission"
+                        assert list(test_bloom_filter.not_filter((packet,) for packet in packets)) == [], "does not have all correct bits set after transmission"
+
+                        # BLOOM_FILTER must have been correctly filled
+                        test_bloom_filter.clear()
+                        test_bloom_filter.add_keys(packets)
+                        if not bloom_filter.bytes == bloom_filter.bytes:
+                            if bloom_filter.bits_checked < test_bloom_filter.bits_checked:
+                                logger.error("%d bits in: %s", bloom_filter.bits_checked, bloom_filter.bytes.encode("HEX"))
+                                logger.error("%d bits in: %s", test_bloom_filter.bits_checked, test_bloom_filter.bytes.encode("HEX"))
+                                assert False, "does not match the given range [%d:%d] %%%d+%d packets:%d" % (time_low, time_high, modulo, offset, len(packets))
 
         if destination.get_destination_address(self._wan_address) != destination.sock_addr:
             logger.warning("destination address, %s should (in theory) be the sock_addr %s", destination.get_destination_address(self._wan_address), destination)
@@ -2287,7 +2483,7 @@ WHERE sync.community = ? AND meta_message.priority > 32 AND sync.undone = 0 AND
         request = meta_request.impl(authentication=(community.my_member,),
                                     distribution=(community.global_time,),
                                     destination=(destination,),
-                                    payload=(destination.get_destination_address(self._wan_address), self._lan_address, self._wan_address, advice, self._connection_type, sync, identifier))
+                                    payload=(destination.get_destination_address(self._wan_address), self._lan_address, self._wan_address, advice, self._connection_type, sync, identifier, True))
 
         if forward:
             if sync:
@@ -2358,6 +2554,7 @@ WHERE sync.community = ? AND meta_message.priority > 32 AND sync.undone = 0 AND
             # update sender candidate
             source_lan_address, source_wan_address = self.estimate_lan_and_wan_addresses(candidate.sock_addr, payload.source_lan_address, payload.source_wan_address)
             candidate.update(candidate.tunnel, source_lan_address, source_wan_address, payload.connection_type)
+            candidate.double_hashing_support = payload.double_hashing_support
             candidate.stumble(now)
             community.add_candidate(candidate)
 
@@ -2410,23 +2607,23 @@ WHERE sync.community = ? AND meta_message.priority > 32 AND sync.undone = 0 AND
         meta_messages = [(meta.distribution.priority, -meta.distribution.synchronization_direction_value, meta) for meta in community.get_meta_messages() if isinstance(meta.distribution, SyncDistribution) and meta.distribution.priority > 32]
         meta_messages.sort(reverse=True)
 
-        sub_selects = []
-        for _, _, meta in meta_messages:
-            sub_selects.append(u"""
+        sub_select = u"""
  SELECT * FROM
-  (SELECT sync.packet FROM sync
+  (SELECT %s FROM sync
    WHERE sync.meta_message = ? AND sync.undone = 0 AND sync.global_time BETWEEN ? AND ? AND (sync.global_time + ?) %% ? = 0
-   ORDER BY sync.global_time %s)""" % (meta.distribution.synchronization_direction,))
+   ORDER BY sync.global_time %s)"""
 
-        sql = "".join((u"SELECT * FROM (", " UNION ALL ".join(sub_selects), ")"))
+        def get_sql(columns):
+            sub_selects = [sub_select % (columns, meta.distribution.synchronization_direction) for _, _, meta in meta_messages]
+            return "".join((u"SELECT * FROM (", " UNION ALL ".join(sub_selects), ")"))
+
+        sql = get_sql(u"sync.packet")
         logger.debug(sql)
 
         for message in messages:
             payload = message.payload
 
             if payload.sync:
-                # we limit the response by byte_limit bytes
-                byte_limit = community.dispersy_sync_response_limit
                 time_high = payload.time_high if payload.has_time_high else community.global_time
 
                 # 07/05/12 Boudewijn: for an unknown reason values larger than 2^63-1 cause
@@ -2434,31 +2631,201 @@ WHERE sync.community = ? AND meta_message.priority > 32 AND sync.undone = 0 AND
                 # 26/02/13 Boudewijn: time_low and time_high must now be given once for every
                 # sub_selects, taking into account that time_low may not be below the
                 # inactive_threshold (if given)
-                sql_arguments = []
-                for _, _, meta in meta_messages:
-                    sql_arguments.extend((meta.database_id,
-                                          min(max(payload.time_low, community.global_time - meta.distribution.pruning.inactive_threshold + 1), 2 ** 63 - 1) if isinstance(meta.distribution.pruning, GlobalTimePruning) else min(payload.time_low, 2 ** 63 - 1),
-                                          min(time_high, 2 ** 63 - 1),
-                                          long(payload.offset),
-                                          long(payload.modulo)))
+                windows = tuple((meta.database_id,
+                                 min(max(payload.time_low, community.global_time - meta.distribution.pruning.inactive_threshold + 1), 2 ** 63 - 1) if isinstance(meta.distribution.pruning, GlobalTimePruning) else min(payload.time_low, 2 ** 63 - 1),
+                                 min(time_high, 2 ** 63 - 1),
+                                 long(payload.offset),
+                                 long(payload.modulo))
+                                for _, _, meta
+                                in meta_messages)
+                sql_arguments = [argument for window in windows for argument in window]
                 logger.debug("%s", sql_arguments)
 
-                packets = []
-                generator = ((str(packet),) for packet, in self._database.execute(sql, sql_arguments))
+                if payload.invertible_bloom_filter:
+                    # the difference between our packets and the packets of the requester in the
+                    # given range is obtained from the packet digests alone, only the packets that
+                    # are missing are retrieved from the database
+                    invertible_bloom_filter = InvertibleBloomFilter(payload.invertible_bloom_filter.size, payload.invertible_bloom_filter.functions)
+                    keys = []
+                    for packet_id, digest in self._database.execute(get_sql(u"sync.id, sync.digest"), sql_arguments):
+                        key = InvertibleBloomFilter.get_key(str(digest))
+                        invertible_bloom_filter.add_key(key)
+                        keys.append((key, packet_id))
+
+                    success, missing, _ = invertible_bloom_filter.subtract(payload.invertible_bloom_filter).decode()
+                    if success:
+                        community.statistics.sync_invertible_decode_success += 1
+                    else:
+                        # the difference is too large to decode completely.  the keys that were
+                        # decoded are still valid, hence we send those packets anyway
+                        community.statistics.sync_invertible_decode_failure += 1
+                        logger.debug("unable to decode the invertible bloom filter from %s completely", message.candidate)
+
+                    packet_ids = [packet_id for key, packet_id in keys if key in missing]
+                    if not packet_ids:
+                        continue
+
+                    id_packets = dict((packet_id, str(packet))
+                                      for packet_id, packet
+                                      in self._database.execute(u"SELECT id, packet FROM sync WHERE id IN (%s)" % u", ".join(unicode(packet_id) for packet_id in packet_ids)))
+                    packets = (id_packets[packet_id] for packet_id in packet_ids)
+
+                elif self._sync_response_pool:
+                    # the packets are selected on one of the worker threads
+                    if not self._sync_response_pool.submit(self._select_sync_response, (sql, sql_arguments, payload.bloom_filter, community.dispersy_sync_response_limit),
+                                                           self._start_sync_response, (community, message.candidate)):
+                        logger.debug("too many pending sync responses, ignoring sync from %s", message.candidate)
+                        self._statistics.dict_inc(self._statistics.outgoing, u"-sync-pool-full-")
+                    continue
+
+                else:
+                    # requests for the same sync range are common, the packets in that range are
+                    # kept for a few seconds to avoid repeating the query.  requests without
+                    # time_high share one entry, regardless of our current global time
+                    cache_windows = windows if payload.has_time_high else tuple((meta_message, time_low, 0, offset, modulo) for meta_message, time_low, _, offset, modulo in windows)
+                    sync_packets = community.sync_response_cache.get(cache_windows)
+                    if sync_packets is None:
+                        community.statistics.sync_response_cache_miss += 1
+                        packets = self._select_and_cache_sync_response(community, cache_windows, sql, sql_arguments, payload.bloom_filter)
+                    else:
+                        community.statistics.sync_response_cache_hit += 1
+                        packets = (packet for packet, in payload.bloom_filter.not_filter((packet,) for packet in sync_packets))
+
+                # the missing packets are found while the response is being sent
+                self._start_sync_response(packets, community, message.candidate)
 
-                for packet, in payload.bloom_filter.not_filter(generator):
-                    logger.debug("found missing (%d bytes) %s for %s", len(packet), sha1(packet).digest().encode("HEX"), message.candidate)
+    def _select_and_cache_sync_response(self, community, windows, sql, sql_arguments, bloom_filter):
+        """
+        Returns a list with the packets selected by SQL that are not in BLOOM_FILTER, up to
+        community.dispersy_sync_response_limit bytes.
 
+        The rows are read in chunks and reading stops once this limit is reached.  However, as long
+        as all packets selected by SQL fit in one community.sync_response_cache entry, the rows are
+        read completely and the packets are stored in the cache for WINDOWS.
+        """
+        cache = community.sync_response_cache
+        byte_limit = community.dispersy_sync_response_limit
+        packets = []
+        # all packets selected by SQL, or None when they do not fit in one cache entry
+        window_packets = []
+        window_bytes = 0
+
+        rows = (str(packet) for packet, in self._database.execute(sql, sql_arguments))
+        while byte_limit > 0 or window_packets is not None:
+            chunk = list(islice(rows, 256))
+            if not chunk:
+                break
+
+            if window_packets is not None:
+                window_bytes += sum(len(packet) for packet in chunk)
+                if window_bytes > cache.entry_bytes:
+                    window_packets = None
+                else:
+                    window_packets.extend(chunk)
+
+            if byte_limit > 0:
+                for packet, in bloom_filter.not_filter((packet,) for packet in chunk):
                     packets.append(packet)
                     byte_limit -= len(packet)
                     if byte_limit <= 0:
-                        logger.debug("bandwidth throttle")
                         break
 
-                if packets:
-                    logger.debug("syncing %d packets (%d bytes) to %s", len(packets), sum(len(packet) for packet in packets), message.candidate)
-                    self._statistics.dict_inc(self._statistics.outgoing, u"-sync-", len(packets))
-                    self._endpoint.send([message.candidate], packets)
+        if window_packets is not None:
+            cache.set(windows, window_packets)
+        return packets
+
+    @staticmethod
+    def _select_sync_response(database, sql, sql_arguments, bloom_filter, byte_limit):
+        """
+        Returns a list with the packets selected by SQL that are not in BLOOM_FILTER, up to
+        BYTE_LIMIT bytes.
+
+        This method is called on a DatabaseReadPool thread, DATABASE is a ReadConnection.
+        """
+        packets = []
+        for packet, in bloom_filter.not_filter((str(packet),) for packet, in database.execute(sql, sql_arguments)):
+            packets.append(packet)
+            byte_limit -= len(packet)
+            if byte_limit <= 0:
+                break
+        return packets
+
+    def _start_sync_response(self, packets, community, candidate):
+        """
+        Start sending the missing PACKETS to CANDIDATE.
+
+        A newer sync response to the same candidate replaces any response that is still in
+        progress.
+        """
+        key = (community.cid, candidate.sock_addr)
+        packets = iter(packets)
+        self._sync_responses[key] = packets
+        sync_response = self._send_sync_response(key, community, candidate, packets)
+
+        # the first burst is sent immediately, the remainder is paced by the callback
+        for delay in sync_response:
+            self._callback.register(lambda: sync_response, delay=delay)
+            break
+
+    def _send_sync_response(self, key, community, candidate, packets):
+        """
+        Send the missing PACKETS to CANDIDATE, in response to a sync request.
+
+        PACKETS is an iterator that is only consumed as far as needed.  At most
+        community.dispersy_sync_response_limit bytes are sent, in bursts of
+        community.dispersy_sync_response_burst bytes that are
+        community.dispersy_sync_response_interval seconds apart.  No new burst is created while
+        the endpoint still has packets waiting in its send queue, i.e. while the socket is not
+        writable, preventing sync responses from starving other traffic.  The response is given up
+        when the endpoint is still congested after community.dispersy_sync_response_deadline
+        seconds.
+
+        The response stops when a newer response for KEY is registered in self._sync_responses.
+        """
+        byte_limit = community.dispersy_sync_response_limit
+        burst_limit = community.dispersy_sync_response_burst
+        interval = community.dispersy_sync_response_interval
+        deadline = time() + community.dispersy_sync_response_deadline
+
+        try:
+            while byte_limit > 0:
+                if not self._sync_responses.get(key) is packets:
+                    logger.debug("sync response to %s is replaced", candidate)
+                    break
+
+                if self._endpoint.cur_sendqueue:
+                    if time() > deadline:
+                        logger.debug("endpoint congested, giving up sync response to %s", candidate)
+                        break
+                    yield interval
+                    continue
+
+                burst = []
+                burst_bytes = 0
+                for packet in packets:
+                    logger.debug("found missing (%d bytes) %s for %s", len(packet), sha1(packet).digest().encode("HEX"), candidate)
+                    burst.append(packet)
+                    burst_bytes += len(packet)
+                    if burst_bytes >= min(burst_limit, byte_limit):
+                        break
+
+                if not burst:
+                    break
+
+                logger.debug("syncing %d packets (%d bytes) to %s", len(burst), burst_bytes, candidate)
+                self._statistics.dict_inc(self._statistics.outgoing, u"-sync-", len(burst))
+                self._endpoint.send([candidate], burst)
+
+                byte_limit -= burst_bytes
+                if byte_limit > 0:
+                    yield interval
+
+            else:
+                logger.debug("bandwidth throttle")
+
+        finally:
+            if self._sync_responses.get(key) is packets:
+                del self._sync_responses[key]
 
     def check_introduction_response(self, messages):
         for message in messages:
@@ -2688,7 +3055,10 @@ WHERE sync.community = ? AND meta_message.priority > 32 AND sync.undone = 0 AND
         database commit not after the (1) store operation but after the (2) update operation.  This
         will ensure that any database changes from handling the message are also synced to disk.  It
         is important to note that the sync will occur before the (3) forward operation to ensure
-        that no remote nodes will obtain data that we have not safely synced ourselves.
+        that no remote nodes will obtain data that we have not safely synced ourselves.  When group
+        commit is enabled the forward operation of our own messages is delayed until the commit is
+        performed, see enable_group_commit.  In this case True is returned, regardless of the result
+        of the delayed forward operation.
 
         For performance reasons messages are processed in batches, where each batch contains only
         messages from the same community and the same meta message instance.  This method, or more
@@ -2744,12 +3114,18 @@ WHERE sync.community = ? AND meta_message.priority > 32 AND sync.undone = 0 AND
         if store:
             my_messages = sum(message.authentication.member == message.community.my_member for message in messages)
             if my_messages:
-                logger.debug("commit user generated message")
-                self._database.commit()
-
                 self._statistics.created_count += my_messages
                 self._statistics.dict_inc(self._statistics.created, messages[0].meta.name, my_messages)
 
+                logger.debug("commit user generated message")
+                if forward and self._database.group_commit_enabled:
+                    # our own messages are only forwarded once they are committed, see
+                    # enable_group_commit
+                    self._database.request_commit(lambda: self._forward(messages))
+                    return True
+
+                self._database.request_commit()
+
         if forward:
             return self._forward(messages)
 
@@ -2873,6 +3249,7 @@ WHERE sync.community = ? AND meta_message.priority > 32 AND sync.undone = 0 AND
         # remove all messages created by the malicious member
         self._database.execute(u"DELETE FROM sync WHERE community = ? AND member = ?",
                                (community.database_id, member.database_id))
+        community.dispersy_invalidate_sync()
 
         # TODO: if we have a address for the malicious member, we can also remove her from the
         # candidate table
@@ -3913,6 +4290,9 @@ WHERE sync.community = ? AND meta_message.priority > 32 AND sync.undone = 0 AND
                                    ((message.packet_id, message.community.database_id, message.payload.member.database_id, message.payload.global_time) for message in messages))
         for meta, iterator in groupby(messages, key=lambda x: x.payload.packet.meta):
             sub_messages = list(iterator)
+            meta.community.dispersy_undo_sync(meta,
+                                              [message.payload.global_time for message in sub_messages],
+                                              [message.payload.packet.packet_digest for message in sub_messages])
             meta.undo_callback([(message.payload.member, message.payload.global_time, message.payload.packet) for message in sub_messages])
 
             # notify that global times have changed
@@ -4023,6 +4403,7 @@ WHERE sync.community = ? AND meta_message.priority > 32 AND sync.undone = 0 AND
                 # 2. cleanup sync table.  everything except what we need to tell others this
                 # community is no longer available
                 self._database.execute(u"DELETE FROM sync WHERE community = ? AND id NOT IN (" + u", ".join(u"?" for _ in packet_ids) + ")", [community.database_id] + list(packet_ids))
+                community.dispersy_invalidate_sync()
 
                 # 3. cleanup the malicious_proof table.  we need nothing here anymore
                 self._database.execute(u"DELETE FROM malicious_proof WHERE community = ?", (community.database_id,))
@@ -4088,6 +4469,9 @@ WHERE sync.community = ? AND meta_message.priority > 32 AND sync.undone = 0 AND
                 if undo:
                     executemany(u"UPDATE sync SET undone = 1 WHERE id = ?", ((message.packet_id,) for message in undo))
                     assert self._database.changes == len(undo), (self._database.changes, len(undo))
+                    community.dispersy_undo_sync(meta,
+                                                 [message.distribution.global_time for message in undo],
+                                                 [message.packet_digest for message in undo])
                     meta.undo_callback([(message.authentication.member, message.distribution.global_time, message) for message in undo])
 
                     # notify that global times have changed
@@ -4096,6 +4480,9 @@ WHERE sync.community = ? AND meta_message.priority > 32 AND sync.undone = 0 AND
                 if redo:
                     executemany(u"UPDATE sync SET undone = 0 WHERE id = ?", ((message.packet_id,) for message in redo))
                     assert self._database.changes == len(redo), (self._database.changes, len(redo))
+                    community.dispersy_redo_sync(meta,
+                                                 [message.distribution.global_time for message in redo],
+                                                 [message.packet_digest for message in redo])
                     meta.handle_callback(redo)
 
                     # notify that global times have changed
@@ -4350,8 +4737,7 @@ WHERE sync.community = ? AND meta_message.priority > 32 AND sync.undone = 0 AND
         numbers are used.
         """
         assert isinstance(meta.distribution, FullSyncDistribution), "currently only FullSyncDistribution allows sequence numbers"
-        sequence_number, = self._database.execute(u"SELECT COUNT(*) FROM sync WHERE member = ? AND sync.meta_message = ?",
-                                                  (community.master_member.database_id, meta.database_id)).next()
+        _, sequence_number = community.sequence_cursors.get(meta.database_id, [community.master_member.database_id])[community.master_member.database_id]
         return sequence_number + 1
 
     def _watchdog(self):
@@ -4376,6 +4762,64 @@ WHERE sync.community = ? AND meta_message.priority > 32 AND sync.undone = 0 AND
         """
         self._database.commit()
 
+    def enable_sync_response_workers(self, size=2):
+        """
+        Select the packets for incoming sync bloom filters on SIZE worker threads.
+
+        Each worker uses a read-only connection to the database, leaving the callback thread
+        available for the walker and incoming packets.  Note that packets only become available to
+        the workers once they are committed.  Requests that carry an invertible bloom filter are
+        still handled on the callback thread.
+
+        Must be called after start().  Returns False when the database is stored in memory, since
+        it can not be shared between connections.
+        """
+        assert self._callback.is_current_thread, "Must be called from the callback thread"
+        assert isinstance(size, int), type(size)
+        assert 0 < size, size
+        if self._database.file_path == u":memory:":
+            logger.warning("unable to use sync response workers with an in-memory database")
+            return False
+
+        if self._sync_response_pool:
+            self._sync_response_pool.stop()
+        self._sync_response_pool = DatabaseReadPool(self._database.file_path, self._callback, size)
+        return True
+
+    def enable_group_commit(self, max_latency=1.0, max_pending=64):
+        """
+        Combine the commits for messages that we create into one commit every MAX_LATENCY seconds,
+        or every MAX_PENDING stored batches, whichever comes first.
+
+        By default every batch containing one of our own messages is committed immediately, i.e.
+        one disk sync per batch.  With group commit these batches share a single disk sync.
+
+        Our own messages that are not committed are lost when a crash occurs.  After restarting we
+        will claim their global times and sequence numbers again, hence new messages would conflict
+        with the lost ones if these had reached other peers.  Therefore store_update_forward only
+        forwards our own messages once they are committed, which delays them by up to MAX_LATENCY
+        seconds.  Messages that we send in another way must not be sent before they are committed.
+        """
+        assert isinstance(max_latency, float), type(max_latency)
+        assert isinstance(max_pending, int), type(max_pending)
+        self._database.enable_group_commit(self._callback, max_latency, max_pending)
+        return True
+
+    def enable_verification_pool(self, processes=0):
+        """
+        Verify the signatures of incoming packets using PROCESSES child processes, by default one
+        for each CPU.
+
+        Each batch of incoming packets is verified at once, spreading the verification over the
+        child processes.  Only packets signed by a single, known, member are verified this way, all
+        other packets are verified on the callback thread while they are decoded.
+        """
+        assert isinstance(processes, int), type(processes)
+        if self._verification_pool:
+            self._verification_pool.close()
+        self._verification_pool = VerificationPool(processes)
+        return True
+
     def start(self):
         """
         Starts Dispersy.
@@ -4460,20 +4904,28 @@ WHERE sync.community = ? AND meta_message.priority > 32 AND sync.undone = 0 AND
                 if timeout > 0.0:
                     yield 0.0
 
-                if not (self._batch_cache or self._communities):
+                if not (self._batch_scheduler or self._communities):
                     break
 
-                logger.debug("Murphy was right!  There are %d batches left.  There are %d communities left", len(self._batch_cache), len(self._communities))
+                logger.debug("Murphy was right!  There are %d batches left.  There are %d communities left", len(self._batch_scheduler), len(self._communities))
 
                 # force remove incoming messages
-                for task_identifier, _, _ in self._batch_cache.itervalues():
-                    self._callback.unregister(task_identifier)
-                self._batch_cache.clear()
+                self._batch_scheduler.clear()
 
                 # unload all communities
                 results.append(ordered_unload_communities())
                 assert all(isinstance(result, bool) for result in results), [type(result) for result in results]
 
+            # stop the verification processes
+            if self._verification_pool:
+                results.append(self._verification_pool.close())
+                self._verification_pool = None
+
+            # stop the sync response workers before the database
+            if self._sync_response_pool:
+                results.append(self._sync_response_pool.stop(timeout))
+                self._sync_response_pool = None
+
             # stop the database
             results.append(self._database.close())
             assert all(isinstance(result, bool) for result in results), [type(result) for result in results]
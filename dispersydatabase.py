@@ -9,6 +9,7 @@ This module provides an interface to the Dispersy database.
 import logging
 logger = logging.getLogger(__name__)
 
+from hashlib import sha1
 from itertools import groupby
 
 from .database import Database
@@ -19,7 +20,7 @@ if "--apswtrace" in getattr(sys, "argv", []):
     from .database import APSWDatabase as Database
 
 
-LATEST_VERSION = 16
+LATEST_VERSION = 17
 
 schema = u"""
 CREATE TABLE member(
@@ -71,8 +72,9 @@ CREATE TABLE sync(
  meta_message INTEGER REFERENCES meta_message(id),
  undone INTEGER DEFAULT 0,
  packet BLOB,
+ digest BLOB,                                           -- sha1 digest of packet
  UNIQUE(community, member, global_time));
-CREATE INDEX sync_meta_message_undone_global_time_index ON sync(meta_message, undone, global_time);
+CREATE INDEX sync_meta_message_undone_global_time_digest_index ON sync(meta_message, undone, global_time, digest);
 CREATE INDEX sync_meta_message_member ON sync(meta_message, member);
 
 CREATE TABLE malicious_proof(
@@ -353,15 +355,112 @@ UPDATE option SET value = '13' WHERE key = 'database_version';
 
             # upgrade from version 16 to version 17
             if database_version < 17:
-                # there is no version 17 yet...
-                # logger.debug("upgrade database %d -> %d", database_version, 17)
-                # self.executescript(u"""UPDATE option SET value = '17' WHERE key = 'database_version';""")
+                logger.debug("upgrade database %d -> %d", database_version, 17)
+                # the digest column contains the sha1 digest of the packet.  this allows packets to
+                # be compared without loading the, much larger, packet itself.  the digest is added
+                # to the meta_message, undone, global_time index to allow range queries to obtain
+                # digests without reading the sync rows at all
+                self.executescript(u"""
+ALTER TABLE sync ADD COLUMN digest BLOB;
+DROP INDEX IF EXISTS sync_meta_message_undone_global_time_index;
+CREATE INDEX sync_meta_message_undone_global_time_digest_index ON sync(meta_message, undone, global_time, digest);
+""")
+                last_id = 0
+                while True:
+                    rows = list(self.execute(u"SELECT id, packet FROM sync WHERE id > ? ORDER BY id LIMIT 1000", (last_id,)))
+                    if not rows:
+                        break
+                    self.executemany(u"UPDATE sync SET digest = ? WHERE id = ?", [(buffer(sha1(str(packet)).digest()), id_) for id_, packet in rows])
+                    last_id = rows[-1][0]
+
+                self.executescript(u"""UPDATE option SET value = '17' WHERE key = 'database_version';""")
+                self.commit()
+                logger.debug("upgrade database %d -> %d (done)", database_version, 17)
+
+            # upgrade from version 17 to version 18
+            if database_version < 18:
+                # there is no version 18 yet...
+                # logger.debug("upgrade database %d -> %d", database_version, 18)
+                # self.executescript(u"""UPDATE option SET value = '18' WHERE key = 'database_version';""")
                 # self.commit()
-                # logger.debug("upgrade database %d -> %d (done)", database_version, 17)
+                # logger.debug("upgrade database %d -> %d (done)", database_version, 18)
                 pass
 
         return LATEST_VERSION
 
+    def get_obsolete_last_sync(self, meta_message, members, history_size):
+        """
+        Returns a list with (id, global time, digest) tuples for the packets of META_MESSAGE, created
+        by one of MEMBERS, that are not among the HISTORY_SIZE most recent packets of their creator.
+
+        META_MESSAGE is the database id of a meta message that uses the LastSyncDistribution policy
+        and MEMBERS are member database ids.  One query is used for all MEMBERS.
+        """
+        assert isinstance(meta_message, (int, long)), type(meta_message)
+        assert all(isinstance(member, (int, long)) for member in members)
+        assert isinstance(history_size, int), type(history_size)
+        assert history_size > 0, history_size
+        if not members:
+            return []
+
+        # the global time of the oldest packet that must be kept is found using the
+        # sync_meta_message_member index.  packets without HISTORY_SIZE newer packets compare
+        # against NULL and are kept
+        return [(syncid, global_time, str(digest))
+                for syncid, global_time, digest
+                in self.execute(u"""
+SELECT id, global_time, digest
+FROM sync
+WHERE meta_message = ? AND member IN (%s) AND global_time < (
+ SELECT newer.global_time
+ FROM sync AS newer
+ WHERE newer.meta_message = sync.meta_message AND newer.member = sync.member
+ ORDER BY newer.global_time DESC
+ LIMIT 1 OFFSET ?)""" % u", ".join(unicode(member) for member in members), (meta_message, history_size - 1))]
+
+    def get_obsolete_double_last_sync(self, meta_message, members, history_size):
+        """
+        Returns a list with (id, global time, digest) tuples for the packets of META_MESSAGE, signed
+        by one of the (member1, member2) pairs in MEMBERS, that are not among the HISTORY_SIZE most
+        recent packets of their pair.
+
+        META_MESSAGE is the database id of a meta message that uses the LastSyncDistribution policy
+        and DoubleMemberAuthentication.  Each pair must be ordered, i.e. member1 < member2.  Packets
+        with the same global time are ordered by their binary value.  One query is used for all
+        MEMBERS.
+        """
+        assert isinstance(meta_message, (int, long)), type(meta_message)
+        members = set(members)
+        assert all(isinstance(member1, (int, long)) and isinstance(member2, (int, long)) and member1 < member2 for member1, member2 in members)
+        assert isinstance(history_size, int), type(history_size)
+        assert history_size > 0, history_size
+        if not members:
+            return []
+
+        # the oldest packet to keep is found once for every pair, using the same LIMIT 1 OFFSET form
+        # as get_obsolete_last_sync, the CROSS JOINs ensure that sqlite evaluates the subquery per pair
+        # instead of per packet.  the unary + prevents sqlite from probing the index for every
+        # member1 and member2 combination.  the query may also return packets for pairs that combine
+        # a member1 and member2 from different pairs in MEMBERS, these are removed afterwards
+        return [(syncid, global_time, str(digest))
+                for syncid, global_time, digest, member1, member2
+                in self.execute(u"""
+SELECT sync.id, sync.global_time, sync.digest, pair.member1, pair.member2
+FROM (SELECT DISTINCT member1, member2 FROM double_signed_sync WHERE member1 IN (%s) AND +member2 IN (%s)) AS pair
+CROSS JOIN sync AS oldest ON oldest.id = (
+ SELECT newer.id
+ FROM double_signed_sync AS newer_double
+ JOIN sync AS newer ON newer.id = newer_double.sync
+ WHERE newer_double.member1 = pair.member1 AND newer_double.member2 = pair.member2 AND newer.meta_message = ?
+ ORDER BY newer.global_time DESC, newer.packet DESC
+ LIMIT 1 OFFSET ?)
+CROSS JOIN double_signed_sync ON double_signed_sync.member1 = pair.member1 AND double_signed_sync.member2 = pair.member2
+CROSS JOIN sync ON sync.id = double_signed_sync.sync
+WHERE sync.meta_message = ? AND (sync.global_time < oldest.global_time OR (sync.global_time = oldest.global_time AND sync.packet < oldest.packet))""" %
+                                (u", ".join(unicode(member1) for member1, _ in members), u", ".join(unicode(member2) for _, member2 in members)),
+                                (meta_message, history_size - 1, meta_message))
+                if (member1, member2) in members]
+
     def check_community_database(self, community, database_version):
         assert isinstance(database_version, int)
         assert database_version >= 0
@@ -185,6 +185,7 @@ class RawserverEndpoint(Endpoint):
             if len(batch) > 0:
                 did_have_senqueue = bool(self._sendqueue)
                 self._sendqueue.extend(batch)
+                self._cur_sendqueue = len(self._sendqueue)
 
                 # If we did not already a sendqueue, then we need to call process_sendqueue in order send these messages
                 if not did_have_senqueue:
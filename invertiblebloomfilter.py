@@ -0,0 +1,223 @@
+"""
+This module provides the invertible bloom filter used for set reconciliation.
+
+An invertible bloom filter (Eppstein, Goodrich, Uyeda, and Varghese, "What's the Difference?  Efficient Set
+Reconciliation without Prior Context") stores, for every cell, the number of keys, the xor of the keys, and the xor of a
+checksum of the keys.  Subtracting the filter of one peer from the filter of another results in a filter containing only
+the keys that are in one set but not in the other.  When this difference is small enough it can be decoded exactly,
+regardless of the size of the sets themselves.
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+from hashlib import md5, sha1
+from struct import Struct
+
+_struct_L = Struct(">L")
+_struct_Q = Struct(">Q")
+_struct_LLLL = Struct(">LLLL")
+_struct_cell = Struct(">HQL")
+
+
+class InvertibleBloomFilter(object):
+
+    """
+    An invertible bloom filter over 64 bit keys.  A key is the first eight bytes of the sha1 digest of a packet, i.e.
+    the first eight bytes of the digest column in the sync table.
+
+    The InvertibleBloomFilter constructor takes parameters that are interpreted differently, depending on their type.
+    The following type combination, and their interpretations, are possible:
+
+    - InvertibleBloomFilter(int:m_cells, int:k_functions=3)
+
+      Will create an empty InvertibleBloomFilter with m_cells cells where every key is stored in k_functions cells.
+
+    - InvertibleBloomFilter(str:bytes, int:k_functions)
+
+      Will create an InvertibleBloomFilter from a binary string and a number of functions.  Typically this is used to
+      retrieve a filter that was serialised using the bytes property.
+    """
+
+    # number of bytes used by one serialised cell
+    cell_size = _struct_cell.size
+
+    @staticmethod
+    def get_key(digest):
+        """
+        Returns the key for the sha1 DIGEST of a packet.
+        @rtype: long
+        """
+        assert isinstance(digest, str), type(digest)
+        assert len(digest) >= 8, len(digest)
+        return _struct_Q.unpack_from(digest)[0]
+
+    @staticmethod
+    def _get_checksum(key):
+        # the checksum must not be linear with respect to xor (as crc32 is), otherwise a cell containing three keys
+        # will be seen as a cell containing their xor
+        return _struct_L.unpack_from(sha1(_struct_Q.pack(key)).digest())[0]
+
+    def __init__(self, *args):
+        # matches: InvertibleBloomFilter(str:bytes, int:k_functions)
+        if len(args) == 2 and isinstance(args[0], str) and isinstance(args[1], int):
+            bytes_, self._k_functions = args
+            assert len(bytes_) % self.cell_size == 0, len(bytes_)
+            self._m_cells = len(bytes_) / self.cell_size
+            cells = [_struct_cell.unpack_from(bytes_, offset) for offset in xrange(0, len(bytes_), self.cell_size)]
+            self._counts = [count for count, _, _ in cells]
+            self._key_sums = [key_sum for _, key_sum, _ in cells]
+            self._checksum_sums = [checksum_sum for _, _, checksum_sum in cells]
+
+        # matches: InvertibleBloomFilter(int:m_cells, int:k_functions=3)
+        elif 1 <= len(args) <= 2 and isinstance(args[0], int) and isinstance(args[-1], int):
+            self._m_cells = args[0]
+            self._k_functions = args[1] if len(args) == 2 else 3
+            self._counts = [0] * self._m_cells
+            self._key_sums = [0] * self._m_cells
+            self._checksum_sums = [0] * self._m_cells
+
+        else:
+            raise RuntimeError("Unknown combination of argument types %s" % str([type(arg) for arg in args]))
+
+        assert 0 < self._k_functions <= 4, "positions are taken from a single md5 digest, k_functions can not exceed 4"
+        assert self._k_functions <= self._m_cells, [self._k_functions, self._m_cells]
+
+        # the cells are divided into K_FUNCTIONS sub tables, ensuring that every key is stored in K_FUNCTIONS different
+        # cells
+        self._sub_size = self._m_cells / self._k_functions
+
+    def _get_positions(self, key):
+        sub_size = self._sub_size
+        return [index * sub_size + value % sub_size
+                for index, value
+                in enumerate(_struct_LLLL.unpack(md5(_struct_Q.pack(key)).digest())[:self._k_functions])]
+
+    def add(self, packet):
+        """
+        Add PACKET to the InvertibleBloomFilter.
+        """
+        self.add_key(self.get_key(sha1(packet).digest()))
+
+    def add_key(self, key, count=1):
+        """
+        Add KEY COUNT times to the InvertibleBloomFilter.  A negative COUNT removes the key.
+        """
+        assert isinstance(key, (int, long)), type(key)
+        assert 0 <= key < 2 ** 64, key
+        checksum = self._get_checksum(key)
+        for position in self._get_positions(key):
+            self._counts[position] += count
+            self._key_sums[position] ^= key
+            self._checksum_sums[position] ^= checksum
+
+    def add_keys(self, keys):
+        """
+        Add a sequence of KEYS to the InvertibleBloomFilter.
+        """
+        for key in keys:
+            self.add_key(key)
+
+    def subtract(self, other):
+        """
+        Returns a new InvertibleBloomFilter containing the keys in SELF minus the keys in OTHER.
+
+        Keys that are only in SELF will have a positive count, keys that are only in OTHER will have
+        a negative count.
+        """
+        assert isinstance(other, InvertibleBloomFilter), type(other)
+        assert self._m_cells == other._m_cells, [self._m_cells, other._m_cells]
+        assert self._k_functions == other._k_functions, [self._k_functions, other._k_functions]
+        difference = InvertibleBloomFilter(self._m_cells, self._k_functions)
+        difference._counts = [a - b for a, b in zip(self._counts, other._counts)]
+        difference._key_sums = [a ^ b for a, b in zip(self._key_sums, other._key_sums)]
+        difference._checksum_sums = [a ^ b for a, b in zip(self._checksum_sums, other._checksum_sums)]
+        return difference
+
+    def decode(self):
+        """
+        Returns a (success, positive, negative) tuple where POSITIVE and NEGATIVE are sets containing the keys with a
+        positive and negative count, respectively.
+
+        SUCCESS is False when the filter could not be decoded completely, i.e. the difference was too large for the
+        number of cells or the filter is malformed.  POSITIVE and NEGATIVE will contain the keys that were decoded so
+        far.
+
+        Decoding does not modify SELF.
+        """
+        counts = self._counts[:]
+        key_sums = self._key_sums[:]
+        checksum_sums = self._checksum_sums[:]
+        get_checksum = self._get_checksum
+
+        def is_pure(position):
+            return counts[position] in (1, -1) and get_checksum(key_sums[position]) == checksum_sums[position]
+
+        positive = set()
+        negative = set()
+        pure = [position for position in xrange(self._m_cells) if is_pure(position)]
+        # every peeled key adds at most K_FUNCTIONS positions to PURE, a well formed filter can not
+        # require more iterations than this
+        iterations = self._m_cells * (self._k_functions + 1)
+        while pure:
+            iterations -= 1
+            if iterations < 0:
+                logger.debug("decoding failed, too many iterations")
+                return False, positive, negative
+
+            position = pure.pop()
+            if not is_pure(position):
+                continue
+
+            key = key_sums[position]
+            sign = counts[position]
+
+            # a key can only be peeled once.  a crafted filter, for example a single pure cell whose
+            # other cells are empty, would otherwise flip the key between positive and negative
+            # forever
+            if key in positive or key in negative:
+                logger.debug("decoding failed, key %d was peeled twice", key)
+                return False, positive, negative
+
+            (positive if sign == 1 else negative).add(key)
+
+            checksum = get_checksum(key)
+            for other in self._get_positions(key):
+                counts[other] -= sign
+                key_sums[other] ^= key
+                checksum_sums[other] ^= checksum
+                if is_pure(other):
+                    pure.append(other)
+
+        success = not (any(counts) or any(key_sums) or any(checksum_sums))
+        logger.debug("decoded %d positive and %d negative keys (%s)", len(positive), len(negative), "success" if success else "failure")
+        return success, positive, negative
+
+    @property
+    def size(self):
+        """
+        The number of cells (m).
+        @rtype: int
+        """
+        return self._m_cells
+
+    @property
+    def functions(self):
+        """
+        The number of cells used for each key (k).
+        @rtype: int
+        """
+        return self._k_functions
+
+    @property
+    def bytes(self):
+        """
+        The binary representation of the cells.  Note that to reconstruct the filter, the bytes as well as the number of
+        functions are required.  Only filters with non-negative counts, i.e. not the result of subtract, can be
+        serialised.
+        @rtype: string
+        """
+        assert all(0 <= count < 2 ** 16 for count in self._counts), "counts must fit in an unsigned short"
+        return "".join(_struct_cell.pack(count, key_sum, checksum_sum)
+                       for count, key_sum, checksum_sum
+                       in zip(self._counts, self._key_sums, self._checksum_sums))
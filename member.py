@@ -281,7 +281,7 @@ class Member(DummyMember):
         assert isinstance(length, (int, long))
         return self._public_key and \
             self._signature_length == len(signature) \
-            and ec_verify(self._ec, sha1(data[offset:offset + (length or len(data))]).digest(), signature)
+            and ec_verify(self._ec, sha1(buffer(data, offset, length or len(data))).digest(), signature)
 
     def sign(self, data, offset=0, length=0):
         """
@@ -290,7 +290,7 @@ class Member(DummyMember):
         Will raise a RuntimeError when this we do not have the private key.
         """
         if self._private_key:
-            return ec_sign(self._ec, sha1(data[offset:length or len(data)]).digest())
+            return ec_sign(self._ec, sha1(buffer(data, offset, (length or len(data)) - offset)).digest())
         else:
             raise RuntimeError("unable to sign data without the private key")
 
@@ -2,6 +2,8 @@ import logging
 logger = logging.getLogger(__name__)
 
 from abc import ABCMeta, abstractmethod
+from hashlib import sha1
+
 from .meta import MetaObject
 
 #
@@ -224,7 +226,7 @@ class DropMessage(Exception):
 
 class BatchConfiguration(object):
 
-    def __init__(self, max_window=0.0, priority=0, max_size=1024, max_age=300.0):
+    def __init__(self, max_window=0.0, priority=0, max_size=1024, max_age=300.0, min_window=None, min_size=None):
         """
         Per meta message configuration on batch handling.
 
@@ -244,7 +246,16 @@ class BatchConfiguration(object):
         response.  When the requests are delayed for to long they will time out, in this case a
         response no longer needs to be sent.  MAX_AGE for the request messages should hence be lower
         than the used timeout + max_window on the response messages.
+
+        MIN_WINDOW and MIN_SIZE enable adaptive batching.  The window and size of each batch are
+        then chosen at runtime, between MIN_WINDOW and MAX_WINDOW and between MIN_SIZE and MAX_SIZE,
+        based on the observed arrival rate and processing time.  By default MIN_WINDOW equals
+        MAX_WINDOW and MIN_SIZE equals MAX_SIZE, i.e. the window and size are fixed.
         """
+        if min_window is None:
+            min_window = max_window
+        if min_size is None:
+            min_size = max_size
         assert isinstance(max_window, float)
         assert 0.0 <= max_window, max_window
         assert isinstance(priority, int)
@@ -252,10 +263,16 @@ class BatchConfiguration(object):
         assert 0 < max_size, max_size
         assert isinstance(max_age, float)
         assert 0.0 <= max_window < max_age, [max_window, max_age]
+        assert isinstance(min_window, float)
+        assert 0.0 <= min_window <= max_window, [min_window, max_window]
+        assert isinstance(min_size, int)
+        assert 0 < min_size <= max_size, [min_size, max_size]
         self._max_window = max_window
         self._priority = priority
         self._max_size = max_size
         self._max_age = max_age
+        self._min_window = min_window
+        self._min_size = min_size
 
     @property
     def enabled(self):
@@ -278,6 +295,19 @@ class BatchConfiguration(object):
     def max_age(self):
         return self._max_age
 
+    @property
+    def min_window(self):
+        return self._min_window
+
+    @property
+    def min_size(self):
+        return self._min_size
+
+    @property
+    def adaptive(self):
+        # adaptive when the window or size is not fixed
+        return self._min_window < self._max_window or self._min_size < self._max_size
+
 #
 # packet
 #
@@ -285,12 +315,14 @@ class BatchConfiguration(object):
 
 class Packet(MetaObject.Implementation):
 
-    def __init__(self, meta, packet, packet_id):
+    def __init__(self, meta, packet, packet_id, packet_digest=None):
         assert isinstance(packet, str)
         assert isinstance(packet_id, (int, long))
+        assert packet_digest is None or (isinstance(packet_digest, str) and len(packet_digest) == 20), packet_digest
         super(Packet, self).__init__(meta)
         self._packet = packet
         self._packet_id = packet_id
+        self._packet_digest = packet_digest
 
     @property
     def community(self):
@@ -332,6 +364,15 @@ class Packet(MetaObject.Implementation):
     def packet(self):
         return self._packet
 
+    @property
+    def packet_digest(self):
+        """
+        The sha1 digest of the packet, computed once.
+        """
+        if self._packet_digest is None:
+            self._packet_digest = sha1(self._packet).digest()
+        return self._packet_digest
+
     @property
     def packet_id(self):
         return self._packet_id
@@ -358,7 +399,7 @@ class Message(MetaObject):
 
     class Implementation(Packet):
 
-        def __init__(self, meta, authentication, resolution, distribution, destination, payload, conversion=None, candidate=None, packet="", packet_id=0, sign=True):
+        def __init__(self, meta, authentication, resolution, distribution, destination, payload, conversion=None, candidate=None, packet="", packet_id=0, sign=True, packet_digest=None):
             if __debug__:
                 from .conversion import Conversion
                 from .candidate import Candidate
@@ -367,17 +408,25 @@ class Message(MetaObject):
             assert isinstance(resolution, meta.resolution.Implementation), "RESOLUTION has invalid type '%s'" % type(resolution)
             assert isinstance(distribution, meta.distribution.Implementation), "DISTRIBUTION has invalid type '%s'" % type(distribution)
             assert isinstance(destination, meta.destination.Implementation), "DESTINATION has invalid type '%s'" % type(destination)
-            assert isinstance(payload, meta.payload.Implementation), "PAYLOAD has invalid type '%s'" % type(payload)
+            # PAYLOAD may also be a callable that decodes the payload when it is first used, see
+            # Message.lazy_payload
+            assert isinstance(payload, meta.payload.Implementation) or (callable(payload) and packet), "PAYLOAD has invalid type '%s'" % type(payload)
             assert conversion is None or isinstance(conversion, Conversion), "CONVERSION has invalid type '%s'" % type(conversion)
             assert candidate is None or isinstance(candidate, Candidate)
             assert isinstance(packet, str)
             assert isinstance(packet_id, (int, long))
-            super(Message.Implementation, self).__init__(meta, packet, packet_id)
+            assert packet_digest is None or packet, "PACKET_DIGEST requires PACKET"
+            super(Message.Implementation, self).__init__(meta, packet, packet_id, packet_digest)
             self._authentication = authentication
             self._resolution = resolution
             self._distribution = distribution
             self._destination = destination
-            self._payload = payload
+            if callable(payload):
+                self._payload = None
+                self._decode_payload = payload
+            else:
+                self._payload = payload
+                self._decode_payload = None
             self._candidate = candidate
 
             # _RESUME contains the message that caused SELF to be processed after it was delayed
@@ -423,8 +472,19 @@ class Message(MetaObject):
 
         @property
         def payload(self):
+            if self._decode_payload:
+                # may raise DropPacket or DelayPacket
+                self._payload = self._decode_payload()
+                self._decode_payload = None
             return self._payload
 
+        @property
+        def is_payload_decoded(self):
+            """
+            False when the payload has not been decoded yet, see Message.lazy_payload.
+            """
+            return self._decode_payload is None
+
         @property
         def candidate(self):
             return self._candidate
@@ -446,11 +506,12 @@ class Message(MetaObject):
                 self._packet = packet
             else:
                 self._packet = self._conversion.encode_message(self)
+            self._packet_digest = None
 
         def __str__(self):
             return "<%s.%s %s %dbytes>" % (self._meta.__class__.__name__, self.__class__.__name__, self._meta._name, len(self._packet))
 
-    def __init__(self, community, name, authentication, resolution, distribution, destination, payload, check_callback, handle_callback, undo_callback=None, batch=None):
+    def __init__(self, community, name, authentication, resolution, distribution, destination, payload, check_callback, handle_callback, undo_callback=None, batch=None, lazy_payload=False):
         if __debug__:
             from .community import Community
             from .authentication import Authentication
@@ -472,6 +533,7 @@ class Message(MetaObject):
             if isinstance(resolution, DynamicResolution):
                 assert callable(undo_callback), "UNDO_CALLBACK must be specified when using the DynamicResolution policy"
         assert batch is None or isinstance(batch, BatchConfiguration)
+        assert isinstance(lazy_payload, bool), type(lazy_payload)
         assert self.check_policy_combination(authentication, resolution, distribution, destination)
         self._community = community
         self._name = name
@@ -484,6 +546,7 @@ class Message(MetaObject):
         self._handle_callback = handle_callback
         self._undo_callback = undo_callback
         self._batch = BatchConfiguration() if batch is None else batch
+        self._lazy_payload = lazy_payload
 
         # use cache to avoid database queries
         cache = community.meta_message_cache.get(name)
@@ -551,6 +614,18 @@ class Message(MetaObject):
     def batch(self):
         return self._batch
 
+    @property
+    def lazy_payload(self):
+        """
+        When True, the payload of packets received from the network is decoded when it is first
+        used instead of when the packet is decoded.
+
+        Packets that are dropped because they are duplicate, old, or from a blacklisted member will
+        never decode their payload.  The payload of the remaining packets is decoded before
+        meta.check_callback is called, hence decoding errors are handled as usual.
+        """
+        return self._lazy_payload
+
     def impl(self, authentication=(), resolution=(), distribution=(), destination=(), payload=(), *args, **kargs):
         if __debug__:
             assert isinstance(authentication, tuple), type(authentication)
@@ -1,5 +1,6 @@
 from hashlib import sha1
 
+from .invertiblebloomfilter import InvertibleBloomFilter
 from .meta import MetaObject
 
 if __debug__:
@@ -36,7 +37,7 @@ class IntroductionRequestPayload(Payload):
 
     class Implementation(Payload.Implementation):
 
-        def __init__(self, meta, destination_address, source_lan_address, source_wan_address, advice, connection_type, sync, identifier):
+        def __init__(self, meta, destination_address, source_lan_address, source_wan_address, advice, connection_type, sync, identifier, double_hashing_support=False):
             """
             Create the payload for an introduction-request message.
 
@@ -69,10 +70,16 @@ class IntroductionRequestPayload(Payload):
                packets in that range.
 
                BLOOM_FILTER is a BloomFilter object containing all packets that the sender has in
-               the given sync range.
+               the given sync range.  Alternatively it is an InvertibleBloomFilter object containing
+               the digests of these packets, allowing the receiver to determine exactly which
+               packets are missing.
 
             IDENTIFIER is a number that must be given in the associated introduction-response.  This
             number allows to distinguish between multiple introduction-response messages.
+
+            DOUBLE_HASHING_SUPPORT is a boolean value.  When True the sender is able to handle sync
+            bloom filters that use double hashing.  Older peers never set this flag, hence they will
+            only receive sync bloom filters that use the classic scheme.
             """
             assert is_address(destination_address), destination_address
             assert is_address(source_lan_address), source_lan_address
@@ -83,6 +90,7 @@ class IntroductionRequestPayload(Payload):
             assert sync is None or len(sync) == 5, sync
             assert isinstance(identifier, int), identifier
             assert 0 <= identifier < 2 ** 16, identifier
+            assert isinstance(double_hashing_support, bool), type(double_hashing_support)
             super(IntroductionRequestPayload.Implementation, self).__init__(meta)
             self._destination_address = destination_address
             self._source_lan_address = source_lan_address
@@ -90,8 +98,10 @@ class IntroductionRequestPayload(Payload):
             self._advice = advice
             self._connection_type = connection_type
             self._identifier = identifier
+            self._double_hashing_support = double_hashing_support
+            self._bloom_filter = self._invertible_bloom_filter = None
             if sync:
-                self._time_low, self._time_high, self._modulo, self._offset, self._bloom_filter = sync
+                self._time_low, self._time_high, self._modulo, self._offset, bloom_filter = sync
                 assert isinstance(self._time_low, (int, long))
                 assert 0 < self._time_low
                 assert isinstance(self._time_high, (int, long))
@@ -100,9 +110,13 @@ class IntroductionRequestPayload(Payload):
                 assert 0 < self._modulo < 2 ** 16, self._modulo
                 assert isinstance(self._offset, int), type(self._offset)
                 assert 0 <= self._offset < self._modulo, [self._offset, self._modulo]
-                assert isinstance(self._bloom_filter, BloomFilter)
+                assert isinstance(bloom_filter, (BloomFilter, InvertibleBloomFilter)), type(bloom_filter)
+                if isinstance(bloom_filter, InvertibleBloomFilter):
+                    self._invertible_bloom_filter = bloom_filter
+                else:
+                    self._bloom_filter = bloom_filter
             else:
-                self._time_low, self._time_high, self._modulo, self._offset, self._bloom_filter = 0, 0, 1, 0, None
+                self._time_low, self._time_high, self._modulo, self._offset = 0, 0, 1, 0
 
         @property
         def destination_address(self):
@@ -126,7 +140,7 @@ class IntroductionRequestPayload(Payload):
 
         @property
         def sync(self):
-            return True if self._bloom_filter else False
+            return not (self._bloom_filter is None and self._invertible_bloom_filter is None)
 
         @property
         def time_low(self):
@@ -152,10 +166,18 @@ class IntroductionRequestPayload(Payload):
         def bloom_filter(self):
             return self._bloom_filter
 
+        @property
+        def invertible_bloom_filter(self):
+            return self._invertible_bloom_filter
+
         @property
         def identifier(self):
             return self._identifier
 
+        @property
+        def double_hashing_support(self):
+            return self._double_hashing_support
+
 
 class IntroductionResponsePayload(Payload):
 
@@ -0,0 +1,306 @@
+"""
+This module provides a low overhead profiler for the SQL statements executed by a Database.
+
+Statements are grouped by template, i.e. the statement with its literals replaced by placeholders
+and its whitespace collapsed, such that statements that are built using string formatting end up
+in the same group.  For each template the QueryProfiler counts the number of executions, the total
+execution time, the number of rows returned or changed, and keeps a histogram of the execution
+times from which the p50 and p99 latencies are estimated.  The histogram has one bucket for each
+power of two, hence the estimated latencies are within a factor two of the actual latencies.
+
+The rows returned by SELECT and PRAGMA statements are counted by the RowCountingCursor, which the
+Database uses for its connection.  The Database returns this cursor unchanged.  The rows fetched
+between two recorded statements are attributed to the first of the two.
+
+The latency of a statement is the time spent in the cursor.execute call.  For sqlite this includes
+stepping to the first row, which is where sorting, grouping, and aggregation takes place, but it
+does not include fetching the remaining rows.
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+from collections import defaultdict, deque
+from functools import partial
+from itertools import count, imap, islice, izip
+from math import frexp, ldexp
+from operator import itemgetter
+from re import compile as re_compile, IGNORECASE
+from sqlite3 import Cursor
+
+# the latency that is recorded for statements that complete within the resolution of the timer
+_MIN_DURATION = 0.000001
+
+_re_whitespace = re_compile(r"\s+")
+_re_literal = re_compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_re_placeholders = re_compile(r"\?(?:\s*,\s*\?)+")
+# lists of numbers or placeholders, i.e. the IN lists that are built using string formatting.  these
+# are collapsed first, the other expressions are much slower on long lists
+_re_list = re_compile(r"\bIN\s*\(\s*[-.\d?]+(?:\s*,\s*[-.\d?]+)*\s*\)", IGNORECASE)
+
+
+def _get_statement_template(statement):
+    """
+    Returns a (template, lists) tuple, where LISTS is the number of lists that were collapsed.
+    """
+    template, lists = _re_list.subn(u"IN (?, ...)", statement)
+    template = _re_whitespace.sub(u" ", template).strip()
+    template = _re_literal.sub(u"?", template)
+    return _re_placeholders.sub(u"?, ...", template), lists
+
+
+def get_statement_template(statement):
+    """
+    Returns STATEMENT with its literals replaced by '?', lists of placeholders replaced by '?, ...',
+    and its whitespace collapsed.
+    """
+    return _get_statement_template(statement)[0]
+
+
+_cursor_next = Cursor.next
+_first = itemgetter(0)
+
+
+def _advance(counter, rows, _consume=deque(maxlen=0).extend):
+    _consume(islice(counter, rows))
+
+
+class RowCountingCursor(Cursor):
+
+    """
+    A sqlite3 cursor that counts the rows fetched from it, see QueryProfiler.row_counter.
+
+    Iterating over the cursor counts the rows using a chain of C iterators, hence there is no
+    Python call for every row.  The next and fetch methods count the rows that they return.
+    """
+
+    def __init__(self, connection):
+        super(RowCountingCursor, self).__init__(connection)
+        # an itertools.count that is advanced for every row fetched
+        self.counter = count()
+
+    def __iter__(self):
+        return imap(_first, izip(iter(partial(_cursor_next, self), None), self.counter))
+
+    def next(self):
+        row = _cursor_next(self)
+        next(self.counter)
+        return row
+
+    def fetchone(self):
+        row = super(RowCountingCursor, self).fetchone()
+        if row is not None:
+            next(self.counter)
+        return row
+
+    def fetchmany(self, *args):
+        rows = super(RowCountingCursor, self).fetchmany(*args)
+        _advance(self.counter, len(rows))
+        return rows
+
+    def fetchall(self):
+        rows = super(RowCountingCursor, self).fetchall()
+        _advance(self.counter, len(rows))
+        return rows
+
+
+class _QueryStatistics(object):
+
+    __slots__ = ("duration", "rows", "histogram", "select")
+
+    def __init__(self, select):
+        self.duration = 0.0
+        self.rows = 0
+        # EXPONENT:COUNT pairs, see QueryProfiler.record
+        self.histogram = defaultdict(int)
+        self.select = select
+
+    @property
+    def count(self):
+        return sum(self.histogram.itervalues())
+
+    def get_percentile(self, percentile):
+        """
+        Returns an estimate of the PERCENTILE latency, interpolated within the histogram bucket
+        that contains PERCENTILE.
+        """
+        threshold = self.count * percentile / 100.0
+        seen = 0
+        for exponent, count_ in sorted(self.histogram.iteritems()):
+            if seen + count_ >= threshold:
+                # bucket EXPONENT contains the latencies in [2 ** (EXPONENT - 1), 2 ** EXPONENT)
+                return ldexp(2.0 ** ((threshold - seen) / count_), exponent - 1)
+            seen += count_
+        return 0.0
+
+
+class QueryProfiler(object):
+
+    """
+    Keeps track of the number of executions, execution time, and rows for each statement template.
+
+    The QueryProfiler is owned by a Database and may only be used from the database thread.
+    """
+
+    def __init__(self, enabled=True, cache_size=1024, count_rows=True):
+        """
+        Create a new profiler.
+
+        @param enabled: whether statements are recorded, see QueryProfiler.enabled.
+        @type enabled: bool
+
+        @param cache_size: the maximum number of statements that are remembered along with their
+         template.  When the cache is full the least recently used quarter is removed.
+        @type cache_size: int
+
+        @param count_rows: whether the rows returned by SELECT statements are counted, see
+         QueryProfiler.count_rows.
+        @type count_rows: bool
+        """
+        assert isinstance(enabled, bool), type(enabled)
+        assert isinstance(cache_size, int), type(cache_size)
+        assert 0 < cache_size, cache_size
+        assert isinstance(count_rows, bool), type(count_rows)
+        self._enabled = enabled
+        self._cache_size = cache_size
+        self._count_rows = count_rows
+        # TEMPLATE:_QUERYSTATISTICS pairs
+        self._templates = {}
+        # STATEMENT:[_QUERYSTATISTICS, LAST_USED] pairs, prevents computing the template for every
+        # execution
+        self._statements = {}
+        self._clock = 0
+        # advanced for every row fetched, the rows fetched since the previous statement are the
+        # difference between the next value and MARK
+        self._row_counter = count()
+        self._row_mark = 0
+        self._previous = _QueryStatistics(False)
+
+    @property
+    def enabled(self):
+        return self._enabled
+
+    @enabled.setter
+    def enabled(self, enabled):
+        assert isinstance(enabled, bool), type(enabled)
+        self._add_fetched_rows(_QueryStatistics(False))
+        self._enabled = enabled
+
+    @property
+    def count_rows(self):
+        """
+        Whether the rows returned by SELECT statements are counted.
+
+        This requires the cursor to count its rows using QueryProfiler.row_counter, the rows fetched
+        from other cursors are not counted.
+        """
+        return self._count_rows
+
+    @count_rows.setter
+    def count_rows(self, count_rows):
+        assert isinstance(count_rows, bool), type(count_rows)
+        self._add_fetched_rows(_QueryStatistics(False))
+        self._count_rows = count_rows
+
+    @property
+    def row_counter(self):
+        """
+        The itertools.count that the cursor advances for every row fetched, see
+        RowCountingCursor.counter.
+        """
+        return self._row_counter
+
+    def reset(self):
+        """
+        Forget all recorded statements.
+        """
+        self._templates = {}
+        self._statements = {}
+        self._add_fetched_rows(_QueryStatistics(False))
+
+    def _add_fetched_rows(self, statistics):
+        """
+        Add the rows fetched since the previous call to the previous STATISTICS.
+        """
+        rows = next(self._row_counter)
+        self._previous.rows += rows - self._row_mark
+        # reading the counter advanced it as well
+        self._row_mark = rows + 1
+        self._previous = statistics
+
+    def record(self, statement, duration, cursor):
+        """
+        Record that STATEMENT took DURATION seconds to execute.
+
+        Returns CURSOR.  The rows changed by statements other than SELECT are obtained from the
+        cursor rowcount.  The rows returned by SELECT statements are counted while they are fetched
+        from CURSOR, until the next statement is recorded.
+        """
+        entry = self._statements.get(statement) or self._get_entry(statement)
+        self._clock += 1
+        entry[1] = self._clock
+        statistics = entry[0]
+        statistics.duration += duration
+        # the exponent of DURATION is a cheap power of two histogram bucket
+        statistics.histogram[frexp(duration or _MIN_DURATION)[1]] += 1
+
+        if self._count_rows:
+            # inlined _add_fetched_rows, the rows fetched since the previous statement belong to it
+            rows = next(self._row_counter)
+            self._previous.rows += rows - self._row_mark
+            self._row_mark = rows + 1
+            self._previous = statistics
+
+        if not statistics.select:
+            rowcount = getattr(cursor, "rowcount", -1)
+            if rowcount > 0:
+                statistics.rows += rowcount
+        return cursor
+
+    def _get_entry(self, statement):
+        template, lists = _get_statement_template(statement)
+        statistics = self._templates.get(template)
+        if statistics is None:
+            statistics = self._templates[template] = _QueryStatistics(template[:6].upper() in (u"SELECT", u"PRAGMA"))
+
+        entry = [statistics, 0]
+        # statements containing lists that are built using string formatting rarely repeat, these
+        # are not cached to keep the other statements in the cache
+        if not lists:
+            if len(self._statements) >= self._cache_size:
+                self._evict()
+            self._statements[statement] = entry
+        return entry
+
+    def _evict(self):
+        # remove the least recently used quarter of the statements
+        statements = sorted(self._statements.iteritems(), key=lambda (_, entry): entry[1])
+        for statement, _ in statements[:max(1, len(statements) / 4)]:
+            del self._statements[statement]
+        logger.debug("evicted statements from cache, %d statements for %d templates", len(self._statements), len(self._templates))
+
+    def get_statistics(self):
+        """
+        Returns a dictionary with TEMPLATE:STATISTICS pairs, where STATISTICS is a dictionary
+        containing the count, total duration, p50 and p99 latency (in seconds), and rows.
+        """
+        if self._count_rows:
+            self._add_fetched_rows(self._previous)
+
+        return dict((template, {"count": statistics.count,
+                                "duration": statistics.duration,
+                                "p50": statistics.get_percentile(50),
+                                "p99": statistics.get_percentile(99),
+                                "rows": statistics.rows})
+                    for template, statistics
+                    in self._templates.iteritems())
+
+    def log_statistics(self, limit=10):
+        """
+        Log the LIMIT statement templates with the largest total duration.
+        """
+        entries = sorted(self.get_statistics().iteritems(), key=lambda (_, statistics): statistics["duration"], reverse=True)
+        logger.info(" COUNT      SUM      P50      P99     ROWS  TEMPLATE")
+        for template, statistics in entries[:limit]:
+            logger.info("%5dx %7.3fs %7.4fs %7.4fs %8d  %s",
+                        statistics["count"], statistics["duration"], statistics["p50"], statistics["p99"], statistics["rows"], template)
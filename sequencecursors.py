@@ -0,0 +1,91 @@
+"""
+This module provides an in-memory cache of the sequence number cursors of a community.
+
+Messages with enable_sequence_number must be processed in sequence number order.  To check this we
+need, for every (member, meta message) pair, the highest global time and the number of stored
+packets, undone or not, i.e. the most recent sequence number.  Counting the rows of a prolific member becomes
+slower as its history grows, the SequenceCursors load each cursor once and are kept up to date by
+the Community when packets are stored, pruned, or otherwise removed.
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+
+class SequenceCursors(object):
+
+    def __init__(self, database):
+        """
+        Create a new, empty, cache that loads the cursors from DATABASE when required.
+        """
+        self._database = database
+        # (META_MESSAGE, MEMBER):(HIGHEST_GLOBAL_TIME, COUNT) pairs
+        self._cursors = {}
+
+    def __len__(self):
+        return len(self._cursors)
+
+    def get(self, meta_message, members):
+        """
+        Returns a dictionary with member database id:(highest global time, count) for all MEMBERS.
+
+        META_MESSAGE is the database id of the meta message.  Cursors that are not cached yet are
+        loaded using one query.
+        """
+        assert isinstance(meta_message, (int, long)), type(meta_message)
+        members = set(members)
+        assert all(isinstance(member, (int, long)) for member in members)
+        missing = [member for member in members if not (meta_message, member) in self._cursors]
+        if missing:
+            cursors = dict((member, (0, 0)) for member in missing)
+            cursors.update((member, (global_time, count))
+                           for member, global_time, count
+                           in self._database.execute(u"SELECT member, MAX(global_time), COUNT(*) FROM sync WHERE meta_message = ? AND member IN (%s) GROUP BY member" % u", ".join(unicode(member) for member in missing),
+                                                     (meta_message,)))
+            self._cursors.update(((meta_message, member), cursor) for member, cursor in cursors.iteritems())
+
+        return dict((member, self._cursors[(meta_message, member)]) for member in members)
+
+    def add(self, meta_message, member, global_time):
+        """
+        Called after a packet of META_MESSAGE created by MEMBER at GLOBAL_TIME was stored.
+        """
+        key = (meta_message, member)
+        cursor = self._cursors.get(key)
+        # cursors that are not cached will be loaded from the database when required
+        if cursor is not None:
+            self._cursors[key] = (max(cursor[0], global_time), cursor[1] + 1)
+
+    def invalidate(self, meta_message, member=None):
+        """
+        Remove the cursors of META_MESSAGE, or only the cursor of META_MESSAGE and MEMBER, they are
+        loaded again when required.
+        """
+        if member is None:
+            for key in [key for key in self._cursors.iterkeys() if key[0] == meta_message]:
+                del self._cursors[key]
+        else:
+            self._cursors.pop((meta_message, member), None)
+
+    def clear(self):
+        """
+        Remove all cursors.
+        """
+        self._cursors.clear()
+
+    def check(self):
+        """
+        Compare all cached cursors with the database, cursors that differ are corrected.
+
+        Returns the number of cursors that were corrected.
+        """
+        corrected = 0
+        for key, cursor in self._cursors.items():
+            meta_message, member = key
+            global_time, count = self._database.execute(u"SELECT MAX(global_time), COUNT(*) FROM sync WHERE meta_message = ? AND member = ?",
+                                                        (meta_message, member)).next()
+            if (global_time or 0, count) != cursor:
+                logger.warning("sequence cursor for %d@%d is %s, the database has %s", member, meta_message, cursor, (global_time or 0, count))
+                self._cursors[key] = (global_time or 0, count)
+                corrected += 1
+        return corrected
@@ -0,0 +1,81 @@
+"""
+This module provides a bounded cache of packets whose signatures were already verified.
+
+The same signed packet is often received many times, i.e. through sync responses, forwards, and
+again when a delayed packet is processed.  The SignatureCache remembers the sha1 digest of every
+packet that passed verification, together with the public keys of the signers, such that the
+expensive EC verification can be skipped when the exact same packet arrives again.
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+try:
+    # python 2.7 only...
+    from collections import OrderedDict
+except ImportError:
+    from .python27_ordereddict import OrderedDict
+
+
+class SignatureCache(object):
+
+    def __init__(self, size=4096):
+        """
+        Create a new cache that remembers at most SIZE packets, the least recently used packets are
+        removed first.
+        """
+        assert isinstance(size, int), type(size)
+        assert 0 < size, size
+        self._size = size
+        # DIGEST:PUBLIC_KEYS pairs
+        self._entries = OrderedDict()
+        self._hit = 0
+        self._miss = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def hit(self):
+        return self._hit
+
+    @property
+    def miss(self):
+        return self._miss
+
+    def reset_statistics(self):
+        self._hit = 0
+        self._miss = 0
+
+    def get(self, digest):
+        """
+        Returns a tuple with the public keys that signed the packet with DIGEST, or None when the
+        packet was not verified before.
+        """
+        public_keys = self._entries.pop(digest, None)
+        if public_keys is None:
+            self._miss += 1
+        else:
+            self._hit += 1
+            # move to the most recently used position
+            self._entries[digest] = public_keys
+        return public_keys
+
+    def add(self, digest, public_keys):
+        """
+        Remember that the packet with DIGEST has valid signatures from PUBLIC_KEYS.
+        """
+        assert isinstance(digest, str), type(digest)
+        assert len(digest) == 20, len(digest)
+        assert isinstance(public_keys, tuple), type(public_keys)
+        assert all(isinstance(public_key, str) for public_key in public_keys)
+        self._entries.pop(digest, None)
+        self._entries[digest] = public_keys
+        if len(self._entries) > self._size:
+            self._entries.popitem(False)
+
+    def clear(self):
+        """
+        Remove all entries.
+        """
+        self._entries.clear()
@@ -83,6 +83,18 @@ class DispersyStatistics(Statistics):
         # size of the sendqueue
         self.cur_sendqueue = 0
 
+        # nr of signature verifications that were skipped (hit) or performed (miss) because of the
+        # signature cache
+        self.signature_cache_hit = 0
+        self.signature_cache_miss = 0
+
+        # nr of incoming packets waiting to be processed in a batch, nr of batches processed, and
+        # the average and maximum seconds between the creation and the processing of a batch
+        self.batch_queue_depth = 0
+        self.batch_flush_count = 0
+        self.batch_flush_latency = 0.0
+        self.batch_flush_latency_max = 0.0
+
         # nr of candidates introduced/stumbled upon
         self.total_candidates_discovered = 0
 
@@ -163,6 +175,18 @@ class DispersyStatistics(Statistics):
         self.total_send = self._dispersy.endpoint.total_send
         self.cur_sendqueue = self._dispersy.endpoint.cur_sendqueue
 
+        self.signature_cache_hit = self._dispersy.signature_cache.hit
+        self.signature_cache_miss = self._dispersy.signature_cache.miss
+
+        batch_scheduler = self._dispersy.batch_scheduler
+        self.batch_queue_depth = batch_scheduler.depth
+        self.batch_flush_count = batch_scheduler.flush_count
+        self.batch_flush_latency = batch_scheduler.flush_latency / batch_scheduler.flush_count if batch_scheduler.flush_count else 0.0
+        self.batch_flush_latency_max = batch_scheduler.flush_latency_max
+
+        # TEMPLATE:STATISTICS pairs, see QueryProfiler.get_statistics
+        self.database_queries = self._dispersy.database.query_profiler.get_statistics()
+
         self.communities = [community.statistics for community in self._dispersy.get_communities()]
         for community in self.communities:
             community.update(database=database)
@@ -184,6 +208,18 @@ class DispersyStatistics(Statistics):
         self.cur_sendqueue = self._dispersy.endpoint.cur_sendqueue
         self.start = self.timestamp = time()
 
+        self._dispersy.signature_cache.reset_statistics()
+        self.signature_cache_hit = 0
+        self.signature_cache_miss = 0
+
+        self._dispersy.batch_scheduler.reset_statistics()
+        self.batch_flush_count = 0
+        self.batch_flush_latency = 0.0
+        self.batch_flush_latency_max = 0.0
+
+        self._dispersy.database.query_profiler.reset()
+        self.database_queries = {}
+
         self.walk_attempt = 0
         self.walk_reset = 0
         self.walk_success = 0
@@ -228,6 +264,14 @@ class CommunityStatistics(Statistics):
         self.sync_bloom_reuse = 0
         self.sync_bloom_send = 0
         self.sync_bloom_skip = 0
+        # nr incoming invertible bloom filters that could, or could not, be decoded completely
+        self.sync_invertible_decode_success = 0
+        self.sync_invertible_decode_failure = 0
+        # nr incoming sync bloom filters that could, or could not, use the cached sync response packets
+        self.sync_response_cache_hit = 0
+        self.sync_response_cache_miss = 0
+        # meta message name:(window, size, rate) for the meta messages that use adaptive batching
+        self.batch_parameters = dict()
         self.update()
 
     def update(self, database=False):
@@ -236,6 +280,11 @@ class CommunityStatistics(Statistics):
         self.dispersy_enable_candidate_walker = self._community.dispersy_enable_candidate_walker
         self.dispersy_enable_candidate_walker_responses = self._community.dispersy_enable_candidate_walker_responses
         self.global_time = self._community.global_time
+        batch_scheduler = self._community.dispersy.batch_scheduler
+        self.batch_parameters = dict((meta.name, (policy.window, policy.size, policy.rate))
+                                     for meta, policy
+                                     in ((meta, batch_scheduler.get_policy(meta)) for meta in self._community.get_meta_messages())
+                                     if policy)
         now = time()
         self.candidates = [(candidate.lan_address, candidate.wan_address, candidate.global_time)
                            for candidate
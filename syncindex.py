@@ -0,0 +1,91 @@
+"""
+This module provides an in-memory index over the sync table.
+
+The sync bloom filter strategies in Community need to know how many syncable packets exist and
+which global time ranges contain a certain number of packets.  Rather than running several ORDER BY
+... LIMIT queries on the sync table for every walker step, the SyncIndex keeps the global times of
+all syncable, not undone, packets in one sorted list.  It is kept up to date by the Community when
+packets are stored, undone, pruned, or otherwise removed.
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+from bisect import bisect_left, insort
+
+
+class SyncIndex(object):
+
+    def __init__(self, entries=()):
+        """
+        Create a new index from (global_time, meta_message_database_id) ENTRIES.
+        """
+        self._entries = sorted((global_time, meta_message) for global_time, meta_message in entries)
+        logger.debug("new sync index with %d entries", len(self._entries))
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, global_time, meta_message):
+        """
+        Add one packet, identified by GLOBAL_TIME and META_MESSAGE database id, to the index.
+        """
+        assert isinstance(global_time, (int, long)), type(global_time)
+        assert isinstance(meta_message, (int, long)), type(meta_message)
+        insort(self._entries, (global_time, meta_message))
+
+    def remove(self, global_time, meta_message):
+        """
+        Remove one packet, identified by GLOBAL_TIME and META_MESSAGE database id, from the index.
+
+        Returns True when the packet was in the index.
+        """
+        entries = self._entries
+        index = bisect_left(entries, (global_time, meta_message))
+        if index < len(entries) and entries[index] == (global_time, meta_message):
+            del entries[index]
+            return True
+        return False
+
+    def prune(self, meta_message, global_time):
+        """
+        Remove all packets of META_MESSAGE with a global time up to and including GLOBAL_TIME.
+        """
+        entries = self._entries
+        index = bisect_left(entries, (global_time + 1,))
+        entries[:index] = [entry for entry in entries[:index] if entry[1] != meta_message]
+
+    def select(self, global_time, to_select, higher=True):
+        """
+        Returns a (global_times, fixed) tuple.
+
+        GLOBAL_TIMES contains at most TO_SELECT global times, sorted in ascending order, that are
+        either higher or lower than GLOBAL_TIME, depending on HIGHER.  Global times that occur more
+        than once are either all included or all excluded.
+
+        FIXED is True when more than TO_SELECT global times were available, i.e. the returned global
+        times do not cover everything beyond GLOBAL_TIME.
+        """
+        entries = self._entries
+        if higher:
+            index = bisect_left(entries, (global_time + 1,))
+            data = [entry[0] for entry in entries[index:index + to_select + 1]]
+        else:
+            index = bisect_left(entries, (global_time,))
+            data = [entry[0] for entry in entries[max(0, index - to_select - 1):index]]
+            data.reverse()
+
+        fixed = False
+        if len(data) > to_select:
+            fixed = True
+
+            # if last 2 global times are equal, then we need to drop those
+            global_time = data[-1]
+            del data[-1]
+            while data and data[-1] == global_time:
+                del data[-1]
+
+        if not higher:
+            data.reverse()
+
+        return data, fixed
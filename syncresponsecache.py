@@ -0,0 +1,139 @@
+"""
+This module provides a short-lived cache for the packets that are candidates for a sync response.
+
+Every incoming dispersy-introduction-request that contains a sync bloom filter results in one large
+query over the sync table.  Many peers send requests for the same, or overlapping, sync ranges.  The
+SyncResponseCache keeps the query results for a few seconds, keyed by the per meta message sync
+windows, such that only the bloom filter has to be applied for each request.  It is kept up to date
+by the Community when packets are stored, pruned, or otherwise removed.
+
+The cache is bounded by the total number of bytes in all entries.  Windows whose packets exceed the
+per entry limit are never cached, these are streamed from the database for every request.
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+from time import time
+
+
+class SyncResponseCache(object):
+
+    def __init__(self, timeout=5.0, size=16, max_bytes=4 * 1024 * 1024, entry_bytes=512 * 1024):
+        """
+        Create a new cache that keeps at most SIZE entries, each for at most TIMEOUT seconds.
+
+        The packets in all entries combined contain at most MAX_BYTES bytes, the packets in one
+        entry contain at most ENTRY_BYTES bytes.
+        """
+        assert isinstance(timeout, float), type(timeout)
+        assert isinstance(size, int), type(size)
+        assert 0 < size, size
+        assert isinstance(max_bytes, int), type(max_bytes)
+        assert isinstance(entry_bytes, int), type(entry_bytes)
+        assert 0 < entry_bytes <= max_bytes, [entry_bytes, max_bytes]
+        self._timeout = timeout
+        self._size = size
+        self._max_bytes = max_bytes
+        self._entry_bytes = entry_bytes
+        # WINDOWS: (DEADLINE, PACKETS, BYTES)
+        self._entries = {}
+        # the number of bytes in all entries combined
+        self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    @property
+    def bytes(self):
+        """
+        The number of bytes in all entries combined.
+        """
+        return self._bytes
+
+    @property
+    def entry_bytes(self):
+        """
+        The maximum number of bytes in one entry, larger windows are not cached.
+        """
+        return self._entry_bytes
+
+    def _remove(self, windows):
+        _, _, bytes_ = self._entries.pop(windows)
+        self._bytes -= bytes_
+
+    def get(self, windows):
+        """
+        Returns the packets stored for WINDOWS, or None when they are not available.
+
+        WINDOWS is a tuple containing a (meta_message_database_id, time_low, time_high, offset, modulo)
+        tuple for every syncable meta message.  A TIME_HIGH of zero indicates that the window has no
+        upper bound.
+        """
+        entry = self._entries.get(windows)
+        if entry:
+            deadline, packets, _ = entry
+            if deadline > time():
+                return packets
+            self._remove(windows)
+        return None
+
+    def set(self, windows, packets):
+        """
+        Store PACKETS for WINDOWS, see get.
+
+        Returns False, without storing PACKETS, when PACKETS contain more than entry_bytes bytes.
+        """
+        assert isinstance(windows, tuple), type(windows)
+        assert isinstance(packets, list), type(packets)
+        bytes_ = sum(len(packet) for packet in packets)
+        if bytes_ > self._entry_bytes:
+            return False
+
+        if windows in self._entries:
+            self._remove(windows)
+
+        if len(self._entries) >= self._size or self._bytes + bytes_ > self._max_bytes:
+            now = time()
+            for key in [key for key, (deadline, _, _) in self._entries.iteritems() if deadline <= now]:
+                self._remove(key)
+
+            while len(self._entries) >= self._size or self._bytes + bytes_ > self._max_bytes:
+                # remove the entry that expires first
+                self._remove(min(self._entries.iterkeys(), key=lambda key: self._entries[key][0]))
+
+        self._entries[windows] = (time() + self._timeout, packets, bytes_)
+        self._bytes += bytes_
+        return True
+
+    def invalidate(self, meta_message, global_time):
+        """
+        Remove all entries that include a packet of META_MESSAGE with GLOBAL_TIME, i.e. because
+        that packet was added or removed.
+        """
+        for windows in self._entries.keys():
+            for window_meta_message, time_low, time_high, offset, modulo in windows:
+                if (window_meta_message == meta_message and
+                    time_low <= global_time and
+                    (time_high == 0 or global_time <= time_high) and
+                    (global_time + offset) % modulo == 0):
+                    self._remove(windows)
+                    break
+
+    def prune(self, meta_message, global_time):
+        """
+        Remove all entries that may include packets of META_MESSAGE with a global time up to and
+        including GLOBAL_TIME.
+        """
+        for windows in self._entries.keys():
+            for window_meta_message, time_low, _, _, _ in windows:
+                if window_meta_message == meta_message and time_low <= global_time:
+                    self._remove(windows)
+                    break
+
+    def clear(self):
+        """
+        Remove all entries.
+        """
+        self._entries.clear()
+        self._bytes = 0
@@ -562,7 +562,7 @@ class DebugNode(object):
         meta = self._community.get_meta_message(u"dispersy-missing-proof")
         return meta.impl(distribution=(global_time,), payload=(member, global_time))
 
-    def create_dispersy_introduction_request(self, destination, source_lan, source_wan, advice, connection_type, sync, identifier, global_time):
+    def create_dispersy_introduction_request(self, destination, source_lan, source_wan, advice, connection_type, sync, identifier, global_time, double_hashing_support=False):
         """
         Returns a new dispersy-introduction-request message.
         """
@@ -591,7 +591,7 @@ class DebugNode(object):
         return meta.impl(authentication=(self._my_member,),
                          destination=(destination,),
                          distribution=(global_time,),
-                         payload=(destination.sock_addr, source_lan, source_wan, advice, connection_type, sync, identifier))
+                         payload=(destination.sock_addr, source_lan, source_wan, advice, connection_type, sync, identifier, double_hashing_support))
 
     def _create_text(self, message_name, text, global_time, resolution=(), destination=()):
         assert isinstance(message_name, unicode), type(message_name)
@@ -664,6 +664,12 @@ class DebugNode(object):
         """
         return self._create_text(u"full-sync-global-time-pruning-text", text, global_time)
 
+    def create_lazy_full_sync_text(self, text, global_time):
+        """
+        Returns a new lazy-full-sync-text message.
+        """
+        return self._create_text(u"lazy-full-sync-text", text, global_time)
+
     def create_in_order_text(self, text, global_time):
         """
         Returns a new ASC-text message.
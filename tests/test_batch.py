@@ -55,7 +55,7 @@ class TestBatch(DispersyTestFunc):
 
         # wait till the batch is processed
         meta = community.get_meta_message(u"full-sync-text")
-        while meta in self._dispersy._batch_cache:
+        while meta in self._dispersy._batch_scheduler:
             yield 0.1
 
         end = time()
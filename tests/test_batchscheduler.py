@@ -0,0 +1,123 @@
+import logging
+logger = logging.getLogger(__name__)
+
+from unittest import TestCase
+
+from ..batchscheduler import BatchPolicy, BatchScheduler
+from ..message import BatchConfiguration
+
+
+class Meta(object):
+
+    def __init__(self, name, max_size, **kargs):
+        self.name = name
+        self.batch = BatchConfiguration(max_window=5.0, max_size=max_size, **kargs)
+
+
+class Callback(object):
+
+    """
+    Collects registered tasks, they run only when run_all is called.
+    """
+
+    def __init__(self):
+        self.tasks = []
+
+    def register(self, call, args=(), delay=0.0, priority=0):
+        self.tasks.append((delay, call, args))
+
+    def run_all(self):
+        tasks, self.tasks = sorted(self.tasks, key=lambda task: task[0]), []
+        for _, call, args in tasks:
+            call(*args)
+
+
+class TestBatchScheduler(TestCase):
+
+    def setUp(self):
+        self.callback = Callback()
+        self.batches = []
+        self.scheduler = BatchScheduler(self.callback, lambda meta, timestamp, batch: self.batches.append((meta.name, batch)))
+
+    def test_window(self):
+        """
+        Testing that all packets added within the window are processed as one batch, using one task.
+        """
+        meta = Meta(u"a", 100)
+        for index in xrange(10):
+            self.scheduler.add(meta, 0.0, [index])
+        self.assertEqual(len(self.callback.tasks), 1)
+        self.assertIn(meta, self.scheduler)
+        self.assertEqual(self.scheduler.depth, 10)
+
+        self.callback.run_all()
+        self.assertEqual(self.batches, [(u"a", range(10))])
+        self.assertNotIn(meta, self.scheduler)
+        self.assertEqual(self.scheduler.depth, 0)
+        self.assertEqual(self.scheduler.flush_count, 1)
+
+    def test_max_size(self):
+        """
+        Testing that batches exceeding max_size are processed in max_size chunks.
+        """
+        meta = Meta(u"a", 4)
+        self.scheduler.add(meta, 0.0, range(10))
+        self.callback.run_all()
+        self.assertEqual(self.batches, [(u"a", [0, 1, 2, 3]), (u"a", [4, 5, 6, 7]), (u"a", [8, 9])])
+        self.assertEqual(self.scheduler.depth, 0)
+
+    def test_flush_discard(self):
+        """
+        Testing BatchScheduler.flush and BatchScheduler.discard, the pending tasks must not process
+        the batches again.
+        """
+        a = Meta(u"a", 100)
+        b = Meta(u"b", 100)
+        self.scheduler.add(a, 0.0, [1, 2])
+        self.scheduler.add(b, 0.0, [3])
+
+        self.scheduler.flush(a)
+        self.assertEqual(self.scheduler.discard(b), 1)
+        self.assertEqual(len(self.scheduler), 0)
+
+        self.callback.run_all()
+        self.assertEqual(self.batches, [(u"a", [1, 2])])
+        self.assertEqual(self.scheduler.depth, 0)
+
+    def test_policy(self):
+        """
+        Testing that BatchPolicy stays within the bounds of the BatchConfiguration.
+        """
+        batch = BatchConfiguration(max_window=1.0, max_size=64, min_window=0.1, min_size=8)
+        self.assertTrue(batch.adaptive)
+        self.assertFalse(BatchConfiguration(max_window=1.0).adaptive)
+
+        # light load: the window shrinks
+        policy = BatchPolicy(batch)
+        policy.rate = 0.5
+        for _ in xrange(10):
+            policy._last_flush -= 10.0
+            policy.update(1, 0.001)
+        self.assertEqual(policy.window, 0.1)
+        self.assertEqual(policy.size, 64)
+
+        # heavy load with slow processing: the window grows and the size shrinks
+        for _ in xrange(10):
+            policy.update(64, 2.0)
+        self.assertEqual(policy.window, 1.0)
+        self.assertEqual(policy.size, 8)
+
+        # heavy load with fast processing: the size grows again
+        for _ in xrange(50):
+            policy.update(policy.size, 0.001)
+        self.assertEqual(policy.size, 64)
+
+    def test_adaptive_scheduler(self):
+        """
+        Testing that BatchScheduler uses the size chosen by the BatchPolicy.
+        """
+        meta = Meta(u"a", 64, min_window=0.1, min_size=8)
+        self.scheduler.get_policy(meta).size = 8
+        self.scheduler.add(meta, 0.0, range(20))
+        self.callback.run_all()
+        self.assertEqual([len(batch) for _, batch in self.batches], [8, 8, 4])
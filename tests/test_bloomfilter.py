@@ -1,9 +1,11 @@
 import logging
 logger = logging.getLogger(__name__)
 
+from binascii import unhexlify
 from time import time
-from unittest import TestCase
+from unittest import TestCase, skipIf
 
+from .. import bloomfilter
 from ..bloomfilter import BloomFilter
 from ..decorator import attach_profiler
 
@@ -33,6 +35,9 @@ class TestBloomFilter(TestCase):
             self.assertEqual(len(bloom.bytes), 128)
             self.assertEqual(bloom.prefix, "p")
 
+        # the bits are stored in whole bytes
+        self.assertRaises(ValueError, BloomFilter, 128 * 8 + 4, 0.25)
+
     def test_adaptive_size_constructor(self):
         """
         Testing BloomFilter(float:f_error_rate, int:n_capacity, str:prefix="")
@@ -94,6 +99,29 @@ class TestBloomFilter(TestCase):
         bloom.clear()
         self.assertEqual(bloom.bits_checked, 0)
 
+    def test_wire_layout(self):
+        """
+        Testing that BloomFilter.bytes is identical to the little-endian representation of a long
+        where bit N is set for every hash position N.
+        """
+        for prefix in ("", "p"):
+            bloom = BloomFilter(128 * 8, 0.25, prefix)
+            keys = [str(i) for i in xrange(100)]
+            bloom.add_keys(keys)
+
+            filter_ = 0
+            for key in keys:
+                hash_ = bloom._salt.copy()
+                hash_.update(key)
+                for pos in bloom._fmt_unpack(hash_.digest()):
+                    filter_ |= 1 << (pos % bloom.size)
+            hex_ = "%x" % filter_
+            expected = unhexlify("0" * (bloom.size / 4 - len(hex_)) + hex_)[::-1]
+
+            self.assertEqual(bloom.bytes, expected)
+            self.assertEqual(bloom.bits_checked, bin(filter_).count("1"))
+            self.assertEqual(BloomFilter(expected, bloom.functions, prefix).bytes, expected)
+
     def test_false_positives(self):
         """
         Testing false positives.
@@ -116,8 +144,91 @@ class TestBloomFilter(TestCase):
                 (0.4, 1024, "p")]
 
         for f_error_rate, n_capacity, prefix in args:
-            bloom = BloomFilter(f_error_rate, n_capacity, prefix)
-            bloom.add_keys(str(i) for i in xrange(n_capacity))
-            self.assertTrue(all(str(i) in bloom for i in xrange(n_capacity)))
-            false_positives = sum(str(i) in bloom for i in xrange(n_capacity, n_capacity + 10000))
-            self.assertAlmostEqual(1.0 * false_positives / 10000, f_error_rate, delta=0.05)
+            for double_hashing in (False, True):
+                bloom = BloomFilter(f_error_rate, n_capacity, prefix, double_hashing=double_hashing)
+                bloom.add_keys(str(i) for i in xrange(n_capacity))
+                self.assertTrue(all(str(i) in bloom for i in xrange(n_capacity)))
+                false_positives = sum(str(i) in bloom for i in xrange(n_capacity, n_capacity + 10000))
+                self.assertAlmostEqual(1.0 * false_positives / 10000, f_error_rate, delta=0.05)
+
+    def test_double_hashing(self):
+        """
+        Testing BloomFilter(..., double_hashing=True)
+        """
+        bloom = BloomFilter(128 * 8, 0.25, "p", double_hashing=True)
+        self.assertTrue(bloom.double_hashing)
+        bloom.add_keys(str(i) for i in xrange(100))
+        bytes_, functions = bloom.bytes, bloom.functions
+
+        clone = BloomFilter(bytes_, functions, "p", double_hashing=True)
+        self.assertEqual(clone.bytes, bytes_)
+        self.assertTrue(all(str(i) in clone for i in xrange(100)))
+
+        # the classic scheme gives a different filter for the same keys
+        classic = BloomFilter(128 * 8, 0.25, "p")
+        classic.add_keys(str(i) for i in xrange(100))
+        self.assertFalse(classic.double_hashing)
+        self.assertNotEqual(classic.bytes, bytes_)
+
+    @skipIf(bloomfilter.numpy is None, "numpy is not available")
+    def test_batch_paths(self):
+        """
+        Testing that the numpy and pure python paths give identical results.
+        """
+        numpy = bloomfilter.numpy
+        keys = [str(i) for i in xrange(1000)]
+        others = [str(i) for i in xrange(1000, 2000)]
+
+        try:
+            results = []
+            for double_hashing in (False, True):
+                for module_numpy in (numpy, None):
+                    bloomfilter.numpy = module_numpy
+                    bloom = BloomFilter(0.01, 1000, "p", double_hashing=double_hashing)
+                    bloom.add_keys(keys)
+                    results.append((bloom.bytes,
+                                    [tuple(positions) for positions in bloom.get_positions(others)],
+                                    bloom.contains_keys(keys + others),
+                                    list(bloom.not_filter((key,) for key in keys + others))))
+        finally:
+            bloomfilter.numpy = numpy
+
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(results[2], results[3])
+        self.assertTrue(all(results[0][2][:len(keys)]))
+        self.assertTrue(all(results[2][2][:len(keys)]))
+
+    @skipIf(bloomfilter.numpy is None, "numpy is not available")
+    def test_batch_performance(self):
+        """
+        Compare the numpy and pure python paths of not_filter on a filter that is typically used in
+        sync responses.
+        """
+        numpy = bloomfilter.numpy
+        # sync responses test packets, typically a few hundred bytes each
+        keys = [str(i).rjust(500, "x") for i in xrange(10000)]
+        tuples = [(key,) for key in keys] + [(str(i).rjust(500, "x"),) for i in xrange(10000, 20000)]
+
+        try:
+            for double_hashing in (False, True):
+                results = []
+                for module_numpy in (numpy, None):
+                    bloomfilter.numpy = module_numpy
+                    bloom = BloomFilter(1024 * 8 * 8, 0.01, "p", double_hashing=double_hashing)
+                    bloom.add_keys(keys)
+
+                    begin = time()
+                    missing = list(bloom.not_filter(iter(tuples)))
+                    end = time()
+                    logger.debug("%s %s: %.4f seconds for %d keys (%d missing)",
+                                 "double" if double_hashing else "classic", "numpy" if module_numpy else "python",
+                                 end - begin, len(tuples), len(missing))
+
+                    results.append((bloom.bytes,
+                                    [tuple(positions) for positions in bloom.get_positions(keys[:100])],
+                                    missing))
+
+                # both paths must set the same bits and find the same missing keys
+                self.assertEqual(results[0], results[1])
+        finally:
+            bloomfilter.numpy = numpy
@@ -0,0 +1,227 @@
+import logging
+logger = logging.getLogger(__name__)
+
+from struct import pack
+from time import time
+
+from .debugcommunity.community import DebugCommunity
+from .debugcommunity.conversion import DebugCommunityConversion
+from .debugcommunity.node import DebugNode
+from ..message import DropPacket
+from ..tool.tracker import BinaryTrackerConversion
+from .dispersytestclass import DispersyTestFunc, call_on_dispersy_thread
+
+
+class CopyCountingString(str):
+
+    """
+    A packet that counts the number of bytes that are copied out of it by slicing.
+    """
+
+    copied = 0
+    slices = 0
+
+    def __getslice__(self, begin, end):
+        data = str.__getslice__(self, begin, end)
+        CopyCountingString.copied += len(data)
+        CopyCountingString.slices += 1
+        return data
+
+    def __getitem__(self, key):
+        data = str.__getitem__(self, key)
+        CopyCountingString.copied += len(data)
+        CopyCountingString.slices += 1
+        return data
+
+
+class TestConversion(DispersyTestFunc):
+
+    @call_on_dispersy_thread
+    def test_decode_benchmark(self, length=1000):
+        """
+        Decode many packets and report the time and the number of bytes that are copied out of the
+        packet for each decoded packet.
+        """
+        community = DebugCommunity.create_community(self._dispersy, self._my_member)
+
+        # create node and ensure that SELF knows the node address
+        node = DebugNode(community)
+        node.init_socket()
+        node.init_my_member()
+
+        messages = [node.create_full_sync_text("benchmark #%d %s" % (global_time, "x" * 200), global_time) for global_time in xrange(10, 10 + length)]
+        packets = [CopyCountingString(message.packet) for message in messages]
+        conversion = community.get_conversion_for_packet(packets[0])
+
+        CopyCountingString.copied = CopyCountingString.slices = 0
+        begin = time()
+        decoded = [conversion.decode_message(node.candidate, packet, verify=False) for packet in packets]
+        end = time()
+
+        logger.info("decoded %d packets of %d bytes in %.2f us/packet, %.1f slices and %.1f bytes copied per packet",
+                    length,
+                    len(packets[0]),
+                    1000000.0 * (end - begin) / length,
+                    float(CopyCountingString.slices) / length,
+                    float(CopyCountingString.copied) / length)
+
+        self.assertEqual([message.payload.text for message in decoded], [message.payload.text for message in messages])
+        # the packet is copied once, without its signature, for the payload decoder
+        self.assertLess(CopyCountingString.copied / length, len(packets[0]) * 2)
+
+        # cleanup
+        community.create_dispersy_destroy_community(u"hard-kill")
+        self._dispersy.get_community(community.cid).unload_community()
+
+    @call_on_dispersy_thread
+    def test_payload_data(self):
+        """
+        Testing that the payload decoder is given the packet, without its signature, as a str.
+        """
+        received = []
+        decode_text = DebugCommunityConversion._decode_text
+
+        def _decode_text(conversion, placeholder, offset, data):
+            received.append(data)
+            return decode_text(conversion, placeholder, offset, data)
+
+        DebugCommunityConversion._decode_text = _decode_text
+        try:
+            community = DebugCommunity.create_community(self._dispersy, self._my_member)
+        finally:
+            DebugCommunityConversion._decode_text = decode_text
+
+        # create node and ensure that SELF knows the node address
+        node = DebugNode(community)
+        node.init_socket()
+        node.init_my_member()
+
+        message = node.create_full_sync_text("payload", 10)
+        conversion = community.get_conversion_for_packet(message.packet)
+        self.assertEqual(conversion.decode_message(node.candidate, message.packet).payload.text, "payload")
+        self.assertEqual(len(received), 1)
+        self.assertIs(type(received[0]), str)
+        self.assertEqual(received[0], message.packet[:len(message.packet) - node.my_member.signature_length])
+
+        # cleanup
+        community.create_dispersy_destroy_community(u"hard-kill")
+        self._dispersy.get_community(community.cid).unload_community()
+
+    @call_on_dispersy_thread
+    def test_header_encoding(self):
+        """
+        The precompiled header encoders and decoders must use the same wire format as before: the
+        member identifier, an optional resolution policy index, the global time, and an optional
+        sequence number.
+        """
+        community = DebugCommunity.create_community(self._dispersy, self._my_member)
+        conversion = community.get_conversion_for_message(community.get_meta_message(u"full-sync-text"))
+
+        node = DebugNode(community)
+        node.init_socket()
+        node.init_my_member()
+        mid = node.my_member.mid
+
+        meta = community.get_meta_message(u"dynamic-resolution-text")
+        messages = [(node.create_full_sync_text("text", 10), mid + pack(">Q", 10)),
+                    (node.create_sequence_text("text", 11, 1), mid + pack(">QL", 11, 1)),
+                    (node.create_last_1_test("text", 12), mid + pack(">Q", 12)),
+                    (node.create_dynamic_resolution_text("text", 13, meta.resolution.policies[1].implement()), mid + pack(">BQ", 1, 13))]
+
+        for message, header in messages:
+            self.assertEqual(message.packet[23:23 + len(header)], header)
+            decoded = conversion.decode_message(node.candidate, message.packet)
+            self.assertEqual(decoded.distribution.global_time, message.distribution.global_time)
+            self.assertEqual(decoded.payload.text, "text")
+
+        self.assertEqual(conversion.decode_message(node.candidate, messages[1][0].packet).distribution.sequence_number, 1)
+        self.assertIs(conversion.decode_message(node.candidate, messages[3][0].packet).resolution.policy.meta, meta.resolution.policies[1])
+
+        # cleanup
+        community.create_dispersy_destroy_community(u"hard-kill")
+        self._dispersy.get_community(community.cid).unload_community()
+
+    @call_on_dispersy_thread
+    def test_lazy_payload(self):
+        """
+        The payload of a meta message with lazy_payload is decoded when it is first used, and only
+        when decode_message is called with lazy=True.
+        """
+        community = DebugCommunity.create_community(self._dispersy, self._my_member)
+
+        node = DebugNode(community)
+        node.init_socket()
+        node.init_my_member()
+
+        message = node.create_lazy_full_sync_text("lazy", 10)
+        conversion = community.get_conversion_for_packet(message.packet)
+
+        self.assertTrue(conversion.decode_message(node.candidate, message.packet, verify=False).is_payload_decoded)
+        decoded = conversion.decode_message(node.candidate, message.packet, verify=False, lazy=True)
+        self.assertFalse(decoded.is_payload_decoded)
+        self.assertEqual(decoded.distribution.global_time, 10)
+        self.assertEqual(decoded.payload.text, "lazy")
+        self.assertTrue(decoded.is_payload_decoded)
+
+        # an invalid payload is only detected once it is used
+        offset = len(message.packet) - node.my_member.signature_length - len("lazy") - 1
+        packet = message.packet[:offset] + "\xff" + message.packet[offset + 1:]
+        decoded = conversion.decode_message(node.candidate, packet, verify=False, lazy=True)
+        self.assertRaises(DropPacket, getattr, decoded, "payload")
+
+        # the message is processed as usual
+        node.give_message(message)
+        self.assertEqual(community.fetch_packets(u"lazy-full-sync-text"), [message.packet])
+
+        # cleanup
+        community.create_dispersy_destroy_community(u"hard-kill")
+        self._dispersy.get_community(community.cid).unload_community()
+
+    @call_on_dispersy_thread
+    def test_dispatch_table(self):
+        """
+        Incoming packets for an attached community are dispatched to the most recent conversion
+        that can decode them, the entries are removed once the community is detached.
+        """
+        community = DebugCommunity.create_community(self._dispersy, self._my_member)
+
+        node = DebugNode(community)
+        node.init_socket()
+        node.init_my_member()
+
+        message = node.create_full_sync_text("dispatch", 10)
+        batch = list(self._dispersy._convert_packets_into_batch([(node.candidate, message.packet)]))
+        self.assertEqual(batch, [(message.meta, node.candidate, message.packet, community.get_conversion_for_packet(message.packet))])
+
+        # a newer conversion for the same prefix takes precedence
+        conversion = DebugCommunityConversion(community)
+        community.add_conversion(conversion)
+        batch = list(self._dispersy._convert_packets_into_batch([(node.candidate, message.packet)]))
+        self.assertIs(batch[0][3], conversion)
+
+        self._dispersy.get_community(community.cid).unload_community()
+        self.assertNotIn(message.packet[:23], self._dispersy._dispatch_table)
+
+    @call_on_dispersy_thread
+    def test_tracker_conversion(self):
+        """
+        Incoming packets are decoded through the tracker conversion, which does not verify
+        signatures, reusing the packet digest computed for the duplicate check.
+        """
+        community = DebugCommunity.create_community(self._dispersy, self._my_member)
+
+        node = DebugNode(community)
+        node.init_socket()
+        node.init_my_member()
+
+        message = node.create_dispersy_introduction_request(community.my_candidate, node.lan_address, node.wan_address, False, u"unknown", None, 42, 10)
+        conversion = BinaryTrackerConversion(community, community.get_conversion_for_packet(message.packet).community_version)
+
+        decoded, = self._dispersy._convert_batch_into_messages([(node.candidate, message.packet, conversion)])
+        self.assertEqual(decoded.packet, message.packet)
+        self.assertEqual(decoded.packet_digest, message.packet_digest)
+        self.assertEqual(decoded.payload.identifier, 42)
+
+        # cleanup
+        community.create_dispersy_destroy_community(u"hard-kill")
+        self._dispersy.get_community(community.cid).unload_community()
@@ -0,0 +1,286 @@
+import logging
+logger = logging.getLogger(__name__)
+
+from os import path
+from shutil import rmtree
+from tempfile import mkdtemp
+from threading import Event
+from time import time
+from unittest import TestCase
+
+from ..database import Database, DatabaseProfile, DatabaseReadPool, IgnoreCommits, ReadConnection, DEFAULT_PROFILE, DURABLE_PROFILE, FAST_PROFILE
+
+
+class ItemDatabase(Database):
+
+    def check_database(self, database_version):
+        if database_version == u"0":
+            self.executescript(u"""
+CREATE TABLE option(key TEXT PRIMARY KEY, value BLOB);
+INSERT INTO option(key, value) VALUES('database_version', '1');
+CREATE TABLE item(id INTEGER PRIMARY KEY, value TEXT);""")
+            self.commit()
+        return 1
+
+
+class SyncDatabase(Database):
+
+    def check_database(self, database_version):
+        if database_version == u"0":
+            self.executescript(u"""
+CREATE TABLE option(key TEXT PRIMARY KEY, value BLOB);
+INSERT INTO option(key, value) VALUES('database_version', '1');
+CREATE TABLE sync(id INTEGER PRIMARY KEY, meta_message INTEGER, global_time INTEGER, packet BLOB);
+CREATE INDEX sync_meta_message_global_time_index ON sync(meta_message, global_time);""")
+            self.commit()
+        return 1
+
+
+class TestReadConnection(TestCase):
+
+    def setUp(self):
+        self._directory = mkdtemp()
+        self._database = ItemDatabase(unicode(path.join(self._directory, "test.db")))
+        self._database.open()
+        self._database.executemany(u"INSERT INTO item (value) VALUES (?)", [(unicode(i),) for i in xrange(10)])
+        self._database.commit()
+
+    def tearDown(self):
+        self._database.close()
+        rmtree(self._directory)
+
+    def test_read_connection(self):
+        """
+        Testing that a ReadConnection sees committed changes and can not write.
+        """
+        database = ReadConnection(self._database.file_path)
+        self.assertEqual(next(database.execute(u"SELECT COUNT(*) FROM item"))[0], 10)
+
+        self._database.execute(u"INSERT INTO item (value) VALUES (?)", (u"new",))
+        self.assertEqual(next(database.execute(u"SELECT COUNT(*) FROM item"))[0], 10)
+        self._database.commit()
+        self.assertEqual(next(database.execute(u"SELECT COUNT(*) FROM item"))[0], 11)
+
+        # sqlite versions before 3.8.0 ignore PRAGMA query_only
+        if next(database.execute(u"PRAGMA query_only"), (0,))[0]:
+            self.assertRaises(Exception, database.execute, u"DELETE FROM item")
+        database.close()
+
+    def test_read_pool(self):
+        """
+        Testing that DatabaseReadPool runs tasks on its workers and returns the results.
+        """
+        results = []
+        done = Event()
+
+        class Callback(object):
+
+            @staticmethod
+            def register(call, args=()):
+                call(*args)
+
+        def result_func(result, tag):
+            results.append((result, tag))
+            if len(results) == 3:
+                done.set()
+
+        pool = DatabaseReadPool(self._database.file_path, Callback(), size=2)
+        for tag in xrange(3):
+            self.assertTrue(pool.submit(lambda database, limit: [value for value, in database.execute(u"SELECT value FROM item ORDER BY id LIMIT ?", (limit,))],
+                                        (tag,), result_func, (tag,)))
+        done.wait(10.0)
+        self.assertTrue(pool.stop())
+
+        self.assertEqual(sorted(results), [([], 0), ([u"0"], 1), ([u"0", u"1"], 2)])
+
+
+class TestGroupCommit(TestCase):
+
+    class Callback(object):
+
+        """
+        Collects registered tasks, they run only when run_all is called.
+        """
+
+        def __init__(self):
+            self.tasks = []
+
+        def register(self, call, args=(), delay=0.0):
+            self.tasks.append((call, args))
+
+        def run_all(self):
+            tasks, self.tasks = self.tasks, []
+            for call, args in tasks:
+                call(*args)
+
+    def setUp(self):
+        self._directory = mkdtemp()
+        self._database = ItemDatabase(unicode(path.join(self._directory, "test.db")))
+        self._database.open()
+        self._commits = []
+        self._database.attach_commit_callback(self._on_commit)
+
+    def tearDown(self):
+        self._database.close()
+        rmtree(self._directory)
+
+    def _on_commit(self, exiting=False):
+        self._commits.append(exiting)
+
+    def test_without_group_commit(self):
+        """
+        Testing that request_commit commits immediately when group commit is disabled.
+        """
+        committed = []
+        self._database.execute(u"INSERT INTO item (value) VALUES (?)", (u"new",))
+        self.assertTrue(self._database.request_commit(lambda: committed.append(True)))
+        self.assertEqual(committed, [True])
+        self.assertEqual(len(self._commits), 1)
+
+        # within a 'with database:' clause the commit is performed by __exit__
+        with self._database:
+            self.assertFalse(self._database.request_commit(lambda: committed.append(True)))
+            self.assertEqual(len(committed), 1)
+        self.assertEqual(len(committed), 2)
+        self.assertEqual(len(self._commits), 2)
+
+        # ignored commits do not leave the functions pending
+        with self._database:
+            self.assertFalse(self._database.request_commit(lambda: committed.append(True)))
+            raise IgnoreCommits()
+        self.assertEqual(len(committed), 3)
+        self.assertEqual(len(self._commits), 2)
+        self.assertEqual(self._database.group_commit_pending, 0)
+
+    def test_max_latency(self):
+        """
+        Testing that all requests made within the max_latency share one commit.
+        """
+        callback = self.Callback()
+        committed = []
+        self._database.enable_group_commit(callback, max_latency=1.0, max_pending=100)
+        for index in xrange(10):
+            self._database.execute(u"INSERT INTO item (value) VALUES (?)", (unicode(index),))
+            self.assertFalse(self._database.request_commit(lambda index=index: committed.append(index)))
+        self.assertEqual(len(callback.tasks), 1)
+        self.assertEqual(self._database.group_commit_pending, 10)
+        self.assertEqual(self._commits, [])
+
+        callback.run_all()
+        self.assertEqual(committed, range(10))
+        self.assertEqual(len(self._commits), 1)
+        self.assertEqual(self._database.group_commit_pending, 0)
+
+    def test_max_pending(self):
+        """
+        Testing that max_pending requests are committed immediately, and that commit and
+        disable_group_commit perform the pending requests.
+        """
+        callback = self.Callback()
+        self._database.enable_group_commit(callback, max_latency=1.0, max_pending=3)
+        self.assertFalse(self._database.request_commit())
+        self.assertFalse(self._database.request_commit())
+        self.assertTrue(self._database.request_commit())
+        self.assertEqual(len(self._commits), 1)
+
+        # the scheduled task finds nothing to commit
+        callback.run_all()
+        self.assertEqual(len(self._commits), 1)
+
+        self.assertFalse(self._database.request_commit())
+        self._database.commit()
+        self.assertEqual(self._database.group_commit_pending, 0)
+        self.assertFalse(self._database.request_commit())
+        self._database.disable_group_commit()
+        self.assertEqual(self._database.group_commit_pending, 0)
+        self.assertEqual(len(self._commits), 3)
+
+    def test_ignore_commits(self):
+        """
+        Testing that requests made within a 'with database:' clause that ignores its commits are
+        performed by the group commit.
+        """
+        callback = self.Callback()
+        committed = []
+        self._database.enable_group_commit(callback, max_latency=1.0, max_pending=2)
+        with self._database:
+            self.assertFalse(self._database.request_commit(lambda: committed.append(1)))
+            # max pending, the commit is deferred until __exit__
+            self.assertFalse(self._database.request_commit(lambda: committed.append(2)))
+            callback.run_all()
+            raise IgnoreCommits()
+        self.assertEqual(committed, [])
+        self.assertEqual(len(callback.tasks), 1)
+
+        callback.run_all()
+        self.assertEqual(committed, [1, 2])
+        self.assertEqual(len(self._commits), 1)
+
+
+class TestDatabaseProfile(TestCase):
+
+    def setUp(self):
+        self._directory = mkdtemp()
+
+    def tearDown(self):
+        rmtree(self._directory)
+
+    def test_profile(self):
+        """
+        Testing that the pragmas of a DatabaseProfile are applied, also to an existing database.
+        """
+        file_path = unicode(path.join(self._directory, "test.db"))
+        database = ItemDatabase(file_path, DatabaseProfile(journal_mode=u"DELETE", synchronous=u"FULL", page_size=4096))
+        database.open()
+        self.assertEqual(database.get_pragmas()[u"page_size"], 4096)
+        self.assertEqual(database.get_pragmas()[u"journal_mode"], u"DELETE")
+        self.assertEqual(database.get_pragmas()[u"synchronous"], u"FULL")
+        database.executemany(u"INSERT INTO item (value) VALUES (?)", [(unicode(i),) for i in xrange(10)])
+        database.close()
+
+        # the existing database is migrated to the default profile
+        database = ItemDatabase(file_path)
+        database.open()
+        self.assertIs(database.profile, DEFAULT_PROFILE)
+        pragmas = database.get_pragmas()
+        self.assertEqual(pragmas[u"page_size"], 8192)
+        self.assertEqual(pragmas[u"journal_mode"], u"WAL")
+        self.assertEqual(pragmas[u"synchronous"], u"NORMAL")
+        self.assertEqual(next(database.execute(u"SELECT COUNT(*) FROM item"))[0], 10)
+        database.close()
+
+        database = ItemDatabase(file_path, FAST_PROFILE)
+        database.open()
+        pragmas = database.get_pragmas()
+        self.assertEqual(pragmas[u"synchronous"], u"OFF")
+        self.assertEqual(pragmas[u"cache_size"], -65536)
+        database.close()
+
+    def test_benchmark(self, batches=200, batch_size=50, queries=2000):
+        """
+        Compare the profiles on an insert-heavy workload, BATCHES batches of BATCH_SIZE rows that
+        are each committed, and on a sync-query-heavy workload, QUERIES global time range queries.
+        """
+        for name, profile in ((u"default", DEFAULT_PROFILE), (u"durable", DURABLE_PROFILE), (u"fast", FAST_PROFILE)):
+            database = SyncDatabase(unicode(path.join(self._directory, "%s.db" % name)), profile)
+            database.open()
+
+            begin = time()
+            for batch in xrange(batches):
+                database.executemany(u"INSERT INTO sync (meta_message, global_time, packet) VALUES (?, ?, ?)",
+                                     [(index % 4, batch * batch_size + index, buffer("x" * 200)) for index in xrange(batch_size)])
+                database.commit()
+            insert_time = time() - begin
+
+            begin = time()
+            count = 0
+            for query in xrange(queries):
+                low = (query * 97) % (batches * batch_size)
+                count += len(list(database.execute(u"SELECT packet FROM sync WHERE meta_message = ? AND global_time BETWEEN ? AND ?",
+                                                   (query % 4, low, low + 100))))
+            query_time = time() - begin
+            database.close()
+
+            logger.info("%s profile: %.3fs for %d committed inserts, %.3fs for %d sync queries",
+                        name, insert_time, batches * batch_size, query_time, queries)
+            self.assertGreater(count, 0)
@@ -0,0 +1,115 @@
+import logging
+logger = logging.getLogger(__name__)
+
+from time import time
+from unittest import TestCase
+
+from ..dispersydatabase import DispersyDatabase
+
+
+class TestLastSyncHistory(TestCase):
+
+    def setUp(self):
+        self._database = DispersyDatabase(u":memory:")
+        self._database.open()
+
+    def tearDown(self):
+        self._database.close()
+
+    def _fill(self, members, packets_per_member, meta_message=1):
+        self._database.executemany(u"INSERT INTO sync (community, member, global_time, meta_message, packet, digest) VALUES (?, ?, ?, ?, ?, ?)",
+                                   ((meta_message, member, global_time, meta_message, buffer("packet %d@%d" % (member, global_time)), buffer("digest %d@%d" % (member, global_time)))
+                                    for member in xrange(1, members + 1)
+                                    for global_time in xrange(member, member + packets_per_member)))
+
+    def _get_obsolete_per_member(self, meta_message, members, history_size):
+        # the previous implementation, one query for every member
+        items = []
+        for member in members:
+            all_items = list(self._database.execute(u"SELECT id, global_time, digest FROM sync WHERE meta_message = ? AND member = ? ORDER BY global_time",
+                                                    (meta_message, member)))
+            if len(all_items) > history_size:
+                items.extend((syncid, global_time, str(digest)) for syncid, global_time, digest in all_items[:len(all_items) - history_size])
+        return items
+
+    def test_obsolete_last_sync(self, members=10000, packets_per_member=3, history_size=2):
+        """
+        Find the obsolete packets for MEMBERS members that each have PACKETS_PER_MEMBER packets, and
+        report the time required using a single query and using one query per member.
+        """
+        self._fill(members, packets_per_member)
+        # another meta message must not be affected
+        self._fill(10, packets_per_member, meta_message=2)
+        member_ids = set(xrange(1, members + 1))
+
+        begin = time()
+        expected = self._get_obsolete_per_member(1, member_ids, history_size)
+        middle = time()
+        items = self._database.get_obsolete_last_sync(1, member_ids, history_size)
+        end = time()
+
+        logger.info("found %d obsolete packets for %d members: %.3fs using one query per member, %.3fs using one query",
+                    len(items), members, middle - begin, end - middle)
+
+        self.assertEqual(len(items), members * (packets_per_member - history_size))
+        self.assertEqual(sorted(items), sorted(expected))
+        self.assertEqual(self._database.get_obsolete_last_sync(1, member_ids, packets_per_member), [])
+        self.assertEqual(self._database.get_obsolete_last_sync(1, [], history_size), [])
+
+    def test_obsolete_double_last_sync(self):
+        """
+        Testing that the packets of each member pair are ordered by global time and packet.
+        """
+        # (id, member, global time, packet, member1, member2)
+        rows = [(1, 1, 10, "b", 1, 2),
+                (2, 2, 10, "a", 1, 2),
+                (3, 1, 11, "c", 1, 2),
+                (4, 1, 9, "d", 1, 3),
+                (5, 3, 12, "e", 1, 3),
+                (6, 3, 5, "f", 3, 4)]
+        for syncid, member, global_time, packet, member1, member2 in rows:
+            self._database.execute(u"INSERT INTO sync (id, community, member, global_time, meta_message, packet, digest) VALUES (?, 1, ?, ?, 1, ?, ?)",
+                                   (syncid, member, global_time, buffer(packet), buffer(packet)))
+            self._database.execute(u"INSERT INTO double_signed_sync (sync, member1, member2) VALUES (?, ?, ?)", (syncid, member1, member2))
+
+        self.assertEqual(sorted(self._database.get_obsolete_double_last_sync(1, [(1, 2)], 1)), [(1, 10, "b"), (2, 10, "a")])
+        self.assertEqual(sorted(self._database.get_obsolete_double_last_sync(1, [(1, 2)], 2)), [(2, 10, "a")])
+        # (1, 4) and (3, 2) are not requested
+        self.assertEqual(sorted(self._database.get_obsolete_double_last_sync(1, [(1, 2), (3, 4)], 2)), [(2, 10, "a")])
+        self.assertEqual(sorted(self._database.get_obsolete_double_last_sync(1, [(1, 3), (3, 4)], 1)), [(4, 9, "d")])
+
+    def _get_obsolete_double_per_pair(self, meta_message, members, history_size):
+        # the previous implementation, one query for every pair
+        items = []
+        for member1, member2 in members:
+            all_items = list(self._database.execute(u"""
+SELECT sync.id, sync.global_time, sync.digest
+FROM sync
+JOIN double_signed_sync ON double_signed_sync.sync = sync.id
+WHERE sync.meta_message = ? AND double_signed_sync.member1 = ? AND double_signed_sync.member2 = ?
+ORDER BY sync.global_time, sync.packet""", (meta_message, member1, member2)))
+            if len(all_items) > history_size:
+                items.extend((syncid, global_time, str(digest)) for syncid, global_time, digest in all_items[:len(all_items) - history_size])
+        return items
+
+    def test_obsolete_double_last_sync_benchmark(self, pairs=10000, packets_per_pair=3, history_size=2):
+        """
+        Find the obsolete packets for PAIRS member pairs that each have PACKETS_PER_PAIR packets, and
+        report the time required using a single query and using one query per pair.
+        """
+        self._fill(pairs, packets_per_pair)
+        self._database.execute(u"INSERT INTO double_signed_sync (sync, member1, member2) SELECT id, member, member + ? FROM sync", (pairs,))
+        member_ids = set((member, member + pairs) for member in xrange(1, pairs + 1))
+
+        begin = time()
+        expected = self._get_obsolete_double_per_pair(1, member_ids, history_size)
+        middle = time()
+        items = self._database.get_obsolete_double_last_sync(1, member_ids, history_size)
+        end = time()
+
+        logger.info("found %d obsolete packets for %d pairs: %.3fs using one query per pair, %.3fs using one query",
+                    len(items), pairs, middle - begin, end - middle)
+
+        self.assertEqual(len(items), pairs * (packets_per_pair - history_size))
+        self.assertEqual(sorted(items), sorted(expected))
+        self.assertEqual(self._database.get_obsolete_double_last_sync(1, member_ids, packets_per_pair), [])
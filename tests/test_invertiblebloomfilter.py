@@ -0,0 +1,86 @@
+import logging
+logger = logging.getLogger(__name__)
+
+from hashlib import sha1
+from random import Random
+from unittest import TestCase
+
+from ..invertiblebloomfilter import InvertibleBloomFilter
+
+
+class TestInvertibleBloomFilter(TestCase):
+
+    @staticmethod
+    def _packets(rand, count):
+        return ["".join(chr(rand.randint(0, 255)) for _ in xrange(50)) for _ in xrange(count)]
+
+    def test_constructor(self):
+        """
+        Testing InvertibleBloomFilter(int:m_cells, int:k_functions=3) and InvertibleBloomFilter(str:bytes, int:k_functions)
+        """
+        ibf = InvertibleBloomFilter(90)
+        self.assertEqual(ibf.size, 90)
+        self.assertEqual(ibf.functions, 3)
+        self.assertEqual(len(ibf.bytes), 90 * InvertibleBloomFilter.cell_size)
+
+        ibf.add_keys(xrange(1, 100))
+        clone = InvertibleBloomFilter(ibf.bytes, ibf.functions)
+        self.assertEqual(clone.size, 90)
+        self.assertEqual(clone.bytes, ibf.bytes)
+
+    def test_decode(self):
+        """
+        Testing InvertibleBloomFilter.subtract and InvertibleBloomFilter.decode for small differences.
+        """
+        rand = Random(42)
+        common = self._packets(rand, 5000)
+        only_a = self._packets(rand, 30)
+        only_b = self._packets(rand, 20)
+
+        a = InvertibleBloomFilter(90)
+        b = InvertibleBloomFilter(90)
+        for packet in common + only_a:
+            a.add(packet)
+        for packet in common + only_b:
+            b.add(packet)
+
+        # b is transmitted
+        b = InvertibleBloomFilter(b.bytes, b.functions)
+
+        success, positive, negative = a.subtract(b).decode()
+        self.assertTrue(success)
+        self.assertEqual(positive, set(InvertibleBloomFilter.get_key(sha1(packet).digest()) for packet in only_a))
+        self.assertEqual(negative, set(InvertibleBloomFilter.get_key(sha1(packet).digest()) for packet in only_b))
+
+    def test_decode_failure(self):
+        """
+        Testing InvertibleBloomFilter.decode when the difference is too large.
+        """
+        rand = Random(42)
+        a = InvertibleBloomFilter(30)
+        keys = set(rand.randint(0, 2 ** 64 - 1) for _ in xrange(500))
+        a.add_keys(keys)
+
+        success, positive, negative = a.decode()
+        self.assertFalse(success)
+        self.assertTrue(positive.issubset(keys))
+        self.assertEqual(negative, set())
+
+    def test_decode_crafted(self):
+        """
+        Testing that InvertibleBloomFilter.decode terminates on a crafted filter containing a single
+        pure cell while the other cells of that key are empty.
+        """
+        key = 42
+        crafted = InvertibleBloomFilter(30)
+        position = crafted._get_positions(key)[0]
+        crafted._counts[position] = 1
+        crafted._key_sums[position] = key
+        crafted._checksum_sums[position] = InvertibleBloomFilter._get_checksum(key)
+        crafted = InvertibleBloomFilter(crafted.bytes, crafted.functions)
+
+        local = InvertibleBloomFilter(30)
+        for difference in (crafted.subtract(local), local.subtract(crafted)):
+            success, positive, negative = difference.decode()
+            self.assertFalse(success)
+            self.assertLessEqual(len(positive) + len(negative), 1)
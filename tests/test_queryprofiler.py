@@ -0,0 +1,150 @@
+import logging
+logger = logging.getLogger(__name__)
+
+from time import time
+from unittest import TestCase
+
+from ..queryprofiler import QueryProfiler, RowCountingCursor, get_statement_template
+from .test_database import ItemDatabase
+
+
+class TestQueryProfiler(TestCase):
+
+    def setUp(self):
+        self._database = ItemDatabase(u":memory:")
+        self._database.open()
+        self._database.query_profiler.reset()
+
+    def tearDown(self):
+        self._database.close()
+
+    def test_statement_template(self):
+        """
+        Testing that literals, lists of placeholders, and whitespace are removed from statements.
+        """
+        self.assertEqual(get_statement_template(u"SELECT id\n  FROM item WHERE id IN (?, ?,?) AND value = 'foo'"),
+                         u"SELECT id FROM item WHERE id IN (?, ...) AND value = ?")
+        self.assertEqual(get_statement_template(u"DELETE FROM item WHERE id IN (%s)" % ", ".join(str(id_) for id_ in xrange(10))),
+                         u"DELETE FROM item WHERE id IN (?, ...)")
+        self.assertEqual(get_statement_template(u"SELECT member1 FROM double_signed_sync LIMIT 1 OFFSET 2.5"),
+                         u"SELECT member1 FROM double_signed_sync LIMIT ? OFFSET ?")
+        self.assertEqual(get_statement_template(u"SELECT * FROM sync WHERE meta_message = 3 AND global_time IN (%s) AND member IN (?, ?)" % ", ".join(str(global_time) for global_time in xrange(1000))),
+                         u"SELECT * FROM sync WHERE meta_message = ? AND global_time IN (?, ...) AND member IN (?, ...)")
+
+    def test_statement_cache(self):
+        """
+        Testing that the least recently used statements are evicted from the cache and that
+        statements with literal lists are not cached.
+        """
+        profiler = QueryProfiler(cache_size=8)
+        for index in xrange(8):
+            profiler.record(u"SELECT %d" % index, 0.001, None)
+        # use the first statement again, the second is now the least recently used
+        profiler.record(u"SELECT 0", 0.001, None)
+        profiler.record(u"SELECT 8", 0.001, None)
+        self.assertIn(u"SELECT 0", profiler._statements)
+        self.assertNotIn(u"SELECT 1", profiler._statements)
+        self.assertIn(u"SELECT 8", profiler._statements)
+        self.assertLessEqual(len(profiler._statements), 8)
+
+        profiler.record(u"SELECT id FROM item WHERE id IN (1, 2, 3)", 0.001, None)
+        self.assertNotIn(u"SELECT id FROM item WHERE id IN (1, 2, 3)", profiler._statements)
+
+        statistics = profiler.get_statistics()
+        self.assertEqual(statistics[u"SELECT ?"]["count"], 10)
+        self.assertEqual(statistics[u"SELECT id FROM item WHERE id IN (?, ...)"]["count"], 1)
+
+    def test_record(self):
+        """
+        Testing the counts and rows that the Database records for each statement template.
+        """
+        self._database.executemany(u"INSERT INTO item (value) VALUES (?)", [(u"value %d" % index,) for index in xrange(10)])
+        for limit in xrange(1, 4):
+            self.assertEqual(len(list(self._database.execute(u"SELECT id FROM item LIMIT %d" % limit))), limit)
+        self.assertEqual(self._database.execute(u"SELECT COUNT(*) FROM item").next(), (10,))
+        self._database.execute(u"DELETE FROM item WHERE id > ?", (5,))
+
+        statistics = self._database.query_profiler.get_statistics()
+        self.assertEqual(sorted(statistics.keys()), [u"DELETE FROM item WHERE id > ?",
+                                                     u"INSERT INTO item (value) VALUES (?)",
+                                                     u"SELECT COUNT(*) FROM item",
+                                                     u"SELECT id FROM item LIMIT ?"])
+        self.assertEqual([(value["count"], value["rows"]) for _, value in sorted(statistics.iteritems())],
+                         [(1, 5), (1, 10), (1, 1), (3, 6)])
+        for value in statistics.itervalues():
+            self.assertLessEqual(value["p50"], value["p99"])
+            self.assertGreaterEqual(value["duration"], 0.0)
+
+        self._database.query_profiler.reset()
+        self.assertEqual(self._database.query_profiler.get_statistics(), {})
+
+        # the cursor itself is returned, the fetch methods count the rows as well
+        cursor = self._database.execute(u"SELECT id FROM item")
+        self.assertIsInstance(cursor, RowCountingCursor)
+        self.assertEqual(cursor.fetchone(), (1,))
+        self.assertEqual(len(cursor.fetchmany(2)), 2)
+        self.assertEqual(len(cursor.fetchall()), 2)
+        self.assertEqual(self._database.query_profiler.get_statistics()[u"SELECT id FROM item"]["rows"], 5)
+
+        # the rows are attributed to the statement that returned them
+        self._database.execute(u"SELECT id FROM item").next()
+        self.assertEqual(len(list(self._database.execute(u"SELECT id FROM item WHERE id > ?", (3,)))), 2)
+        statistics = self._database.query_profiler.get_statistics()
+        self.assertEqual(statistics[u"SELECT id FROM item"]["rows"], 6)
+        self.assertEqual(statistics[u"SELECT id FROM item WHERE id > ?"]["rows"], 2)
+
+        self._database.query_profiler.count_rows = False
+        self.assertEqual(len(list(self._database.execute(u"SELECT id FROM item"))), 5)
+        self.assertEqual(self._database.query_profiler.get_statistics()[u"SELECT id FROM item"]["rows"], 6)
+        self._database.query_profiler.count_rows = True
+        self._database.query_profiler.reset()
+
+        # a disabled profiler records nothing and returns the cursor itself
+        self._database.query_profiler.enabled = False
+        self.assertEqual(self._database.execute(u"SELECT COUNT(*) FROM item").next(), (5,))
+        self.assertEqual(self._database.query_profiler.get_statistics(), {})
+
+    def test_percentiles(self):
+        """
+        Testing that the p50 and p99 latencies are within a factor two of the actual latency.
+        """
+        profiler = QueryProfiler()
+        for _ in xrange(98):
+            profiler.record(u"SELECT 1", 0.001, None)
+        profiler.record(u"SELECT 1", 0.1, None)
+        profiler.record(u"SELECT 1", 1.0, None)
+        statistics = profiler.get_statistics()[u"SELECT ?"]
+        self.assertEqual(statistics["count"], 100)
+        self.assertAlmostEqual(statistics["duration"], 1.198)
+        self.assertTrue(0.001 / 2 <= statistics["p50"] <= 0.001 * 2, statistics["p50"])
+        self.assertTrue(0.1 / 2 <= statistics["p99"] <= 0.1 * 2, statistics["p99"])
+
+        # statements that complete within the timer resolution
+        profiler.record(u"SELECT id FROM item", 0.0, None)
+        self.assertTrue(0.0 < profiler.get_statistics()[u"SELECT id FROM item"]["p99"] < 0.001)
+
+    def test_benchmark(self, queries=10000):
+        """
+        Report the overhead of the profiler for a simple query, it may add at most half to the time
+        spent in Database.execute.  Most of it is spent measuring the time and counting the rows.
+        """
+        self._database.execute(u"INSERT INTO item (value) VALUES (?)", (u"value",))
+
+        # the median overhead of several rounds, each round measures the time with and without the
+        # profiler back to back, reduces the noise from other processes
+        ratios = []
+        for _ in xrange(15):
+            durations = []
+            for enabled in (False, True):
+                self._database.query_profiler.enabled = enabled
+                begin = time()
+                for _ in xrange(queries):
+                    self._database.execute(u"SELECT value FROM item WHERE id = ?", (1,)).next()
+                durations.append(time() - begin)
+            ratios.append(durations[1] / durations[0])
+        ratio = sorted(ratios)[len(ratios) / 2]
+
+        logger.info("%d queries: %.2f us/query without profiler, %.0f%% overhead with profiler",
+                    queries, 1000000.0 * durations[0] / queries, 100.0 * (ratio - 1.0))
+        self.assertEqual(self._database.query_profiler.get_statistics()[u"SELECT value FROM item WHERE id = ?"]["count"], 15 * queries)
+        self.assertLess(ratio, 1.5)
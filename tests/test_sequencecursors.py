@@ -0,0 +1,49 @@
+import logging
+logger = logging.getLogger(__name__)
+
+from sqlite3 import connect
+from unittest import TestCase
+
+from ..sequencecursors import SequenceCursors
+
+
+class TestSequenceCursors(TestCase):
+
+    def setUp(self):
+        self._database = connect(":memory:")
+        self._database.execute(u"CREATE TABLE sync(id INTEGER PRIMARY KEY, member INTEGER, global_time INTEGER, meta_message INTEGER)")
+        self._database.executemany(u"INSERT INTO sync (member, global_time, meta_message) VALUES (?, ?, ?)",
+                                   [(1, 10, 5), (1, 20, 5), (2, 15, 5), (1, 30, 6)])
+
+    def test_get(self):
+        """
+        Testing SequenceCursors.get, including members without any packets.
+        """
+        cursors = SequenceCursors(self._database)
+        self.assertEqual(cursors.get(5, [1, 2, 3]), {1: (20, 2), 2: (15, 1), 3: (0, 0)})
+        self.assertEqual(cursors.get(6, [1]), {1: (30, 1)})
+        self.assertEqual(len(cursors), 4)
+
+    def test_add_invalidate_check(self):
+        """
+        Testing SequenceCursors.add, SequenceCursors.invalidate, and SequenceCursors.check.
+        """
+        cursors = SequenceCursors(self._database)
+        cursors.get(5, [1, 3])
+
+        self._database.execute(u"INSERT INTO sync (member, global_time, meta_message) VALUES (?, ?, ?)", (3, 40, 5))
+        cursors.add(5, 3, 40)
+        # not cached, hence ignored
+        cursors.add(5, 2, 40)
+        self.assertEqual(cursors.get(5, [1, 2, 3]), {1: (20, 2), 2: (15, 1), 3: (40, 1)})
+        self.assertEqual(cursors.check(), 0)
+
+        # the database changed without updating the cursors
+        self._database.execute(u"DELETE FROM sync WHERE member = 1 AND global_time = 20")
+        self.assertEqual(cursors.check(), 1)
+        self.assertEqual(cursors.get(5, [1]), {1: (10, 1)})
+
+        cursors.invalidate(5, 1)
+        self.assertEqual(len(cursors), 2)
+        cursors.invalidate(5)
+        self.assertEqual(len(cursors), 0)
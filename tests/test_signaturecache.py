@@ -0,0 +1,44 @@
+import logging
+logger = logging.getLogger(__name__)
+
+from hashlib import sha1
+from unittest import TestCase
+
+from ..signaturecache import SignatureCache
+
+
+class TestSignatureCache(TestCase):
+
+    def test_get_add(self):
+        """
+        Testing SignatureCache.get and SignatureCache.add, including the hit and miss counters.
+        """
+        cache = SignatureCache()
+        digest = sha1("packet").digest()
+        self.assertIsNone(cache.get(digest))
+
+        cache.add(digest, ("key",))
+        self.assertEqual(cache.get(digest), ("key",))
+        self.assertIsNone(cache.get(sha1("other").digest()))
+        self.assertEqual((cache.hit, cache.miss), (1, 2))
+
+        cache.reset_statistics()
+        self.assertEqual((cache.hit, cache.miss), (0, 0))
+
+    def test_size(self):
+        """
+        Testing that SignatureCache removes the least recently used entry.
+        """
+        cache = SignatureCache(size=2)
+        digests = [sha1(str(index)).digest() for index in xrange(3)]
+        cache.add(digests[0], ("a",))
+        cache.add(digests[1], ("b",))
+
+        # use digests[0], making digests[1] the least recently used
+        self.assertEqual(cache.get(digests[0]), ("a",))
+        cache.add(digests[2], ("c",))
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get(digests[1]))
+        self.assertEqual(cache.get(digests[0]), ("a",))
+        self.assertEqual(cache.get(digests[2]), ("c",))
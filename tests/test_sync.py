@@ -3,6 +3,8 @@ logger = logging.getLogger(__name__)
 
 from random import random
 
+from ..dispersy import IntroductionRequestCache
+from ..syncresponsecache import SyncResponseCache
 from .debugcommunity.community import DebugCommunity
 from .debugcommunity.node import DebugNode
 from .dispersytestclass import DispersyTestFunc, call_on_dispersy_thread
@@ -42,6 +44,65 @@ class TestSync(DispersyTestFunc):
                 self.assertEqual(sorted(global_times), sorted(response_times))
                 logger.debug("%%%d+%d: %s -> OK", modulo, offset, sorted(global_times))
 
+    @call_on_dispersy_thread
+    def test_double_hashing_negotiation(self):
+        """
+        SELF only creates a double hashed sync bloom filter toward a candidate that indicated support
+        in its own introduction-request.
+        """
+        class DoubleHashingCommunity(DebugCommunity):
+
+            @property
+            def dispersy_sync_bloom_filter_double_hashing(self):
+                return True
+
+        community = DoubleHashingCommunity.create_community(self._dispersy, self._my_member)
+        community.create_full_sync_text("foo-bar", forward=False)
+
+        for double_hashing_support in (True, False):
+            node = DebugNode(community)
+            node.init_socket()
+            node.init_my_member()
+            node.give_message(node.create_dispersy_introduction_request(community.my_candidate, node.lan_address, node.wan_address, False, u"unknown", None, 42, 10, double_hashing_support=double_hashing_support))
+
+            candidate = community.get_candidate(node.lan_address)
+            self.assertEqual(candidate.double_hashing_support, double_hashing_support)
+
+            _, _, _, _, bloom_filter = community.dispersy_claim_sync_bloom_filter(IntroductionRequestCache(community, candidate))
+            self.assertEqual(bloom_filter.double_hashing, double_hashing_support)
+
+            # pretend that the bloom filter was useful, it will be reused unless the next candidate
+            # does not support double hashing
+            community._sync_cache.responses_received = 1
+
+    @call_on_dispersy_thread
+    def test_sync_response_cache(self):
+        """
+        NODE sends the same sync request twice.  The second request is answered from the sync
+        response cache, unless the packets in the window exceed the byte limit of one cache entry.
+        """
+        community = DebugCommunity.create_community(self._dispersy, self._my_member)
+        messages = [community.create_full_sync_text("sync response cache #%d" % i, forward=False) for i in xrange(10)]
+        window_bytes = sum(len(message.packet) for message in messages)
+
+        node = DebugNode(community)
+        node.init_socket()
+        node.init_my_member()
+
+        # the window also contains packets of other meta messages, such as dispersy-identity
+        for entry_bytes, hits in ((window_bytes * 4, 1), (window_bytes / 2, 0)):
+            community._sync_response_cache = SyncResponseCache(entry_bytes=entry_bytes)
+            community.statistics.sync_response_cache_hit = community.statistics.sync_response_cache_miss = 0
+
+            for identifier in (42, 43):
+                node.drop_packets()
+                node.give_message(node.create_dispersy_introduction_request(community.my_candidate, node.lan_address, node.wan_address, False, u"unknown", (1, 0, 1, 0, []), identifier, 10))
+                responses = node.receive_messages(message_names=[u"full-sync-text"])
+                self.assertEqual(sorted(message.packet for _, message in responses), sorted(message.packet for message in messages))
+
+            self.assertEqual(community.statistics.sync_response_cache_hit, hits)
+            self.assertEqual(community.statistics.sync_response_cache_miss, 2 - hits)
+
     @call_on_dispersy_thread
     def test_in_order(self):
         community = DebugCommunity.create_community(self._dispersy, self._my_member)
@@ -443,3 +504,35 @@ class TestSync(DispersyTestFunc):
             sync = (1, 0, m, o, [])
             node.give_message(node.create_dispersy_introduction_request(community.my_candidate, node.lan_address, node.wan_address, False, u"unknown", sync, 42, 10))
             node.drop_packets()
+
+    @call_on_dispersy_thread
+    def test_group_commit_forward(self):
+        """
+        With group commit enabled, SELF may only forward its own messages once they are committed.
+        Without group commit they are forwarded immediately.
+        """
+        community = DebugCommunity.create_community(self._dispersy, self._my_member)
+
+        forwarded = []
+        self._dispersy._forward = lambda messages: forwarded.extend(messages) or False
+        try:
+            # the result of the forward operation is returned
+            meta = community.get_meta_message(u"full-sync-text")
+            message = meta.impl(authentication=(community.my_member,),
+                                distribution=(community.claim_global_time(),),
+                                payload=("without group commit",))
+            self.assertFalse(self._dispersy.store_update_forward([message], True, True, True))
+            self.assertEqual(forwarded, [message])
+            del forwarded[:]
+
+            self._dispersy.enable_group_commit(max_latency=60.0, max_pending=100)
+            messages = [community.create_full_sync_text("group commit #%d" % i) for i in xrange(3)]
+            self.assertEqual(forwarded, [])
+            self.assertEqual(self._dispersy.database.group_commit_pending, 3)
+
+            self._dispersy.database.commit()
+            self.assertEqual(forwarded, messages)
+
+        finally:
+            self._dispersy.database.disable_group_commit()
+            del self._dispersy._forward
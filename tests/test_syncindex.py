@@ -0,0 +1,71 @@
+import logging
+logger = logging.getLogger(__name__)
+
+from random import Random
+from unittest import TestCase
+
+from ..syncindex import SyncIndex
+
+
+class TestSyncIndex(TestCase):
+
+    @staticmethod
+    def _select_and_fix(entries, global_time, to_select, higher):
+        """
+        Reference implementation, mirrors the SQL queries that were used before the SyncIndex.
+        """
+        if higher:
+            data = sorted(time for time, _ in entries if time > global_time)[:to_select + 1]
+        else:
+            data = sorted((time for time, _ in entries if time < global_time), reverse=True)[:to_select + 1]
+
+        fixed = False
+        if len(data) > to_select:
+            fixed = True
+            global_time = data[-1]
+            del data[-1]
+            while data and data[-1] == global_time:
+                del data[-1]
+
+        if not higher:
+            data.reverse()
+        return data, fixed
+
+    def test_select(self):
+        """
+        Testing SyncIndex.select against the reference implementation.
+        """
+        rand = Random(42)
+        entries = [(rand.randint(1, 500), rand.randint(1, 3)) for _ in xrange(1000)]
+        index = SyncIndex(entries)
+        self.assertEqual(len(index), len(entries))
+
+        for global_time in (0, 1, 100, 250, 499, 500, 501):
+            for to_select in (1, 10, 100, 2000):
+                for higher in (True, False):
+                    self.assertEqual(index.select(global_time, to_select, higher),
+                                     self._select_and_fix(entries, global_time, to_select, higher))
+
+    def test_add_remove(self):
+        """
+        Testing SyncIndex.add and SyncIndex.remove.
+        """
+        index = SyncIndex()
+        index.add(10, 1)
+        index.add(10, 1)
+        index.add(5, 2)
+        self.assertEqual(len(index), 3)
+        self.assertEqual(index.select(0, 10), ([5, 10, 10], False))
+
+        self.assertTrue(index.remove(10, 1))
+        self.assertFalse(index.remove(10, 2))
+        self.assertEqual(index.select(0, 10), ([5, 10], False))
+
+    def test_prune(self):
+        """
+        Testing SyncIndex.prune.
+        """
+        index = SyncIndex([(time, meta) for time in xrange(1, 11) for meta in (1, 2)])
+        index.prune(1, 5)
+        self.assertEqual(len(index), 15)
+        self.assertEqual(index.select(0, 100), ([1, 2, 3, 4, 5] + sorted(range(6, 11) * 2), False))
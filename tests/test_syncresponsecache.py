@@ -0,0 +1,95 @@
+import logging
+logger = logging.getLogger(__name__)
+
+from time import sleep
+from unittest import TestCase
+
+from ..syncresponsecache import SyncResponseCache
+
+
+class TestSyncResponseCache(TestCase):
+
+    def test_get_set(self):
+        """
+        Testing SyncResponseCache.get and SyncResponseCache.set, including expiration.
+        """
+        cache = SyncResponseCache(0.1)
+        windows = ((1, 1, 100, 0, 1), (2, 50, 100, 0, 1))
+        self.assertIsNone(cache.get(windows))
+
+        cache.set(windows, ["a", "b"])
+        self.assertEqual(cache.get(windows), ["a", "b"])
+        self.assertIsNone(cache.get(((1, 1, 100, 0, 1),)))
+
+        sleep(0.15)
+        self.assertIsNone(cache.get(windows))
+        self.assertEqual(len(cache), 0)
+
+    def test_size(self):
+        """
+        Testing that SyncResponseCache keeps at most SIZE entries.
+        """
+        cache = SyncResponseCache(size=2)
+        for time_low in xrange(1, 4):
+            cache.set(((1, time_low, 100, 0, 1),), [])
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get(((1, 1, 100, 0, 1),)))
+        self.assertEqual(cache.get(((1, 3, 100, 0, 1),)), [])
+
+    def test_invalidate(self):
+        """
+        Testing SyncResponseCache.invalidate and SyncResponseCache.prune.
+        """
+        cache = SyncResponseCache()
+        even = ((1, 1, 100, 0, 2), (2, 50, 100, 0, 2))
+        odd = ((1, 1, 100, 1, 2), (2, 50, 100, 1, 2))
+        cache.set(even, [])
+        cache.set(odd, [])
+
+        # outside every window
+        cache.invalidate(1, 101)
+        cache.invalidate(2, 10)
+        cache.invalidate(3, 10)
+        self.assertEqual(len(cache), 2)
+
+        # only in the odd window
+        cache.invalidate(2, 51)
+        self.assertIsNone(cache.get(odd))
+        self.assertEqual(cache.get(even), [])
+
+        cache.prune(2, 49)
+        self.assertEqual(len(cache), 1)
+        cache.prune(2, 50)
+        self.assertEqual(len(cache), 0)
+
+    def test_bytes(self):
+        """
+        Testing that SyncResponseCache keeps at most MAX_BYTES bytes and does not store entries
+        larger than ENTRY_BYTES.
+        """
+        cache = SyncResponseCache(max_bytes=10, entry_bytes=6)
+        self.assertFalse(cache.set(((1, 1, 100, 0, 1),), ["abcd", "efg"]))
+        self.assertIsNone(cache.get(((1, 1, 100, 0, 1),)))
+
+        self.assertTrue(cache.set(((1, 1, 100, 0, 1),), ["abcd"]))
+        self.assertTrue(cache.set(((1, 2, 100, 0, 1),), ["abcd"]))
+        self.assertEqual(cache.bytes, 8)
+        # the entry that expires first is removed
+        self.assertTrue(cache.set(((1, 3, 100, 0, 1),), ["abc"]))
+        self.assertEqual(cache.bytes, 7)
+        self.assertIsNone(cache.get(((1, 1, 100, 0, 1),)))
+
+        cache.clear()
+        self.assertEqual(cache.bytes, 0)
+
+    def test_unbounded_window(self):
+        """
+        Testing that SyncResponseCache.invalidate treats a time_high of zero as unbounded.
+        """
+        cache = SyncResponseCache()
+        windows = ((1, 50, 0, 0, 1),)
+        cache.set(windows, [])
+        cache.invalidate(1, 49)
+        self.assertEqual(cache.get(windows), [])
+        cache.invalidate(1, 1000)
+        self.assertIsNone(cache.get(windows))
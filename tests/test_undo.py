@@ -1,7 +1,9 @@
 import logging
 logger = logging.getLogger(__name__)
 
+from ..distribution import SyncDistribution
 from ..message import Message
+from ..syncindex import SyncIndex
 from .debugcommunity.community import DebugCommunity
 from .debugcommunity.node import DebugNode
 from .dispersytestclass import DispersyTestFunc, call_on_dispersy_thread
@@ -47,6 +49,81 @@ class TestUndo(DispersyTestFunc):
         community.create_dispersy_destroy_community(u"hard-kill", forward=False)
         self._dispersy.get_community(community.cid).unload_community()
 
+    @call_on_dispersy_thread
+    def test_undo_sync_index(self):
+        """
+        SELF undoes a message, the in-memory sync index is updated rather than loaded again.
+        """
+        community = DebugCommunity.create_community(self._dispersy, self._my_member)
+        messages = [community.create_full_sync_text("Should undo #%d" % i, forward=False) for i in xrange(5)]
+
+        syncable_messages = u", ".join(unicode(meta.database_id) for meta in community.get_meta_messages() if isinstance(meta.distribution, SyncDistribution) and meta.distribution.priority > 32)
+        sync_index = community._get_sync_index(syncable_messages)
+
+        community.create_dispersy_undo(messages[0], forward=False)
+        self.assertIs(community._get_sync_index(syncable_messages), sync_index)
+        expected = SyncIndex(self._dispersy.database.execute(u"SELECT global_time, meta_message FROM sync WHERE meta_message IN (%s) AND undone = 0" % syncable_messages))
+        self.assertEqual(sync_index._entries, expected._entries)
+
+        # cleanup
+        community.create_dispersy_destroy_community(u"hard-kill", forward=False)
+        self._dispersy.get_community(community.cid).unload_community()
+
+    @call_on_dispersy_thread
+    def test_undo_duplicate_index(self):
+        """
+        SELF undoes a message, only its digest is removed from the duplicate index.  The index never
+        grows beyond dispersy_duplicate_index_size.
+        """
+        community = DebugCommunity.create_community(self._dispersy, self._my_member)
+        messages = [community.create_full_sync_text("Should undo #%d" % i, forward=False) for i in xrange(5)]
+
+        duplicate_index = community._get_duplicate_index()
+        self.assertTrue(all(community.is_duplicate_packet(message.packet_digest) for message in messages))
+
+        undo = community.create_dispersy_undo(messages[0], forward=False)
+        self.assertIs(community._get_duplicate_index(), duplicate_index)
+        self.assertFalse(community.is_duplicate_packet(messages[0].packet_digest))
+        self.assertTrue(all(community.is_duplicate_packet(message.packet_digest) for message in messages[1:] + [undo]))
+
+        # a full index is not extended, the most recent packets are loaded
+        community._duplicate_index_size = len(duplicate_index)
+        message = community.create_full_sync_text("Not in the index", forward=False)
+        self.assertFalse(community.is_duplicate_packet(message.packet_digest))
+        community.dispersy_invalidate_sync()
+        self.assertEqual(len(community._get_duplicate_index()), community._duplicate_index_size)
+        self.assertTrue(community.is_duplicate_packet(message.packet_digest))
+
+        # cleanup
+        community.create_dispersy_destroy_community(u"hard-kill", forward=False)
+        self._dispersy.get_community(community.cid).unload_community()
+
+    @call_on_dispersy_thread
+    def test_undo_sequence_cursors(self):
+        """
+        SELF undoes a message with a sequence number, the sequence cursors are kept because their
+        counts include undone packets.
+        """
+        community = DebugCommunity.create_community(self._dispersy, self._my_member)
+        meta = community.get_meta_message(u"sequence-text")
+        messages = [community.create_sequence_text("Should undo #%d" % i, forward=False) for i in xrange(5)]
+
+        member = community.my_member.database_id
+        self.assertEqual(community.sequence_cursors.get(meta.database_id, [member]), {member: (messages[-1].distribution.global_time, 5)})
+        cached = len(community.sequence_cursors)
+
+        community.create_dispersy_undo(messages[2], forward=False)
+        self.assertEqual(len(community.sequence_cursors), cached)
+        self.assertEqual(community.sequence_cursors.get(meta.database_id, [member]), {member: (messages[-1].distribution.global_time, 5)})
+
+        # the next message continues the sequence
+        message = community.create_sequence_text("After undo", forward=False)
+        self.assertEqual(message.distribution.sequence_number, 6)
+
+        # cleanup
+        community.create_dispersy_destroy_community(u"hard-kill", forward=False)
+        self._dispersy.get_community(community.cid).unload_community()
+
     @call_on_dispersy_thread
     def test_self_undo_other(self):
         """
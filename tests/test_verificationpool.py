@@ -0,0 +1,36 @@
+import logging
+logger = logging.getLogger(__name__)
+
+from hashlib import sha1
+from unittest import TestCase
+
+from ..crypto import ec_generate_key, ec_sign, ec_to_public_bin
+from ..verificationpool import VerificationPool
+
+
+class TestVerificationPool(TestCase):
+
+    def test_verify(self):
+        """
+        Testing that VerificationPool.verify accepts valid signatures and rejects invalid ones.
+        """
+        ec = ec_generate_key(u"low")
+        public_key = ec_to_public_bin(ec)
+        triples = []
+        expected = []
+        for index in xrange(20):
+            digest = sha1(str(index)).digest()
+            signature = ec_sign(ec, digest)
+            if index % 3 == 0:
+                # sign something else
+                signature = ec_sign(ec, sha1("invalid").digest())
+            triples.append((public_key, digest, signature))
+            expected.append(index % 3 != 0)
+
+        pool = VerificationPool(2)
+        try:
+            # inline and in the child processes
+            self.assertEqual(pool.verify(triples[:2]), expected[:2])
+            self.assertEqual(pool.verify(triples), expected)
+        finally:
+            pool.close()
@@ -63,9 +63,9 @@ else:
 
 class BinaryTrackerConversion(BinaryConversion):
 
-    def decode_message(self, candidate, data, _=None):
+    def decode_message(self, candidate, data, verify=None, lazy=False, digest=None):
         # disable verify
-        return self._decode_message(candidate, data, False, False)
+        return self._decode_message(candidate, data, False, False, lazy, digest)
 
 
 class TrackerHardKilledCommunity(HardKilledCommunity):
@@ -312,7 +312,7 @@ class TrackerDispersy(Dispersy):
                 return True
 
             # check 2: does the community have any cached messages waiting to be processed
-            for meta in self._batch_cache.iterkeys():
+            for meta in self._batch_scheduler:
                 if meta.community == community:
                     return True
 
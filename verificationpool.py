@@ -0,0 +1,75 @@
+"""
+This module provides a process pool to verify many signatures in parallel.
+
+Verifying EC signatures is CPU bound and, because of the global interpreter lock, can not be spread
+over multiple threads.  The VerificationPool verifies (public key, digest, signature) triples in
+child processes instead.
+"""
+
+import logging
+logger = logging.getLogger(__name__)
+
+from multiprocessing import Pool, cpu_count
+
+from .crypto import ec_from_public_bin, ec_verify
+
+# public key:EC cache, one for each child process
+_ec_cache = {}
+
+
+def _verify(triple):
+    """
+    Returns True when the signature in the (public key, digest, signature) TRIPLE is valid.
+
+    Called in a child process.
+    """
+    public_key, digest, signature = triple
+    try:
+        ec = _ec_cache.get(public_key)
+        if ec is None:
+            if len(_ec_cache) > 1024:
+                _ec_cache.clear()
+            ec = _ec_cache[public_key] = ec_from_public_bin(public_key)
+        return bool(ec_verify(ec, digest, signature))
+    except Exception:
+        return False
+
+
+class VerificationPool(object):
+
+    def __init__(self, processes=0, min_batch_size=0):
+        """
+        Create a pool with PROCESSES child processes, by default one for each CPU.
+
+        Batches with less than MIN_BATCH_SIZE triples, by default twice the number of processes,
+        are not worth the inter process communication and are verified on the calling thread.
+        """
+        assert isinstance(processes, int), type(processes)
+        assert 0 <= processes, processes
+        assert isinstance(min_batch_size, int), type(min_batch_size)
+        self._processes = processes or cpu_count()
+        self._min_batch_size = min_batch_size or 2 * self._processes
+        self._pool = Pool(self._processes)
+        logger.debug("started %d verification processes", self._processes)
+
+    @property
+    def processes(self):
+        return self._processes
+
+    def verify(self, triples):
+        """
+        Returns a list with a boolean for every (public key, digest, signature) triple in TRIPLES,
+        True when the signature is valid.
+        """
+        assert isinstance(triples, list), type(triples)
+        if len(triples) < self._min_batch_size:
+            return [_verify(triple) for triple in triples]
+        return self._pool.map(_verify, triples, max(1, len(triples) // self._processes))
+
+    def close(self):
+        """
+        Stop all child processes.
+        """
+        self._pool.terminate()
+        self._pool.join()
+        return True